@@ -1,64 +1,289 @@
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
 from django.contrib import admin
-from .models import Customer, Purchase, ActivityLog
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404
+from django.shortcuts import redirect, render
+from django.urls import path
+from django.contrib.admin.views.main import ChangeList
+from .admin_filters import AutocompleteFilter, AutocompleteFilterMixin, EstimatedCountPaginator, ShardFilter
+from .forms import CustomerChoiceField, CustomerImportForm
+from .jobs import enqueue
+from .models import ArchivedPurchase, Branch, ChangeEvent, ChangeFeedOffset, Customer, CustomerToken, Purchase, ActivityLog, Job, LoginSession, Notification, ProfilingRule, UserProfile, WalletDebit
+from .profiling import get_profile, list_profiles, rule_cache, summarize
+from .sharding import shard_for_pk
 import jdatetime
 from django.utils import timezone
-import pytz
 
 
-class CustomerAdmin(admin.ModelAdmin):
+@lru_cache(maxsize=2048)
+def _jalali_date(date):
+    return jdatetime.date.fromgregorian(date=date).strftime('%Y/%m/%d')
+
+
+def format_jalali(value, time_format='%H:%M'):
+    """Jalali date and time; the calendar conversion is cached per day since changelist rows share dates."""
+    if not value:
+        return '-'
+    if timezone.is_aware(value):
+        value = timezone.localtime(value)
+    return f"{_jalali_date(value.date())} {value.strftime(time_format)}"
+
+
+class CustomerFilter(AutocompleteFilter):
+    field_name = 'customer'
+
+
+class UserFilter(AutocompleteFilter):
+    field_name = 'user'
+
+
+class LargeTableAdmin(AutocompleteFilterMixin, admin.ModelAdmin):
+    """Changelist settings for tables with millions of rows."""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_per_page = 50
+    list_max_show_all = 200
+
+
+class ShardedAdminMixin:
+    """
+    Admin of a sharded model: the changelist reads one shard at a time (see
+    ShardFilter), rows are opened on the shard their id belongs to and
+    customer foreign keys are resolved on the customer's shard.
+    """
+
+    def get_list_filter(self, request):
+        return [ShardFilter, *super().get_list_filter(request)]
+
+    def get_object(self, request, object_id, from_field=None):
+        if from_field is not None and from_field != self.model._meta.pk.attname:
+            return super().get_object(request, object_id, from_field)
+        alias = shard_for_pk(object_id) if str(object_id).isdigit() else None
+        if alias is None:
+            return None
+        return self.get_queryset(request).using(alias).filter(pk=object_id).first()
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'customer':
+            kwargs['form_class'] = CustomerChoiceField
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+class BranchAdmin(admin.ModelAdmin):
+    list_display = ['name', 'code', 'is_active', 'created_at']
+    list_filter = ['is_active']
+    search_fields = ['name', 'code']
+
+    def has_delete_permission(self, request, obj=None):
+        # Customers and purchases on the shards keep pointing at it; deactivate instead
+        return False
+
+
+class UserProfileAdmin(admin.ModelAdmin):
+    list_display = ['user', 'user_type', 'branch']
+    list_filter = ['user_type', 'branch']
+    list_select_related = ['user', 'branch']
+
+
+class CustomerAdmin(ShardedAdminMixin, LargeTableAdmin):
+    change_list_template = 'admin/cashback_app/customer/change_list.html'
     list_display = ['first_name', 'last_name', 'national_code', 'phone_number', 'wallet_balance', 'formatted_created_at', 'formatted_updated_at']
     search_fields = ['first_name', 'last_name', 'national_code', 'phone_number']
-    list_filter = ['created_at']
+    list_filter = ['created_at', 'branch']
+    date_hierarchy = 'created_at'
+    ordering = ['-pk']
 
     def formatted_created_at(self, obj):
-        if obj.created_at:
-            jdate = jdatetime.datetime.fromgregorian(datetime=obj.created_at)
-            return jdate.strftime('%Y/%m/%d %H:%M')
-        return '-'
+        return format_jalali(obj.created_at)
     formatted_created_at.short_description = 'تاریخ ثبت'
     formatted_created_at.admin_order_field = 'created_at'
 
     def formatted_updated_at(self, obj):
-        if obj.updated_at:
-            jdate = jdatetime.datetime.fromgregorian(datetime=obj.updated_at)
-            return jdate.strftime('%Y/%m/%d %H:%M')
-        return '-'
+        return format_jalali(obj.updated_at)
     formatted_updated_at.short_description = 'تاریخ بروزرسانی'
     formatted_updated_at.admin_order_field = 'updated_at'
 
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_view), name='cashback_app_customer_import'),
+        ] + super().get_urls()
 
-class PurchaseAdmin(admin.ModelAdmin):
+    def import_view(self, request):
+        """Upload a customer file and hand it to the background import job."""
+        if not self.has_add_permission(request):
+            raise PermissionDenied
+        form = CustomerImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            upload_dir = Path(settings.IMPORT_UPLOAD_DIR)
+            upload_dir.mkdir(parents=True, exist_ok=True)
+            path = upload_dir / f"{uuid.uuid4().hex}{Path(upload.name).suffix.lower()}"
+            with open(path, 'wb') as f:
+                for chunk in upload.chunks():
+                    f.write(chunk)
+            # A retry would report the first attempt's rows as duplicates
+            job = enqueue('customer_import', payload={'path': str(path), 'user_id': request.user.pk},
+                          user=request.user, max_attempts=1)
+            return redirect('job_detail', pk=job.pk)
+        context = {
+            **self.admin_site.each_context(request),
+            'title': 'ورود گروهی مشتریان',
+            'opts': self.model._meta,
+            'form': form,
+        }
+        return render(request, 'admin/cashback_app/customer/import.html', context)
+
+
+class PurchaseAdmin(ShardedAdminMixin, LargeTableAdmin):
     list_display = ['customer', 'amount', 'cashback_amount', 'formatted_created_at']
-    list_filter = ['created_at', 'customer']
+    list_filter = ['created_at', 'branch', CustomerFilter]
     search_fields = ['customer__first_name', 'customer__last_name', 'customer__national_code']
+    # Purchases live on their customer's shard, so this join never crosses databases
+    list_select_related = ['customer']
+    date_hierarchy = 'created_at'
+    raw_id_fields = ['customer']
 
     def formatted_created_at(self, obj):
-        if obj.created_at:
-            jdate = jdatetime.datetime.fromgregorian(datetime=obj.created_at)
-            return jdate.strftime('%Y/%m/%d %H:%M')
-        return '-'
+        return format_jalali(obj.created_at)
     formatted_created_at.short_description = 'تاریخ ثبت'
     formatted_created_at.admin_order_field = 'created_at'
 
 
-class ActivityLogAdmin(admin.ModelAdmin):
+class ArchivedPurchaseAdmin(ShardedAdminMixin, LargeTableAdmin):
+    list_display = ['purchase_id', 'customer', 'amount', 'cashback_amount', 'formatted_created_at']
+    list_filter = [CustomerFilter]
+    search_fields = ['=purchase_id']
+    list_select_related = ['customer']
+    readonly_fields = ['purchase_id', 'customer', 'amount', 'cashback_amount', 'created_at', 'created_by',
+                       'branch', 'archived_at']
+
+    def formatted_created_at(self, obj):
+        return format_jalali(obj.created_at)
+    formatted_created_at.short_description = 'تاریخ ثبت'
+    formatted_created_at.admin_order_field = 'created_at'
+
+    def has_add_permission(self, request):
+        # Rows are moved here by `manage.py archive_purchases`
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        # Monthly summaries already count these purchases
+        return False
+
+
+class ChangeEventAdmin(ShardedAdminMixin, LargeTableAdmin):
+    list_display = ['id', 'entity', 'entity_id', 'operation', 'formatted_created_at']
+    list_filter = ['entity', 'operation']
+    search_fields = ['=entity_id']
+    readonly_fields = ['entity', 'entity_id', 'operation', 'data', 'created_at']
+    ordering = ['-id']
+
+    def formatted_created_at(self, obj):
+        return format_jalali(obj.created_at, '%H:%M:%S')
+    formatted_created_at.short_description = 'زمان تغییر'
+    formatted_created_at.admin_order_field = 'created_at'
+
+    def has_add_permission(self, request):
+        # Events are written by the changes themselves
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+class ChangeFeedOffsetAdmin(admin.ModelAdmin):
+    list_display = ['consumer', 'shard', 'last_event_id', 'events_delivered', 'formatted_delivered_at']
+    list_filter = ['consumer']
+    # Lowering last_event_id makes relay_changes send the events after it again
+    readonly_fields = ['consumer', 'shard', 'events_delivered', 'delivered_at']
+
+    def formatted_delivered_at(self, obj):
+        return format_jalali(obj.delivered_at, '%H:%M:%S')
+    formatted_delivered_at.short_description = 'آخرین تحویل'
+    formatted_delivered_at.admin_order_field = 'delivered_at'
+
+    def has_add_permission(self, request):
+        # Offsets are created by relay_changes
+        return False
+
+
+class WalletDebitAdmin(ShardedAdminMixin, admin.ModelAdmin):
+    list_display = ['customer', 'amount', 'reason', 'created_by', 'formatted_created_at']
+    search_fields = ['customer__first_name', 'customer__last_name', 'customer__national_code', 'reason']
+    readonly_fields = ['customer', 'amount', 'reason', 'activity_log_id', 'created_by', 'created_at']
+
+    def formatted_created_at(self, obj):
+        return format_jalali(obj.created_at)
+    formatted_created_at.short_description = 'تاریخ ثبت'
+    formatted_created_at.admin_order_field = 'created_at'
+
+    def has_add_permission(self, request):
+        # Debits are recorded through the wallet reduction page
+        return False
+
+
+class NotificationAdmin(ShardedAdminMixin, LargeTableAdmin):
+    list_display = ['phone_number', 'kind', 'status', 'attempts', 'formatted_created_at', 'sent_at']
+    list_filter = ['status', 'kind']
+    search_fields = ['phone_number', 'dedup_key']
+    raw_id_fields = ['customer']
+    readonly_fields = ['customer', 'kind', 'dedup_key', 'phone_number', 'text', 'attempts', 'locked_by',
+                       'locked_until', 'provider_message_id', 'error', 'created_at', 'sent_at']
+    actions = ['retry_now']
+
+    def formatted_created_at(self, obj):
+        return format_jalali(obj.created_at)
+    formatted_created_at.short_description = 'تاریخ ایجاد'
+    formatted_created_at.admin_order_field = 'created_at'
+
+    def has_add_permission(self, request):
+        # Notifications are queued by wallet changes
+        return False
+
+    @admin.action(description='ارسال دوباره پیامک‌های انتخاب شده')
+    def retry_now(self, request, queryset):
+        updated = queryset.exclude(status='sent').update(
+            status='pending', next_attempt_at=timezone.now(), attempts=0, error=''
+        )
+        self.message_user(request, f'{updated} پیامک دوباره در صف قرار گرفت')
+
+
+class ActivityLogChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        # One query per shard for the page's customers instead of one per row
+        customer_ids = {log.customer_id for log in self.result_list if log.customer_id}
+        by_shard = {}
+        for customer_id in customer_ids:
+            by_shard.setdefault(shard_for_pk(customer_id), []).append(customer_id)
+        customers = {}
+        for alias, ids in by_shard.items():
+            if alias is not None:
+                customers.update(Customer.objects.using(alias).in_bulk(ids))
+        for log in self.result_list:
+            if log.customer_id:
+                log._state.fields_cache['customer'] = customers.get(log.customer_id)
+
+
+class ActivityLogAdmin(LargeTableAdmin):
     list_display = ['user', 'activity_type', 'customer', 'description', 'ip_address', 'formatted_created_at']
-    list_filter = ['activity_type', 'created_at', 'user']
+    list_filter = ['activity_type', 'created_at', 'branch', UserFilter, CustomerFilter]
     search_fields = ['user__username', 'description', 'customer__first_name', 'customer__last_name', 'customer__national_code']
-    readonly_fields = ['user', 'activity_type', 'customer', 'description', 'ip_address', 'created_at']
+    readonly_fields = ['user', 'activity_type', 'customer', 'description', 'ip_address', 'branch', 'created_at']
     ordering = ['-created_at']
-    
+    # Customers may live on shard databases; they are batch-loaded per page instead
+    list_select_related = ['user']
+    date_hierarchy = 'created_at'
+
+    def get_changelist(self, request, **kwargs):
+        return ActivityLogChangeList
+
     def formatted_created_at(self, obj):
-        if obj.created_at:
-            # Convert to Tehran timezone
-            tehran_tz = pytz.timezone('Asia/Tehran')
-            if timezone.is_aware(obj.created_at):
-                local_time = obj.created_at.astimezone(tehran_tz)
-            else:
-                local_time = obj.created_at
-            jdate = jdatetime.datetime.fromgregorian(datetime=local_time)
-            return jdate.strftime('%Y/%m/%d %H:%M:%S')
-        return '-'
+        return format_jalali(obj.created_at, '%H:%M:%S')
     formatted_created_at.short_description = 'تاریخ و زمان'
     formatted_created_at.admin_order_field = 'created_at'
     
@@ -75,6 +300,96 @@ class ActivityLogAdmin(admin.ModelAdmin):
         return request.user.is_superuser
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'kind', 'status', 'progress', 'attempts', 'created_by', 'created_at', 'finished_at']
+    list_filter = ['status', 'kind']
+    readonly_fields = ['kind', 'payload', 'status', 'progress', 'progress_message', 'attempts', 'max_attempts',
+                       'run_after', 'locked_by', 'locked_until', 'result_file', 'error', 'created_by',
+                       'created_at', 'started_at', 'finished_at']
+    list_select_related = ['created_by']
+
+    def has_add_permission(self, request):
+        # Jobs are queued by the application, not by hand
+        return False
+
+
+class LoginSessionAdmin(admin.ModelAdmin):
+    list_display = ['user', 'ip_address', 'started_at', 'last_seen_at', 'ended_at']
+    list_filter = ['user']
+    readonly_fields = ['user', 'session_key', 'ip_address', 'started_at', 'last_seen_at', 'ended_at']
+    list_select_related = ['user']
+
+    def has_add_permission(self, request):
+        # Sessions are recorded on login
+        return False
+
+
+class CustomerTokenAdmin(admin.ModelAdmin):
+    list_display = ['token', 'kind', 'customer_id', 'is_active', 'created_at']
+    list_filter = ['kind', 'is_active']
+    search_fields = ['token']
+    # Customers may live on shard databases, so the FK is edited as a raw id
+    raw_id_fields = ['customer']
+
+
+class ProfilingRuleAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'view_name', 'user', 'sample_rate', 'mode', 'is_active', 'expires_at']
+    list_filter = ['mode', 'is_active']
+    list_editable = ['is_active']
+    change_list_template = 'admin/cashback_app/profilingrule/change_list.html'
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Other processes pick the change up within PROFILING_RULES_TTL seconds
+        rule_cache.clear()
+
+    def get_urls(self):
+        return [
+            path('profiles/', self.admin_site.admin_view(self.profiles_view),
+                 name='cashback_app_profilingrule_profiles'),
+            path('profiles/<str:name>/', self.admin_site.admin_view(self.profile_view),
+                 name='cashback_app_profilingrule_profile'),
+        ] + super().get_urls()
+
+    def _context(self, request, title, **extra):
+        return {
+            **self.admin_site.each_context(request),
+            'title': title,
+            'opts': self.model._meta,
+            **extra,
+        }
+
+    def profiles_view(self, request):
+        """Stored profiles, newest first."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        context = self._context(request, 'پروفایل‌های ذخیره شده', profiles=list_profiles())
+        return render(request, 'admin/cashback_app/profilingrule/profiles.html', context)
+
+    def profile_view(self, request, name):
+        """Summary of one profile; ?download=1 returns the raw file for flame graph tools."""
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        profile = get_profile(name)
+        if profile is None:
+            raise Http404
+        if request.GET.get('download'):
+            return FileResponse(open(profile['path'], 'rb'), as_attachment=True, filename=profile['file'])
+        context = self._context(request, f"پروفایل {profile['name']}", profile=profile, summary=summarize(profile))
+        return render(request, 'admin/cashback_app/profilingrule/profile.html', context)
+
+
+admin.site.register(Branch, BranchAdmin)
+admin.site.register(UserProfile, UserProfileAdmin)
 admin.site.register(Customer, CustomerAdmin)
 admin.site.register(Purchase, PurchaseAdmin)
-admin.site.register(ActivityLog, ActivityLogAdmin)
\ No newline at end of file
+admin.site.register(ArchivedPurchase, ArchivedPurchaseAdmin)
+admin.site.register(WalletDebit, WalletDebitAdmin)
+admin.site.register(Notification, NotificationAdmin)
+admin.site.register(ChangeEvent, ChangeEventAdmin)
+admin.site.register(ChangeFeedOffset, ChangeFeedOffsetAdmin)
+admin.site.register(ActivityLog, ActivityLogAdmin)
+admin.site.register(Job, JobAdmin)
+admin.site.register(LoginSession, LoginSessionAdmin)
+admin.site.register(CustomerToken, CustomerTokenAdmin)
+admin.site.register(ProfilingRule, ProfilingRuleAdmin)
@@ -0,0 +1,151 @@
+"""
+Admin helpers for changelists over very large tables.
+"""
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .sharding import is_sharded, is_sharded_model, shard_aliases, shard_for_pk
+
+
+class AutocompleteFilter(admin.ListFilter):
+    """
+    Sidebar filter on a foreign key that searches the related admin through
+    the autocomplete view instead of listing every related row. Subclasses set
+    ``field_name``; the related model's admin needs ``search_fields``.
+    """
+    template = 'admin/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.field = model._meta.get_field(self.field_name)
+        self.title = self.field.verbose_name
+        self.parameter_name = f'{self.field_name}__{self.field.target_field.name}__exact'
+        self.model_admin = model_admin
+        super().__init__(request, params, model, model_admin)
+        if self.parameter_name in params:
+            self.used_parameters[self.parameter_name] = params.pop(self.parameter_name)
+
+    @property
+    def value(self):
+        return self.used_parameters.get(self.parameter_name)
+
+    def has_output(self):
+        return True
+
+    def expected_parameters(self):
+        return [self.parameter_name]
+
+    def queryset(self, request, queryset):
+        if self.value:
+            return queryset.filter(**{self.field.attname: self.value})
+        return queryset
+
+    def widget(self):
+        remote_model = self.field.remote_field.model
+        using = None
+        if self.value and self.value.isdigit() and is_sharded_model(remote_model):
+            using = shard_for_pk(self.value)
+        widget = AutocompleteSelect(self.field, self.model_admin.admin_site, using=using)
+        form_field = forms.ModelChoiceField(queryset=remote_model._default_manager.all(), widget=widget,
+                                            required=False)
+        return form_field.widget
+
+    def choices(self, changelist):
+        yield {
+            'widget': self.widget().render(self.parameter_name, self.value, attrs={'id': self.parameter_name}),
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+        }
+
+
+class ShardFilter(admin.SimpleListFilter):
+    """
+    Which shard database a changelist of sharded rows reads. A changelist is
+    one query on one database, so it shows the first shard until another one
+    is chosen; there is no "all shards" choice.
+    """
+    title = 'پایگاه داده'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shard_aliases()]
+
+    def has_output(self):
+        return is_sharded()
+
+    def alias(self):
+        return self.value() if self.value() in shard_aliases() else shard_aliases()[0]
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.alias())
+
+    def choices(self, changelist):
+        for alias, title in self.lookup_choices:
+            yield {
+                'selected': self.alias() == alias,
+                'query_string': changelist.get_query_string({self.parameter_name: alias}),
+                'display': title,
+            }
+
+
+class AutocompleteFilterMixin:
+    """Adds the autocomplete widget's scripts to changelists that use AutocompleteFilter."""
+
+    @property
+    def media(self):
+        return super().media + AutocompleteSelect(None, self.admin_site).media
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that reads the planner's row estimate instead of running
+    COUNT(*) when the changelist is unfiltered. Filtered querysets are still
+    counted exactly, since filters narrow them through indexes.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_row_count(queryset.model, queryset.db)
+            if estimate is not None:
+                return estimate
+        return super().count
+
+
+# Tables whose id span is below this are counted exactly on SQLite
+EXACT_COUNT_LIMIT = 1_000_000
+
+
+def estimate_row_count(model, using):
+    """Approximate row count of a model's table, or None if it should be counted exactly."""
+    connection = connections[using]
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+            row = cursor.fetchone()
+            # reltuples is -1 (or 0) until the table has been analyzed
+            return row[0] if row and row[0] > 0 else None
+        if connection.vendor == 'sqlite':
+            # Ids are never reused, so the id span is an upper bound read from the
+            # index; archiving and merges leave gaps that make it overshoot, so
+            # tables it shows to be small enough are counted exactly
+            cursor.execute(f"SELECT MIN(id), MAX(id) FROM {connection.ops.quote_name(table)}")
+            low, high = cursor.fetchone()
+            if low is None:
+                return 0
+            if high - low + 1 <= EXACT_COUNT_LIMIT:
+                return None
+            # Row counts recorded by the last ANALYZE, if any; partial indexes hold fewer rows
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+            if cursor.fetchone():
+                cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+                analyzed = [int(stat.split()[0]) for stat, in cursor.fetchall()]
+                if analyzed:
+                    return max(analyzed)
+            return high - low + 1
+    return None
@@ -0,0 +1,112 @@
+"""
+Vectorized helpers over the columnar purchase store (see columnar.py).
+
+Everything works on plain NumPy arrays, so the helpers can be used on one
+shard's memory maps or on all shards concatenated.
+"""
+import numpy as np
+
+SECONDS_PER_DAY = 86400
+# Keys spanning at most this many slots per row are summed with bincount
+DENSE_KEY_FACTOR = 4
+
+
+def group_sum(keys, *values):
+    """
+    Sum each value array per distinct key. Returns (unique_keys, counts, sums...)
+    in key order. Sums stay in int64, so rial totals are exact.
+    """
+    if len(keys) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return (empty, empty) + tuple(empty for _ in values)
+    low, high = int(keys.min()), int(keys.max())
+    if high - low <= DENSE_KEY_FACTOR * len(keys) and all(_fits_float(value) for value in values):
+        return _dense_group_sum(keys, low, high, values)
+    order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    counts = np.diff(np.r_[starts, len(sorted_keys)])
+    sums = tuple(np.add.reduceat(np.asarray(value)[order], starts) for value in values)
+    return (sorted_keys[starts], counts) + sums
+
+
+def _fits_float(values):
+    # bincount sums in float64, which is exact for integers below 2**53
+    return np.abs(np.asarray(values)).sum(dtype=np.float64) < 2 ** 53
+
+
+def _dense_group_sum(keys, low, high, values):
+    """group_sum for keys from a compact range (customer ids of a shard, day numbers): no sort needed."""
+    offsets = np.asarray(keys) - low
+    counts = np.bincount(offsets, minlength=high - low + 1)
+    present = np.flatnonzero(counts)
+    sums = tuple(
+        np.bincount(offsets, weights=np.asarray(value), minlength=high - low + 1)[present].astype(np.int64)
+        for value in values
+    )
+    return (present + low, counts[present]) + sums
+
+
+def group_max(keys, values):
+    """Largest value per distinct key. Returns (unique_keys, maxima) in key order."""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.asarray(values).dtype)
+    order = np.lexsort((values, keys))
+    sorted_keys = np.asarray(keys)[order]
+    # With equal keys sorted by value, each key's last row holds its maximum
+    ends = np.flatnonzero(np.r_[sorted_keys[1:] != sorted_keys[:-1], True])
+    return sorted_keys[ends], np.asarray(values)[order][ends]
+
+
+def largest(keys, values, limit=10):
+    """The ``limit`` (key, value) pairs with the largest values, as (keys, values) sorted descending."""
+    if len(values) > limit:
+        candidates = np.argpartition(values, -limit)[-limit:]
+    else:
+        candidates = np.arange(len(values))
+    best = candidates[np.argsort(values[candidates], kind='stable')[::-1]]
+    return keys[best], values[best]
+
+
+def top_by_sum(keys, values, limit=10):
+    """The ``limit`` keys with the largest summed value, as (keys, sums) sorted descending."""
+    unique_keys, _, sums = group_sum(keys, values)
+    return largest(unique_keys, sums, limit)
+
+
+def day_numbers(timestamps, utc_offset_seconds=0):
+    """Local day number (days since the epoch) of each Unix timestamp."""
+    return (np.asarray(timestamps) + utc_offset_seconds) // SECONDS_PER_DAY
+
+
+def daily_totals(timestamps, values, since, utc_offset_seconds=0):
+    """
+    Purchase count and summed values per local day for timestamps >= since.
+    Returns (day_numbers, counts, sums...) for days that have purchases.
+    """
+    recent = np.asarray(timestamps) >= since
+    days = day_numbers(np.asarray(timestamps)[recent], utc_offset_seconds)
+    return group_sum(days, *(np.asarray(value)[recent] for value in values))
+
+
+def percentiles(values, qs=(50, 90, 99)):
+    """Percentiles of ``values`` keyed 'p50', 'p90', ...; zeros when there are no values."""
+    results = np.percentile(values, qs).tolist() if len(values) else [0] * len(qs)
+    return {f'p{q}': value for q, value in zip(qs, results)}
+
+
+def quantile_edges(values, bins=5):
+    """The ``bins - 1`` inner quantile boundaries of ``values``; zeros when there are none."""
+    if len(values) == 0:
+        return [0.0] * (bins - 1)
+    return np.quantile(values, np.arange(1, bins) / bins).tolist()
+
+
+def bin_scores(values, edges, reverse=False):
+    """
+    Score 1 to len(edges) + 1 of each value by the edges it exceeds; a value
+    equal to an edge stays in the lower bin. With ``reverse`` small values
+    score highest (days since the last purchase).
+    """
+    passed = np.searchsorted(np.asarray(edges), values, side='left')
+    return len(edges) + 1 - passed if reverse else passed + 1
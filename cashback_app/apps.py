@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+
+
+class CashbackAppConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'cashback_app'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+        from .sharding import seed_shard_sequences
+
+        # Register signal handlers and background job handlers
+        from . import signals, tasks  # noqa: F401
+        post_migrate.connect(seed_shard_sequences, sender=self)
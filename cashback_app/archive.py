@@ -0,0 +1,130 @@
+"""
+Hot/cold archival of old purchases.
+
+``archive_shard`` moves purchases older than a cutoff from Purchase into
+ArchivedPurchase in batched transactions. In the same transaction their
+amounts are rolled forward into PurchaseSummary, one row per customer and
+local Jalali month. Lifetime figures (wallet audits, dashboard totals, the
+customer page) therefore read the small hot table plus the summaries and
+stay exact without touching the archive.
+
+The columnar purchase store is refreshed before each shard is archived, so
+report analytics keep every purchase; ``columnar.refresh(rebuild=True)``
+reads the archive table as well.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+import jdatetime
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+
+from .models import ArchivedPurchase, CashbackLot, Purchase, PurchaseSummary
+from .versioning import bump_version
+
+
+def archive_cutoff(days=None):
+    """Purchases created before this moment are archived."""
+    return timezone.now() - timedelta(days=settings.PURCHASE_ARCHIVE_DAYS if days is None else days)
+
+
+def month_of(value):
+    """Gregorian date of the first day of a datetime's local (Jalali) month."""
+    return jdatetime.date.fromgregorian(date=timezone.localtime(value).date()).replace(day=1).togregorian()
+
+
+def _roll_forward(alias, rows):
+    """Add the rows (customer_id, amount, cashback, created_at) to the month summaries."""
+    totals = {}
+    for customer_id, amount, cashback, created_at in rows:
+        key = (customer_id, month_of(created_at))
+        count, amount_sum, cashback_sum = totals.get(key, (0, Decimal(0), Decimal(0)))
+        totals[key] = (count + 1, amount_sum + amount, cashback_sum + cashback)
+
+    customer_ids = {customer_id for customer_id, _ in totals}
+    months = {month for _, month in totals}
+    existing = {
+        (summary.customer_id, summary.month): summary
+        for summary in PurchaseSummary.objects.using(alias).select_for_update()
+        .filter(customer_id__in=customer_ids, month__in=months)
+    }
+    updated, created = [], []
+    for (customer_id, month), (count, amount, cashback) in totals.items():
+        summary = existing.get((customer_id, month))
+        if summary is None:
+            created.append(PurchaseSummary(customer_id=customer_id, month=month, purchase_count=count,
+                                           total_amount=amount, total_cashback=cashback))
+        else:
+            summary.purchase_count += count
+            summary.total_amount += amount
+            summary.total_cashback += cashback
+            updated.append(summary)
+    PurchaseSummary.objects.using(alias).bulk_update(
+        updated, ['purchase_count', 'total_amount', 'total_cashback'], batch_size=1000
+    )
+    PurchaseSummary.objects.using(alias).bulk_create(created, batch_size=1000)
+
+
+def archive_shard(alias, cutoff, batch_size=5000, progress=None):
+    """
+    Archive purchases of one shard created before ``cutoff``, ``batch_size``
+    per transaction. Returns (purchases archived, customers affected).
+    """
+    archived = 0
+    customers = set()
+    fields = ('pk', 'customer_id', 'amount', 'cashback_amount', 'created_at', 'created_by_id', 'branch_id')
+    while True:
+        with transaction.atomic(using=alias):
+            rows = list(Purchase.objects.using(alias).filter(created_at__lt=cutoff)
+                        .order_by('created_at').values_list(*fields)[:batch_size])
+            if not rows:
+                break
+            ids = [row[0] for row in rows]
+            _roll_forward(alias, [row[1:5] for row in rows])
+            now = timezone.now()
+            ArchivedPurchase.objects.using(alias).bulk_create([
+                ArchivedPurchase(purchase_id=pk, customer_id=customer_id, amount=amount,
+                                 cashback_amount=cashback, created_at=created_at,
+                                 created_by_id=created_by_id, branch_id=branch_id, archived_at=now)
+                for pk, customer_id, amount, cashback, created_at, created_by_id, branch_id in rows
+            ], batch_size=1000)
+            # Lots outlive their purchase; only the link goes
+            CashbackLot.objects.using(alias).filter(purchase_id__in=ids).update(purchase=None)
+            Purchase.objects.using(alias).filter(pk__in=ids)._raw_delete(alias)
+        archived += len(rows)
+        batch_customers = {row[1] for row in rows}
+        customers |= batch_customers
+        for customer_id in batch_customers:
+            bump_version(f'customer:{customer_id}')
+        if progress:
+            progress(archived)
+    if archived:
+        bump_version('stats')
+    return archived, len(customers)
+
+
+def lifetime_totals(customer):
+    """Purchase count, amount and cashback of a customer, hot and archived together."""
+    hot = customer.purchases.aggregate(count=Count('pk'), amount=Sum('amount'), cashback=Sum('cashback_amount'))
+    cold = customer.purchase_summaries.aggregate(
+        count=Sum('purchase_count'), amount=Sum('total_amount'), cashback=Sum('total_cashback')
+    )
+    return {key: (hot[key] or 0) + (cold[key] or 0) for key in ('count', 'amount', 'cashback')}
+
+
+def fold_summaries(alias, keep_id, duplicate_ids):
+    """Move the duplicates' month summaries onto ``keep_id``, adding up months both have."""
+    summaries = PurchaseSummary.objects.using(alias).filter(customer_id__in=[keep_id, *duplicate_ids])
+    months = list(summaries.order_by().values('month').annotate(
+        count=Sum('purchase_count'), amount=Sum('total_amount'), cashback=Sum('total_cashback')
+    ))
+    if not months:
+        return
+    summaries._raw_delete(alias)
+    PurchaseSummary.objects.using(alias).bulk_create([
+        PurchaseSummary(customer_id=keep_id, month=row['month'], purchase_count=row['count'],
+                        total_amount=row['amount'], total_cashback=row['cashback'])
+        for row in months
+    ])
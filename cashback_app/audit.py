@@ -0,0 +1,139 @@
+"""
+Wallet consistency checks.
+
+A customer's expected wallet balance is the cashback of all their purchases
+(archived ones through their month summaries) minus all structured debits and expired cashback. ``audit_range`` compares that with the stored
+``wallet_balance`` for one id range of one shard using a few grouped queries,
+so ranges can be audited in parallel by ``manage.py audit_wallets``.
+"""
+import re
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import ActivityLog, CashbackLot, ChangeEvent, Customer, Purchase, PurchaseSummary, WalletDebit
+from .sharding import shard_for_pk
+from .versioning import bump_version
+
+# Matches the description written by views.wallet_reduction
+DEBIT_DESCRIPTION_RE = re.compile(r'کسر از کیف پول: ([\d,]+) ریال.*?دلیل: (.*)$', re.S)
+
+
+def _sums_by_customer(queryset, field):
+    rows = queryset.order_by().values('customer_id').annotate(total=Sum(field)).values_list('customer_id', 'total')
+    return {customer_id: total or Decimal(0) for customer_id, total in rows}
+
+
+def expected_balances(alias, lo, hi):
+    """Expected balance of every customer with lo <= id < hi that has any history."""
+    credits = _sums_by_customer(
+        Purchase.objects.using(alias).filter(customer_id__gte=lo, customer_id__lt=hi), 'cashback_amount'
+    )
+    # Archived purchases count through their month summaries
+    archived = _sums_by_customer(
+        PurchaseSummary.objects.using(alias).filter(customer_id__gte=lo, customer_id__lt=hi), 'total_cashback'
+    )
+    for customer_id, amount in archived.items():
+        credits[customer_id] = credits.get(customer_id, Decimal(0)) + amount
+    debits = _sums_by_customer(
+        WalletDebit.objects.using(alias).filter(customer_id__gte=lo, customer_id__lt=hi), 'amount'
+    )
+    expired = _sums_by_customer(
+        CashbackLot.objects.using(alias).filter(customer_id__gte=lo, customer_id__lt=hi, expired_amount__gt=0),
+        'expired_amount'
+    )
+    expected = dict(credits)
+    for deductions in (debits, expired):
+        for customer_id, amount in deductions.items():
+            expected[customer_id] = expected.get(customer_id, Decimal(0)) - amount
+    return expected
+
+
+def audit_range(alias, lo, hi, sample_limit=20):
+    """
+    Audit customers with lo <= id < hi on one shard.
+    Returns (checked, drifted, total_abs_drift, samples) where samples holds up
+    to sample_limit (customer_id, stored, expected) tuples.
+    """
+    expected = expected_balances(alias, lo, hi)
+    stored = Customer.objects.using(alias).filter(pk__gte=lo, pk__lt=hi).values_list('pk', 'wallet_balance')
+
+    checked = drifted = 0
+    total_drift = Decimal(0)
+    samples = []
+    for customer_id, balance in stored.iterator(chunk_size=5000):
+        checked += 1
+        should_be = expected.get(customer_id, Decimal(0))
+        if balance != should_be:
+            drifted += 1
+            total_drift += abs(balance - should_be)
+            if len(samples) < sample_limit:
+                samples.append((customer_id, balance, should_be))
+    return checked, drifted, total_drift, samples
+
+
+def _invalidate_customer(customer_id):
+    bump_version(f'customer:{customer_id}')
+    bump_version('stats')
+
+
+def repair_customer(alias, customer_id):
+    """Recompute one customer's balance under a row lock and store it."""
+    with transaction.atomic(using=alias):
+        customer = Customer.objects.using(alias).select_for_update().get(pk=customer_id)
+        balance = expected_balances(alias, customer_id, customer_id + 1).get(customer_id, Decimal(0))
+        if customer.wallet_balance != balance:
+            Customer.objects.using(alias).filter(pk=customer_id).update(
+                wallet_balance=balance, updated_at=timezone.now()
+            )
+            ChangeEvent.record_rows(Customer, alias, [customer_id])
+            # The UPDATE sends no signals; pages cached with the old balance go once it commits
+            transaction.on_commit(lambda: _invalidate_customer(customer_id), using=alias)
+        return balance
+
+
+def backfill_debits(alias):
+    """
+    Create WalletDebit rows for wallet reductions that were only recorded as
+    ActivityLog text. Logs already linked to a debit are skipped, so this is
+    safe to run repeatedly. Returns (created, unparseable).
+    """
+    linked = set(WalletDebit.objects.using(alias).exclude(activity_log_id=None)
+                 .values_list('activity_log_id', flat=True))
+    logs = ActivityLog.objects.filter(activity_type='wallet_reduction', customer_id__isnull=False).order_by('pk')
+    created = unparseable = 0
+    batch = []
+
+    def flush():
+        # Logs can outlive their customer; only debit customers that still exist
+        existing = set(Customer.objects.using(alias).filter(pk__in={debit.customer_id for debit in batch})
+                       .values_list('pk', flat=True))
+        debits = [debit for debit in batch if debit.customer_id in existing]
+        with transaction.atomic(using=alias):
+            WalletDebit.objects.using(alias).bulk_create(debits)
+            ChangeEvent.record_rows(WalletDebit, alias, [debit.pk for debit in debits], 'create')
+        batch.clear()
+        return len(debits)
+
+    for log in logs.iterator(chunk_size=2000):
+        if log.pk in linked or shard_for_pk(log.customer_id) != alias:
+            continue
+        match = DEBIT_DESCRIPTION_RE.search(log.description)
+        if not match:
+            unparseable += 1
+            continue
+        batch.append(WalletDebit(
+            customer_id=log.customer_id,
+            amount=Decimal(match.group(1).replace(',', '')),
+            reason=match.group(2).strip()[:200],
+            activity_log_id=log.pk,
+            created_by_id=log.user_id,
+            created_at=log.created_at,
+        ))
+        if len(batch) >= 1000:
+            created += flush()
+    if batch:
+        created += flush()
+    return created, unparseable
@@ -1,7 +1,7 @@
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.contrib.auth.models import User, Group
-from .models import UserProfile
+from .models import Branch, UserProfile
 
 class LoginForm(AuthenticationForm):
     username = forms.CharField(
@@ -32,6 +32,13 @@ class OperatorCreationForm(UserCreationForm):
         widget=forms.EmailInput(attrs={'class': 'form-control', 'placeholder': 'ایمیل'}),
         label='ایمیل'
     )
+    branch = forms.ModelChoiceField(
+        queryset=Branch.objects.filter(is_active=True),
+        required=False,
+        empty_label='همه شعبه‌ها',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+        label='شعبه'
+    )
     
     class Meta:
         model = User
@@ -48,7 +55,7 @@ class OperatorCreationForm(UserCreationForm):
         if commit:
             user.save()
             # Create operator profile
-            UserProfile.objects.create(user=user, user_type='operator')
+            UserProfile.objects.create(user=user, user_type='operator', branch=self.cleaned_data.get('branch'))
             # Add to operator group
             operator_group, created = Group.objects.get_or_create(name='Operator')
             user.groups.add(operator_group)
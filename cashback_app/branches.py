@@ -0,0 +1,135 @@
+"""
+Branch scoping and per-branch counters.
+
+Users whose profile names a branch only see that branch: views narrow their
+querysets with ``scoped``, which the (branch, ...) composite indexes serve
+without reading other branches' rows. Users without a branch see
+everything.
+
+Branch totals come from BranchStats, one row per branch and shard, kept up
+to date by the model saves, deletion signals and bulk paths (import,
+shard moves). ``recount`` rebuilds them from the tables when they may have
+drifted, e.g. after rows were deleted by hand. ``assign_unassigned`` moves
+rows from before branches existed into a branch.
+"""
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from .models import ActivityLog, ArchivedPurchase, BranchStats, ChangeEvent, Customer, Purchase
+from .sharding import scatter
+from .versioning import bump_version
+
+
+def scoped(queryset, branch_id):
+    """``queryset`` narrowed to one branch, or unchanged for None (all branches)."""
+    return queryset if branch_id is None else queryset.filter(branch_id=branch_id)
+
+
+def branch_totals(branch_id):
+    """Customers, purchases and cashback of a branch, summed over its shards' counters."""
+    def shard_totals(alias):
+        return BranchStats.objects.using(alias).filter(branch_id=branch_id).aggregate(
+            customers=Sum('customers'), purchases=Sum('purchases'), cashback=Sum('cashback'),
+        )
+    totals = {'customers': 0, 'purchases': 0, 'cashback': 0}
+    for shard in scatter(shard_totals):
+        for name, value in shard.items():
+            totals[name] += value or 0
+    return totals
+
+
+def _add_counts(counts, rows, field):
+    for branch_id, count, cashback in rows:
+        if branch_id is None:
+            continue
+        branch = counts.setdefault(branch_id, {'customers': 0, 'purchases': 0, 'cashback': Decimal(0)})
+        branch[field] += count
+        if cashback is not None:
+            branch['cashback'] += cashback
+
+
+def count_branches(alias, customer_id=None):
+    """
+    Totals per branch id as counted from a shard's tables, or from one
+    customer's rows only: {branch_id: {'customers', 'purchases', 'cashback'}}.
+    """
+    customers = Customer.objects.using(alias)
+    purchases = [Purchase.objects.using(alias), ArchivedPurchase.objects.using(alias)]
+    if customer_id is not None:
+        customers = customers.filter(pk=customer_id)
+        purchases = [queryset.filter(customer_id=customer_id) for queryset in purchases]
+    counts = {}
+    _add_counts(counts, [
+        (branch_id, count, None)
+        for branch_id, count in customers.order_by().values('branch_id').annotate(count=Count('pk'))
+        .values_list('branch_id', 'count')
+    ], 'customers')
+    for queryset in purchases:
+        _add_counts(counts, queryset.order_by().values('branch_id')
+                    .annotate(count=Count('pk'), cashback=Sum('cashback_amount'))
+                    .values_list('branch_id', 'count', 'cashback'), 'purchases')
+    return counts
+
+
+def recount(alias, dry_run=False):
+    """
+    Replace a shard's counters with totals counted from its tables. Returns
+    [(branch_id, field, counter value, counted value)] for every mismatch.
+    """
+    with transaction.atomic(using=alias):
+        counted = count_branches(alias)
+        stored = {
+            row['branch_id']: row
+            for row in BranchStats.objects.using(alias).select_for_update()
+            .values('branch_id', 'customers', 'purchases', 'cashback')
+        }
+        mismatches = []
+        for branch_id in sorted(set(counted) | set(stored)):
+            actual = counted.get(branch_id, {'customers': 0, 'purchases': 0, 'cashback': 0})
+            current = stored.get(branch_id, {'customers': 0, 'purchases': 0, 'cashback': 0})
+            mismatches.extend(
+                (branch_id, field, current[field], actual[field])
+                for field in ('customers', 'purchases', 'cashback') if current[field] != actual[field]
+            )
+        if not dry_run and mismatches:
+            BranchStats.objects.using(alias).all()._raw_delete(alias)
+            BranchStats.objects.using(alias).bulk_create([
+                BranchStats(branch_id=branch_id, **totals) for branch_id, totals in counted.items()
+            ])
+    return mismatches
+
+
+def assign_unassigned(alias, branch_id, batch_size=5000):
+    """
+    Put a shard's customers and purchases without a branch into ``branch_id``,
+    ``batch_size`` rows per transaction. Returns {model name: rows assigned}.
+    Run ``recount`` afterwards.
+    """
+    assigned = {}
+    for model in (Customer, Purchase, ArchivedPurchase):
+        rows = model._base_manager.using(alias).filter(branch_id__isnull=True)
+        assigned[model._meta.model_name] = 0
+        while True:
+            with transaction.atomic(using=alias):
+                pks = list(rows.order_by('pk').values_list('pk', flat=True)[:batch_size])
+                if not pks:
+                    break
+                model._base_manager.using(alias).filter(pk__in=pks).update(branch_id=branch_id)
+                if model._meta.model_name in ChangeEvent.FIELDS:
+                    ChangeEvent.record_rows(model, alias, pks)
+            assigned[model._meta.model_name] += len(pks)
+    if any(assigned.values()):
+        bump_version('stats')
+    return assigned
+
+
+def assign_unassigned_logs(branch_id, batch_size=5000):
+    """Put activity logs without a branch into ``branch_id``; returns the number assigned."""
+    assigned = 0
+    while True:
+        pks = list(ActivityLog.objects.filter(branch_id__isnull=True).order_by().values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return assigned
+        assigned += ActivityLog.objects.filter(pk__in=pks).update(branch_id=branch_id)
@@ -0,0 +1,171 @@
+"""
+Append-only columnar copy of the purchases table for analytics.
+
+Each shard gets a directory under PURCHASE_STORE_DIR with one raw int64 file
+per column and a ``meta.json`` holding the row count and the highest
+exported purchase id. ``refresh`` appends purchases above that high-water
+mark; ``load`` memory-maps the columns, so scans never touch the database.
+
+Appending cannot follow purchases that change after they were exported:
+moving a customer to another shard (``sharding.move_customer``, also run by
+customer edits, merges and ``rebalance_shards``) gives its purchases new ids,
+merges repoint them to another customer, and edits or deletes change them in
+place. Each of these bumps the ``purchase_store:<alias>`` version stamp of
+the shards it touched once it commits (this module needs numpy, so they do
+not import it), and the next ``refresh`` sees the stamp differ from the one
+the store was built at and rebuilds the store. A rebuild also reads the
+purchases ``archive_purchases`` moved to the archive table, so analytics keep
+covering every purchase. A store written with other columns than COLUMNS is
+rebuilt on its next refresh, as is every store after the cache holding the
+stamps is cleared. ``manage.py refresh_purchase_store --rebuild`` forces a
+rebuild.
+"""
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+
+from .models import ArchivedPurchase, Purchase
+from .sharding import scatter, shard_aliases
+from .versioning import get_version
+
+COLUMNS = ('id', 'customer_id', 'amount', 'cashback', 'created_at', 'created_by', 'branch')
+DTYPE = np.dtype('<i8')
+META_NAME = 'meta.json'
+# created_by and branch are nullable; missing values are stored as -1
+NO_OPERATOR = -1
+NO_BRANCH = -1
+
+
+def store_dir(alias):
+    path = Path(settings.PURCHASE_STORE_DIR) / alias
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def read_meta(alias):
+    try:
+        with open(store_dir(alias) / META_NAME, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'rows': 0, 'high_water_mark': 0, 'columns': list(COLUMNS), 'version': None}
+
+
+def _write_meta(alias, meta):
+    path = store_dir(alias) / META_NAME
+    tmp_path = path.with_name(f'.{META_NAME}.{os.getpid()}')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+@contextmanager
+def _locked(alias):
+    # One writer per shard store; readers never take the lock
+    with open(store_dir(alias) / '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _rows_to_columns(rows):
+    ids, customer_ids, amounts, cashbacks, created_ats, created_bys, branches = zip(*rows)
+    return {
+        'id': np.array(ids, dtype=DTYPE),
+        'customer_id': np.array(customer_ids, dtype=DTYPE),
+        'amount': np.array([int(value) for value in amounts], dtype=DTYPE),
+        'cashback': np.array([int(value) for value in cashbacks], dtype=DTYPE),
+        'created_at': np.array([int(value.timestamp()) for value in created_ats], dtype=DTYPE),
+        'created_by': np.array([NO_OPERATOR if value is None else value for value in created_bys], dtype=DTYPE),
+        'branch': np.array([NO_BRANCH if value is None else value for value in branches], dtype=DTYPE),
+    }
+
+
+def refresh(alias, batch_size=50000, rebuild=False):
+    """
+    Append purchases newer than the shard's high-water mark, or rebuild the
+    store if it was invalidated. Returns the number of rows added.
+    """
+    with _locked(alias):
+        directory = store_dir(alias)
+        # Read before any purchase: an invalidation while this runs leaves the
+        # store marked with an older stamp, so the next refresh rebuilds again
+        version = get_version(f'purchase_store:{alias}')
+        meta = read_meta(alias)
+        rebuild = rebuild or meta.get('columns') != list(COLUMNS) or meta.get('version') != version
+        if rebuild:
+            for column in COLUMNS:
+                (directory / f'{column}.bin').unlink(missing_ok=True)
+            (directory / META_NAME).unlink(missing_ok=True)
+            meta = {**read_meta(alias), 'version': version}
+            _write_meta(alias, meta)
+
+        # Drop bytes left behind by an append that crashed before its meta was written
+        for column in COLUMNS:
+            path = directory / f'{column}.bin'
+            if path.exists() and path.stat().st_size > meta['rows'] * DTYPE.itemsize:
+                os.truncate(path, meta['rows'] * DTYPE.itemsize)
+
+        added = 0
+        if rebuild:
+            # Archived purchases first; they left the hot table, so the high-water mark stays put
+            fields = ('purchase_id', 'customer_id', 'amount', 'cashback_amount', 'created_at', 'created_by_id',
+                      'branch_id')
+            last_id = 0
+            while True:
+                rows = list(ArchivedPurchase.objects.using(alias).filter(purchase_id__gt=last_id)
+                            .order_by('purchase_id').values_list(*fields)[:batch_size])
+                if not rows:
+                    break
+                _append(directory, rows)
+                last_id = rows[-1][0]
+                meta = {**meta, 'rows': meta['rows'] + len(rows)}
+                _write_meta(alias, meta)
+                added += len(rows)
+
+        fields = ('pk', 'customer_id', 'amount', 'cashback_amount', 'created_at', 'created_by_id', 'branch_id')
+        while True:
+            rows = list(Purchase.objects.using(alias).filter(pk__gt=meta['high_water_mark'])
+                        .order_by('pk').values_list(*fields)[:batch_size])
+            if not rows:
+                break
+            _append(directory, rows)
+            meta = {**meta, 'rows': meta['rows'] + len(rows), 'high_water_mark': rows[-1][0]}
+            _write_meta(alias, meta)
+            added += len(rows)
+        return added
+
+
+def _append(directory, rows):
+    columns = _rows_to_columns(rows)
+    for column in COLUMNS:
+        with open(directory / f'{column}.bin', 'ab') as f:
+            f.write(columns[column].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def refresh_all(batch_size=50000, rebuild=False):
+    """Refresh every shard's store in parallel; returns rows added per shard alias."""
+    added = scatter(lambda alias: refresh(alias, batch_size=batch_size, rebuild=rebuild))
+    return dict(zip(shard_aliases(), added))
+
+
+def load(alias):
+    """Read-only memory-mapped columns of one shard's store, keyed by column name."""
+    rows = read_meta(alias)['rows']
+    directory = store_dir(alias)
+    if rows == 0:
+        return {column: np.empty(0, dtype=DTYPE) for column in COLUMNS}
+    return {
+        column: np.memmap(directory / f'{column}.bin', dtype=DTYPE, mode='r', shape=(rows,))
+        for column in COLUMNS
+    }
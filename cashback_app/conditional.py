@@ -0,0 +1,51 @@
+"""
+ETag support for pages whose content is fully described by version stamps.
+
+Each view supplies the stamps its content depends on (see versioning.py);
+the ETag also covers the user and the CSRF cookie, since every page shows
+the user's menu and embeds a CSRF token. A matching If-None-Match is answered
+with 304 before the view runs, so unchanged pages are neither queried nor
+rendered.
+"""
+import hashlib
+from functools import wraps
+
+from django.contrib import messages
+from django.middleware.csrf import CSRF_SESSION_KEY
+from django.conf import settings
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+
+def page_etag(request, *parts):
+    """
+    ETag for a page built from ``parts``, or None when the page must be
+    rendered anyway (pending flash messages are shown once and then consumed).
+    """
+    if len(messages.get_messages(request)):
+        return None
+    if settings.CSRF_USE_SESSIONS:
+        csrf_secret = request.session.get(CSRF_SESSION_KEY, '')
+    else:
+        csrf_secret = request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')
+    key = '|'.join(str(part) for part in (request.user.pk, csrf_secret, *parts))
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def conditional_page(etag_func, last_modified_func=None):
+    """
+    Like ``django.views.decorators.http.condition`` but also marks the response
+    private and always-revalidate, so browsers keep a copy and ask with
+    If-None-Match instead of reusing it blindly or sharing it.
+    """
+    def decorator(view):
+        conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD') and response.has_header('ETag'):
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,237 @@
+"""
+Duplicate customer detection and merging.
+
+Detection never compares all pairs. Every customer is written under a few
+blocking keys (normalized phone number, folded full name) into on-disk
+partitions. Each partition is then grouped by key and only customers sharing
+a block are compared, so partitions can be processed by a process pool and
+memory stays bounded by the largest partition.
+
+``merge_customers`` folds duplicates into one surviving customer with bulk
+UPDATEs: rows that belong to a customer are repointed, wallet balances are
+summed and activity logs are relinked.
+"""
+import csv
+import re
+import zlib
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .archive import fold_summaries
+from .models import ActivityLog, ChangeEvent, Customer, CustomerSegment, CustomerToken, Purchase, WalletDebit
+from .sharding import customer_child_models, move_customer, shard_aliases, shard_for_pk
+from .versioning import bump_version, bump_version_on_commit
+
+# Arabic letters and forms operators type instead of their Persian equivalents
+NAME_FOLDING = str.maketrans({
+    'ي': 'ی', 'ى': 'ی', 'ئ': 'ی', 'ك': 'ک', 'ة': 'ه', 'ۀ': 'ه',
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا', 'ؤ': 'و',
+    '\u200c': ' ',  # zero-width non-joiner
+    '\u0640': None,  # tatweel
+})
+DIACRITICS_RE = re.compile('[\u064b-\u065f\u0670]')
+WHITESPACE_RE = re.compile(r'\s+')
+
+# Blocks larger than this (very common names) are compared with a sliding
+# window over national codes instead of all pairs
+MAX_BLOCK_SIZE = 200
+WINDOW_SIZE = 10
+
+PHONE_SCORE = 0.45
+NAME_SCORE = 0.35
+CODE_SCORES = {1: 0.3, 2: 0.15}
+
+# Columns of a partition file after the blocking key
+RECORD_FIELDS = ('id', 'name', 'code', 'phone', 'display')
+
+
+def fold_name(first_name, last_name):
+    """Comparable form of a full name: Persian letters, no diacritics, single spaces."""
+    name = f'{first_name} {last_name}'.translate(NAME_FOLDING)
+    name = DIACRITICS_RE.sub('', name)
+    return WHITESPACE_RE.sub(' ', name).strip().lower()
+
+
+def code_distance(a, b, limit=2):
+    """
+    Edit distance between two national codes counting adjacent transpositions
+    as one edit; anything above ``limit`` is reported as limit + 1.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, start=1):
+        current = [i] + [0] * len(b)
+        for j, char_b in enumerate(b, start=1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b))
+            if i > 1 and j > 1 and char_a == b[j - 2] and a[i - 2] == char_b:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+def score_pair(a, b):
+    """Similarity score and reasons for two customer records (see ``_records``)."""
+    score = 0.0
+    reasons = []
+    if a['phone'] and a['phone'] == b['phone']:
+        score += PHONE_SCORE
+        reasons.append('phone')
+    if a['name'] and a['name'] == b['name']:
+        score += NAME_SCORE
+        reasons.append('name')
+    distance = code_distance(a['code'], b['code'])
+    if distance in CODE_SCORES:
+        score += CODE_SCORES[distance]
+        reasons.append(f'code~{distance}')
+    return round(score, 2), reasons
+
+
+def _records(alias, chunk_size=10000):
+    fields = ('pk', 'first_name', 'last_name', 'national_code', 'phone_number')
+    customers = Customer.objects.using(alias).order_by().values_list(*fields)
+    for pk, first_name, last_name, national_code, phone_number in customers.iterator(chunk_size=chunk_size):
+        yield {
+            'id': pk,
+            'name': fold_name(first_name, last_name),
+            'code': national_code,
+            'phone': Customer.normalize_phone_number(phone_number),
+            'display': WHITESPACE_RE.sub(' ', f'{first_name} {last_name}').strip(),
+        }
+
+
+def write_partitions(directory, partitions):
+    """
+    Stream every customer of every shard into ``partitions`` TSV files, once
+    per blocking key. Returns the partition paths and the number of customers.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = [directory / f'block-{index:04d}.tsv' for index in range(partitions)]
+    files = [open(path, 'w', encoding='utf-8', newline='') for path in paths]
+    writers = [csv.writer(f, delimiter='\t') for f in files]
+    customers = 0
+    try:
+        for alias in shard_aliases():
+            for record in _records(alias):
+                customers += 1
+                keys = []
+                if record['phone']:
+                    keys.append(f"p:{record['phone']}")
+                if record['name']:
+                    keys.append(f"n:{record['name']}")
+                for key in keys:
+                    writer = writers[zlib.crc32(key.encode('utf-8')) % partitions]
+                    writer.writerow([key] + [record[field] for field in RECORD_FIELDS])
+    finally:
+        for f in files:
+            f.close()
+    return paths, customers
+
+
+def _compare_block(block):
+    if len(block) <= MAX_BLOCK_SIZE:
+        for i, a in enumerate(block):
+            for b in block[i + 1:]:
+                yield a, b
+    else:
+        ordered = sorted(block, key=lambda record: record['code'])
+        for i, a in enumerate(ordered):
+            for b in ordered[i + 1:i + WINDOW_SIZE]:
+                yield a, b
+
+
+def find_candidates(path, min_score=0.5):
+    """
+    Compare the customers sharing a block in one partition file.
+    Returns [(score, id_a, id_b, reasons, record_a, record_b)] with id_a < id_b.
+    """
+    blocks = {}
+    with open(path, encoding='utf-8', newline='') as f:
+        for row in csv.reader(f, delimiter='\t'):
+            record = dict(zip(RECORD_FIELDS, row[1:]))
+            record['id'] = int(record['id'])
+            blocks.setdefault(row[0], []).append(record)
+
+    candidates = []
+    for block in blocks.values():
+        if len(block) < 2:
+            continue
+        for a, b in _compare_block(block):
+            score, reasons = score_pair(a, b)
+            if score >= min_score:
+                if a['id'] > b['id']:
+                    a, b = b, a
+                candidates.append((score, a['id'], b['id'], reasons, a, b))
+    return candidates
+
+
+def get_customer(pk):
+    """Customer with this id from the shard that owns it, or None."""
+    alias = shard_for_pk(pk)
+    if alias is None:
+        return None
+    return Customer.objects.using(alias).filter(pk=pk).first()
+
+
+def merge_customers(keep, duplicates, user=None):
+    """
+    Fold ``duplicates`` into ``keep``: their purchases, debits and other rows
+    move to ``keep``, their wallet balances are added to it, their activity
+    logs and tokens are relinked and they are deleted. Returns the refreshed ``keep``.
+    """
+    target = keep._state.db
+    # Merging happens within one database; bring duplicates to keep's shard first
+    duplicates = [dup if dup._state.db == target else move_customer(dup, target) for dup in duplicates]
+    duplicate_ids = [dup.pk for dup in duplicates if dup.pk != keep.pk]
+    if not duplicate_ids:
+        return keep
+    # Month summaries are unique per customer, so they are added up instead of
+    # repointed; segments (one per customer too) are recomputed instead
+    children = [model for model in customer_child_models()
+                if model._meta.model_name not in ('purchasesummary', 'customersegment')]
+
+    with transaction.atomic(using=target), transaction.atomic(using='default'):
+        balances = dict(Customer.objects.using(target).select_for_update()
+                        .filter(pk__in=[keep.pk] + duplicate_ids).values_list('pk', 'wallet_balance'))
+        merged_balance = sum(balance for pk, balance in balances.items() if pk != keep.pk)
+        # Repointed purchases and debits reach the change feed as updates
+        moved_rows = {
+            model: list(model.objects.using(target).filter(customer_id__in=duplicate_ids).values_list('pk', flat=True))
+            for model in (Purchase, WalletDebit)
+        }
+        for model in children:
+            model._base_manager.using(target).filter(customer_id__in=duplicate_ids).update(customer_id=keep.pk)
+        fold_summaries(target, keep.pk, duplicate_ids)
+        # The next compute_segments scores customers without a segment, with the merged purchases
+        CustomerSegment.objects.using(target).filter(customer_id=keep.pk).delete()
+        Customer.objects.using(target).filter(pk=keep.pk).update(
+            wallet_balance=F('wallet_balance') + merged_balance, updated_at=timezone.now()
+        )
+        ChangeEvent.record_rows(Customer, target, [keep.pk])
+        for model, pks in moved_rows.items():
+            ChangeEvent.record_rows(model, target, pks)
+        # Relink logs and tokens before the delete, whose signal would otherwise drop them
+        ActivityLog.objects.filter(customer_id__in=duplicate_ids).update(customer_id=keep.pk)
+        CustomerToken.objects.filter(customer_id__in=duplicate_ids).update(customer_id=keep.pk)
+        Customer.objects.using(target).filter(pk__in=duplicate_ids).delete()
+        # The analytics store still credits the repointed purchases to the duplicates
+        bump_version_on_commit(f'purchase_store:{target}', using=target)
+
+    bump_version(f'customer:{keep.pk}')
+    keep.refresh_from_db()
+    if user is not None:
+        ActivityLog.log_activity(
+            user=user,
+            activity_type='customer_edit',
+            description=f"ادغام {len(duplicate_ids)} مشتری تکراری در {keep.first_name} {keep.last_name} "
+                        f"(شناسه‌ها: {', '.join(map(str, duplicate_ids))})",
+            customer=keep,
+        )
+    return keep
@@ -1,6 +1,9 @@
+import uuid
+
 from django import forms
-import re
+from django.forms.models import ModelChoiceIterator
 from .models import Customer, Purchase
+from .sharding import customers_by_national_code, is_sharded, shard_aliases, shard_for_pk
 
 class CustomerForm(forms.ModelForm):
     class Meta:
@@ -20,21 +23,48 @@ class CustomerForm(forms.ModelForm):
         value = Customer.normalize_national_code((value or '').strip())
         if not Customer.is_valid_national_code(value):
             raise forms.ValidationError('کد ملی باید دقیقاً 10 رقم باشد')
+        # The model's unique check only sees 'default'; look on the owning shard
+        if is_sharded() and customers_by_national_code(value).exclude(pk=self.instance.pk).exists():
+            raise forms.ValidationError('مشتری با این کد ملی قبلاً ثبت شده است')
         return value
 
     def clean_phone_number(self):
         """Normalize Persian/Arabic digits in phone number to ASCII and validate basic pattern."""
-        value = self.cleaned_data.get('phone_number', '')
-        # Translate digits similar to national code
-        trans = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
-        value = str((value or '').strip()).translate(trans)
-        # Remove spaces/dashes if any
-        value = re.sub(r'[^0-9]', '', value)
+        value = Customer.normalize_phone_number(self.cleaned_data.get('phone_number', ''))
         # Ensure it follows 09XXXXXXXXX format
-        if not re.match(r'^09\d{9}$', value):
+        if not Customer.is_valid_phone_number(value):
             raise forms.ValidationError('شماره موبایل باید با 09 شروع شود و 11 رقم باشد')
         return value
 
+class ShardedChoiceIterator(ModelChoiceIterator):
+    """Choices read from every shard in turn instead of only 'default'."""
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for alias in shard_aliases():
+            for obj in self.queryset.using(alias).iterator():
+                yield self.choice(obj)
+
+    def __len__(self):
+        count = sum(self.queryset.using(alias).count() for alias in shard_aliases())
+        return count + (1 if self.field.empty_label is not None else 0)
+
+
+class CustomerChoiceField(forms.ModelChoiceField):
+    """Offer customers of every shard and resolve the chosen one on the shard that owns its id."""
+    iterator = ShardedChoiceIterator
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            alias = shard_for_pk(value)
+            return self.queryset.using(alias).get(pk=value)
+        except (ValueError, TypeError, self.queryset.model.DoesNotExist):
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
 class PurchaseForm(forms.ModelForm):
     class Meta:
         model = Purchase
@@ -43,6 +73,29 @@ class PurchaseForm(forms.ModelForm):
             'customer': forms.Select(attrs={'class': 'form-control'}),
             'amount': forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'مبلغ خرید (ریال)'}),
         }
+        field_classes = {
+            'customer': CustomerChoiceField,
+        }
+
+class CheckoutForm(forms.Form):
+    amount = forms.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        min_value=1,
+        widget=forms.NumberInput(attrs={
+            'class': 'form-control form-control-lg',
+            'placeholder': 'مبلغ خرید (ریال)',
+            'min': '1'
+        }),
+        label='مبلغ خرید'
+    )
+    # Generated with each new form and posted back, so a sale submitted twice
+    # (double click, resubmitted page) is recorded once as Purchase.client_id
+    client_id = forms.RegexField(
+        regex=r'^[A-Za-z0-9-]{8,64}$',
+        initial=lambda: uuid.uuid4().hex,
+        widget=forms.HiddenInput,
+    )
 
 class WalletReductionForm(forms.Form):
     amount = forms.DecimalField(
@@ -76,3 +129,16 @@ class WalletReductionForm(forms.Form):
                 f'مبلغ کسر نمی‌تواند بیشتر از موجودی کیف پول ({self.customer.wallet_balance:,} ریال) باشد.'
             )
         return amount
+
+
+class CustomerImportForm(forms.Form):
+    file = forms.FileField(
+        label='فایل مشتریان',
+        help_text='فایل CSV یا XLSX با ستون‌های نام، نام خانوادگی، کد ملی و شماره موبایل',
+    )
+
+    def clean_file(self):
+        upload = self.cleaned_data['file']
+        if not upload.name.lower().endswith(('.csv', '.xlsx', '.xlsm')):
+            raise forms.ValidationError('فقط فایل‌های CSV و XLSX پشتیبانی می‌شوند')
+        return upload
@@ -0,0 +1,224 @@
+"""
+Bulk customer import from CSV or XLSX files.
+
+Rows are streamed in chunks. Each chunk is normalized with the same rules as
+``CustomerForm``, checked against existing national codes with one ``IN``
+query per shard and inserted with ``bulk_create``; if another writer saved
+one of the codes in the meantime, the insert fails as a whole and the chunk is
+checked again. Rejected rows are written to an error CSV together with the
+reason, so they can be fixed and imported again.
+"""
+import csv
+from pathlib import Path
+
+from django.db import IntegrityError, transaction
+
+from .models import ActivityLog, BranchStats, ChangeEvent, Customer, branch_id_of
+from .sharding import shard_for_national_code
+from .versioning import bump_version
+
+# Accepted spellings of each column header: our own field names, the
+# customer export's headers and the Persian labels
+HEADER_ALIASES = {
+    'first_name': {'first_name', 'first name', 'نام'},
+    'last_name': {'last_name', 'last name', 'نام خانوادگی'},
+    'national_code': {'national_code', 'national code', 'کد ملی'},
+    'phone_number': {'phone_number', 'phone', 'شماره موبایل', 'موبایل'},
+}
+FIELDS = tuple(HEADER_ALIASES)
+
+
+class CustomerImportError(Exception):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.rejected = 0
+
+    def __str__(self):
+        return f"{self.rows:,} ردیف، {self.created:,} مشتری جدید، {self.rejected:,} ردیف رد شده"
+
+
+def _column_map(header):
+    """Map our field names to column positions in the file's header row."""
+    positions = {}
+    for index, title in enumerate(header):
+        title = str(title or '').strip().lower()
+        for field, aliases in HEADER_ALIASES.items():
+            if title in aliases:
+                positions[field] = index
+    missing = [field for field in FIELDS if field not in positions]
+    if missing:
+        raise CustomerImportError(f"ستون‌های لازم در فایل پیدا نشد: {', '.join(missing)}")
+    return positions
+
+
+def _cell_text(field, value):
+    if value is None:
+        return ''
+    if isinstance(value, (int, float)):
+        # Spreadsheets store codes as numbers and drop their leading zeros
+        text = str(int(value))
+        if field == 'national_code':
+            return text.zfill(10)
+        if field == 'phone_number' and len(text) == 10 and text.startswith('9'):
+            return '0' + text
+        return text
+    return str(value).strip()
+
+
+class RowReader:
+    """Iterate a CSV or XLSX file as (line number, {field: value}) pairs."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.fraction_done = 0.0
+
+    def __iter__(self):
+        suffix = self.path.suffix.lower()
+        if suffix == '.csv':
+            return self._read_csv()
+        if suffix in ('.xlsx', '.xlsm'):
+            return self._read_xlsx()
+        raise CustomerImportError('فقط فایل‌های CSV و XLSX پشتیبانی می‌شوند')
+
+    def _rows(self, rows):
+        header = next(rows, None)
+        if header is None:
+            return
+        positions = _column_map(header)
+        for line, row in enumerate(rows, start=2):
+            if not any(row):
+                continue
+            yield line, {
+                field: _cell_text(field, row[index]) if index < len(row) else ''
+                for field, index in positions.items()
+            }
+
+    def _read_csv(self):
+        size = self.path.stat().st_size or 1
+        with open(self.path, newline='', encoding='utf-8-sig') as f:
+            for line, values in self._rows(csv.reader(f)):
+                # The buffer position runs slightly ahead of the parser, which is fine for progress
+                self.fraction_done = f.buffer.tell() / size
+                yield line, values
+
+    def _read_xlsx(self):
+        # openpyxl is only needed for spreadsheet imports
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise CustomerImportError('برای ورود فایل XLSX بسته openpyxl را نصب کنید')
+        workbook = load_workbook(self.path, read_only=True, data_only=True)
+        try:
+            sheet = workbook.active
+            total = sheet.max_row or 1
+            for line, values in self._rows(sheet.iter_rows(values_only=True)):
+                self.fraction_done = line / total
+                yield line, values
+        finally:
+            workbook.close()
+
+
+def clean_row(values):
+    """Normalize one row in place; return an error message or None if it is valid."""
+    values['national_code'] = Customer.normalize_national_code(values['national_code'])
+    values['phone_number'] = Customer.normalize_phone_number(values['phone_number'])
+    if not values['first_name'] or len(values['first_name']) > 100:
+        return 'نام خالی یا بیش از ۱۰۰ نویسه است'
+    if not values['last_name'] or len(values['last_name']) > 100:
+        return 'نام خانوادگی خالی یا بیش از ۱۰۰ نویسه است'
+    if not Customer.is_valid_national_code(values['national_code']):
+        return 'کد ملی باید دقیقاً 10 رقم باشد'
+    if not Customer.is_valid_phone_number(values['phone_number']):
+        return 'شماره موبایل باید با 09 شروع شود و 11 رقم باشد'
+    return None
+
+
+def import_customers(path, error_path, created_by=None, chunk_size=5000, progress=None):
+    """
+    Import customers from ``path`` and write rejected rows to ``error_path``.
+    ``progress(percent, message)`` is called after every chunk.
+    """
+    result = ImportResult()
+    seen_codes = set()
+    # Imported customers belong to the importing user's branch
+    branch_id = branch_id_of(created_by)
+    reader = RowReader(path)
+
+    with open(error_path, 'w', newline='', encoding='utf-8-sig') as error_file:
+        errors = csv.writer(error_file)
+        errors.writerow(['ردیف', 'نام', 'نام خانوادگی', 'کد ملی', 'شماره موبایل', 'خطا'])
+
+        def reject(line, values, message):
+            result.rejected += 1
+            errors.writerow([line] + [values[field] for field in FIELDS] + [message])
+
+        def flush(chunk):
+            by_shard = {}
+            for line, values in chunk:
+                by_shard.setdefault(shard_for_national_code(values['national_code']), []).append((line, values))
+            for alias, rows in by_shard.items():
+                pending = rows
+                while pending:
+                    existing = set(Customer.objects.using(alias)
+                                   .filter(national_code__in=[values['national_code'] for _, values in pending])
+                                   .values_list('national_code', flat=True))
+                    for line, values in pending:
+                        if values['national_code'] in existing:
+                            reject(line, values, 'مشتری با این کد ملی قبلاً ثبت شده است')
+                    pending = [(line, values) for line, values in pending if values['national_code'] not in existing]
+                    customers = [Customer(created_by=created_by, branch_id=branch_id, **values)
+                                 for _, values in pending]
+                    try:
+                        with transaction.atomic(using=alias):
+                            Customer.objects.using(alias).bulk_create(customers, batch_size=1000)
+                            # Every code was free, so these are exactly the new rows; not
+                            # every database returns their ids from a bulk insert
+                            new_ids = list(Customer.objects.using(alias).filter(
+                                national_code__in=[customer.national_code for customer in customers]
+                            ).values_list('pk', flat=True))
+                            ChangeEvent.record_rows(Customer, alias, new_ids, 'create')
+                            BranchStats.add(alias, branch_id, customers=len(new_ids))
+                    except IntegrityError:
+                        # Another import or operator saved one of these codes since the
+                        # check above; look again, reject those and insert the rest
+                        if not Customer.objects.using(alias).filter(
+                            national_code__in=[customer.national_code for customer in customers]
+                        ).exists():
+                            raise
+                        continue
+                    result.created += len(new_ids)
+                    break
+            chunk.clear()
+            if progress:
+                progress(reader.fraction_done * 100, str(result))
+
+        chunk = []
+        for line, values in reader:
+            result.rows += 1
+            message = clean_row(values)
+            if message is None and values['national_code'] in seen_codes:
+                message = 'کد ملی در همین فایل تکراری است'
+            if message:
+                reject(line, values, message)
+                continue
+            seen_codes.add(values['national_code'])
+            chunk.append((line, values))
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+        if chunk:
+            flush(chunk)
+
+    if result.created:
+        bump_version('stats')
+        if created_by is not None:
+            ActivityLog.log_activity(
+                user=created_by,
+                activity_type='customer_create',
+                description=f"ورود گروهی مشتریان از فایل {Path(path).name}: {result}",
+            )
+    return result
@@ -0,0 +1,167 @@
+"""
+Database-backed background jobs.
+
+Jobs are rows in the ``Job`` table; ``manage.py run_jobs`` workers lease them,
+run the registered handler and store progress and a result file. No external
+broker is needed: on PostgreSQL workers claim rows with
+``SELECT ... FOR UPDATE SKIP LOCKED``, on SQLite with a conditional UPDATE that
+only one worker can win.
+"""
+import logging
+import traceback
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+HANDLERS = {}
+
+# Delay before retry n is RETRY_BASE_DELAY * 2 ** (n - 1)
+RETRY_BASE_DELAY = timedelta(seconds=30)
+
+
+def job_handler(kind):
+    """Register a function as the handler for jobs of the given kind."""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, payload=None, user=None, max_attempts=3):
+    """Queue a job for the workers and return it."""
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        created_by=user,
+        max_attempts=max_attempts,
+    )
+
+
+def results_dir():
+    path = Path(settings.JOB_RESULTS_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def result_path(job):
+    """Absolute path of a job's result file, or None if it has none."""
+    if not job.result_file:
+        return None
+    return results_dir() / job.result_file
+
+
+class JobContext:
+    """Handed to job handlers for reporting progress and writing results."""
+
+    def __init__(self, job, worker_id, lease_seconds):
+        self.job = job
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.result_file = ''
+
+    @property
+    def payload(self):
+        return self.job.payload
+
+    def set_progress(self, percent, message=''):
+        """Store progress and extend the lease so long jobs are not reclaimed."""
+        percent = max(0, min(100, int(percent)))
+        Job.objects.filter(pk=self.job.pk, locked_by=self.worker_id).update(
+            progress=percent,
+            progress_message=message[:200],
+            locked_until=timezone.now() + timedelta(seconds=self.lease_seconds),
+        )
+
+    def result_file_path(self, suffix):
+        """Reserve the job's result file and return its absolute path."""
+        self.result_file = f"{self.job.kind}-{self.job.pk}{suffix}"
+        return results_dir() / self.result_file
+
+
+def _claimable(now):
+    # Pending jobs that are due, plus running jobs whose worker lost its lease
+    return Job.objects.filter(
+        Q(status='pending', run_after__lte=now) |
+        Q(status='running', locked_until__lt=now)
+    )
+
+
+def claim_job(worker_id, lease_seconds=300):
+    """Lease the next runnable job for this worker, or return None."""
+    now = timezone.now()
+    claim = {
+        'status': 'running',
+        'locked_by': worker_id,
+        'locked_until': now + timedelta(seconds=lease_seconds),
+        'started_at': now,
+    }
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = (_claimable(now).order_by('run_after', 'pk')
+                   .select_for_update(skip_locked=True).first())
+            if job is None:
+                return None
+            for field, value in claim.items():
+                setattr(job, field, value)
+            job.attempts += 1
+            job.save(update_fields=list(claim) + ['attempts'])
+            return job
+
+    # No row locks (SQLite): the conditional UPDATE lets exactly one worker win
+    candidates = _claimable(now).order_by('run_after', 'pk').values_list('pk', flat=True)[:10]
+    for job_id in candidates:
+        won = _claimable(now).filter(pk=job_id).update(attempts=F('attempts') + 1, **claim)
+        if won:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def run_job(job, worker_id, lease_seconds=300):
+    """Run a leased job and record its outcome, scheduling a retry on failure."""
+    handler = HANDLERS.get(job.kind)
+    context = JobContext(job, worker_id, lease_seconds)
+    if job.attempts > job.max_attempts:
+        # Reclaimed after its worker died once too often
+        Job.objects.filter(pk=job.pk, locked_by=worker_id).update(
+            status='failed', finished_at=timezone.now(), locked_by='', locked_until=None,
+            error=job.error or 'Worker lease expired on every attempt',
+        )
+        return False
+    try:
+        if handler is None:
+            raise ValueError(f"No handler registered for job kind: {job.kind}")
+        handler(context)
+    except Exception:
+        error = traceback.format_exc()
+        logger.exception("Job %s (%s) failed on attempt %s", job.pk, job.kind, job.attempts)
+        owned = Job.objects.filter(pk=job.pk, locked_by=worker_id)
+        if handler is not None and job.attempts < job.max_attempts:
+            delay = RETRY_BASE_DELAY * (2 ** (job.attempts - 1))
+            owned.update(status='pending', run_after=timezone.now() + delay,
+                         locked_by='', locked_until=None, error=error)
+        else:
+            owned.update(status='failed', finished_at=timezone.now(),
+                         locked_by='', locked_until=None, error=error)
+        return False
+
+    Job.objects.filter(pk=job.pk, locked_by=worker_id).update(
+        status='succeeded',
+        progress=100,
+        result_file=context.result_file,
+        finished_at=timezone.now(),
+        locked_by='',
+        locked_until=None,
+        error='',
+    )
+    return True
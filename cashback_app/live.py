@@ -0,0 +1,238 @@
+"""
+Live dashboard updates over Server-Sent Events.
+
+One ``Broker`` per process and branch polls for changes on behalf of every
+connected dashboard of that branch (users without a branch share the
+all-branches broker): it compares the 'stats' version stamp (a cache read) and asks for
+activity logs newer than the last one it saw, every LIVE_POLL_INTERVAL
+seconds. Totals are only recomputed when the stamp moved, and the result is
+shared through the cache with the other processes. Each change is published
+once and fanned out to the subscribers' queues. Streams never query the
+database themselves.
+
+Queues are bounded. A subscriber that falls LIVE_CLIENT_QUEUE events behind
+(a stalled connection) is sent a 'reset' instead of the backlog and reloads
+the page. A reconnecting client sends Last-Event-ID and gets the activities
+it missed from the broker's recent history. The broker thread starts with the
+first subscriber and stops once the last one is gone.
+
+Under gunicorn's gthread workers every open stream holds one of the worker's
+threads. At most LIVE_MAX_STREAMS streams run per process, so the remaining
+threads keep serving pages; a client over the limit gets a stream that only
+asks it to reconnect after LIVE_BUSY_RETRY_MS and ends. Keep
+GUNICORN_THREADS above LIVE_MAX_STREAMS (see gunicorn.conf.py).
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, connections
+
+from .branches import scoped
+from .models import ActivityLog
+from .templatetags.persian_dates import persian_datetime
+from .versioning import get_version
+
+logger = logging.getLogger(__name__)
+
+STAT_NAMES = ('total_customers', 'total_purchases', 'total_cashback')
+# Activities kept for clients that reconnect with Last-Event-ID
+HISTORY_SIZE = 50
+# Open streams in this process, at most LIVE_MAX_STREAMS
+stream_slots = threading.BoundedSemaphore(settings.LIVE_MAX_STREAMS)
+
+
+def compute_stats(branch_id=None):
+    """The dashboard totals, as the dashboard page computes them."""
+    from .views import DashboardStats
+    stats = DashboardStats(branch_id)
+    return {name: int(getattr(stats, name)) for name in STAT_NAMES}
+
+
+def shared_stats(version, branch_id=None):
+    """Totals for a 'stats' version, computed by whichever process asks first."""
+    return cache.get_or_set(f'live_stats:{version}:{branch_id}', lambda: compute_stats(branch_id),
+                            settings.LIVE_POLL_INTERVAL * 30)
+
+
+def activity_payload(log):
+    return {
+        'id': log.pk,
+        'description': log.description,
+        'user': (log.user.get_full_name() or log.user.username) if log.user else '',
+        'created_at': persian_datetime(log.created_at),
+    }
+
+
+def format_event(event, data, event_id=None):
+    lines = [f'event: {event}']
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class Subscriber:
+    """One connected stream: a bounded queue of encoded events."""
+
+    def __init__(self, size):
+        self.queue = queue.Queue(maxsize=size)
+        self.overflowed = False
+
+    def put(self, message):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # Too far behind to catch up event by event
+            self.overflowed = True
+
+
+class Broker:
+    def __init__(self, branch_id=None):
+        self.branch_id = branch_id
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.thread = None
+        self.stats = None
+        self.stats_version = None
+        self.last_activity_id = None
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a stream and return it with the events that bring it up to
+        date: the current totals and the activities after ``last_event_id``.
+        """
+        subscriber = Subscriber(settings.LIVE_CLIENT_QUEUE)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self._poll()
+                self.thread = threading.Thread(target=self._run, name=f'live-broker-{self.branch_id}', daemon=True)
+                self.thread.start()
+            self.subscribers.add(subscriber)
+            backlog = [format_event('stats', {'values': self.stats, 'deltas': {}})]
+            if last_event_id is not None:
+                if len(self.history) == HISTORY_SIZE and last_event_id < self.history[0]['id']:
+                    # Missed more than the history holds; the page has to reload
+                    backlog.append(format_event('reset', {}))
+                else:
+                    backlog.extend(format_event('activity', activity, activity['id'])
+                                   for activity in self.history if activity['id'] > last_event_id)
+        return subscriber, backlog
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, message):
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            subscriber.put(message)
+
+    def _run(self):
+        while True:
+            time.sleep(settings.LIVE_POLL_INTERVAL)
+            with self.lock:
+                if not self.subscribers:
+                    # Stop polling once nobody listens; the next subscriber restarts the
+                    # thread and reloads the newest state instead of the missed backlog
+                    self.thread = None
+                    self.stats = self.stats_version = self.last_activity_id = None
+                    self.history.clear()
+                    return
+            try:
+                messages = self._poll()
+            except Exception:
+                logger.exception("Live dashboard poll failed")
+                messages = []
+            finally:
+                close_old_connections()
+            for message in messages:
+                self.publish(message)
+
+    def _poll(self):
+        """Pick up changes since the previous poll; returns the events to publish."""
+        messages = []
+        version = get_version('stats')
+        if version != self.stats_version:
+            stats = shared_stats(version, self.branch_id)
+            if self.stats is not None:
+                deltas = {name: stats[name] - self.stats[name] for name in STAT_NAMES if stats[name] != self.stats[name]}
+                if deltas:
+                    messages.append(format_event('stats', {'values': stats, 'deltas': deltas}))
+            self.stats, self.stats_version = stats, version
+
+        logs = scoped(ActivityLog.objects, self.branch_id).select_related('user')
+        if self.last_activity_id is None:
+            recent = list(logs.order_by('-pk')[:HISTORY_SIZE])[::-1]
+        else:
+            recent = list(logs.filter(pk__gt=self.last_activity_id).order_by('pk')[:HISTORY_SIZE])
+        for log in recent:
+            activity = activity_payload(log)
+            self.history.append(activity)
+            if self.last_activity_id is not None:
+                messages.append(format_event('activity', activity, log.pk))
+        if recent:
+            self.last_activity_id = recent[-1].pk
+        elif self.last_activity_id is None:
+            self.last_activity_id = 0
+        return messages
+
+
+brokers = {}
+brokers_lock = threading.Lock()
+
+
+def get_broker(branch_id=None):
+    with brokers_lock:
+        if branch_id not in brokers:
+            brokers[branch_id] = Broker(branch_id)
+        return brokers[branch_id]
+
+
+def stream(last_event_id=None, branch_id=None):
+    """
+    Events for one client: catch-up first, then published changes, with a
+    heartbeat comment when idle. Ends after LIVE_STREAM_MAX_SECONDS; the
+    browser reconnects by itself with Last-Event-ID.
+    """
+    if not stream_slots.acquire(blocking=False):
+        # Every stream slot of this process is taken; try again later, maybe on another worker
+        yield f'retry: {settings.LIVE_BUSY_RETRY_MS}\n\n'.encode('utf-8')
+        return
+    try:
+        yield from _stream(last_event_id, branch_id)
+    finally:
+        stream_slots.release()
+
+
+def _stream(last_event_id, branch_id):
+    broker = get_broker(branch_id)
+    subscriber, backlog = broker.subscribe(last_event_id)
+    # The stream holds no connection while it waits; the broker does the querying
+    connections.close_all()
+    deadline = time.monotonic() + settings.LIVE_STREAM_MAX_SECONDS
+    try:
+        # Reconnect delay in milliseconds, for when the stream ends
+        yield f'retry: {settings.LIVE_RETRY_MS}\n\n'.encode('utf-8')
+        yield from backlog
+        while time.monotonic() < deadline:
+            try:
+                message = subscriber.queue.get(timeout=settings.LIVE_HEARTBEAT)
+            except queue.Empty:
+                yield b': heartbeat\n\n'
+                continue
+            if subscriber.overflowed:
+                yield format_event('reset', {})
+                return
+            yield message
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+
+from cashback_app import columnar
+from cashback_app.archive import archive_cutoff, archive_shard
+from cashback_app.models import Purchase
+from cashback_app.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Move old purchases into the archive table and fold them into monthly summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=None,
+            help='Archive purchases older than this many days (default: PURCHASE_ARCHIVE_DAYS)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Number of purchases moved per transaction (default: 5000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many purchases would be archived without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options['days'])
+        total_purchases = total_customers = 0
+
+        for alias in shard_aliases():
+            if options['dry_run']:
+                due = Purchase.objects.using(alias).filter(created_at__lt=cutoff)
+                purchases = due.count()
+                customers = due.order_by().values('customer_id').distinct().count()
+                self.stdout.write(f'  {alias}: {purchases} purchases of {customers} customers')
+            else:
+                # Analytics must have every purchase before it leaves the hot table
+                columnar.refresh(alias)
+                purchases, customers = archive_shard(alias, cutoff, batch_size=options['batch_size'])
+                self.stdout.write(f'  {alias}: {purchases} purchases of {customers} customers archived')
+            total_purchases += purchases
+            total_customers += customers
+
+        message = f'{total_purchases} purchases of {total_customers} customers created before {cutoff:%Y-%m-%d}'
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'DRY RUN: Would archive {message}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Successfully archived {message}'))
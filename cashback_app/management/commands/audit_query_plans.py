@@ -0,0 +1,247 @@
+import random
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_databases, setup_test_environment,
+    teardown_databases, teardown_test_environment,
+)
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from cashback_app import sharding, urls
+from cashback_app.models import ActivityLog, CashbackLot, Customer, CustomerToken, Job, Purchase, WalletDebit
+from cashback_app.query_plans import analyze, existing_index, explain, index_definition, normalize
+from cashback_app.sharding import shard_aliases, shard_for_national_code
+
+FIRST_NAMES = ['علی', 'محمد', 'زهرا', 'فاطمه', 'حسین', 'مریم', 'رضا', 'سارا']
+LAST_NAMES = ['محمدی', 'حسینی', 'احمدی', 'رضایی', 'کریمی', 'موسوی', 'جعفری', 'صادقی']
+
+# Query strings exercised in addition to the bare URL
+EXTRA_REQUESTS = {
+    'customer_list': ['?sort=wallet&dir=desc', '?sort=wallet&dir=asc'],
+    'customer_search': ['?name=علی', '?last_name=محمدی', '?phone=0912', '?national_code={national_code}'],
+    'checkout': ['?token={token}'],
+}
+# Logging out would end the audit's session
+SKIPPED_URLS = {'logout'}
+
+
+class _InlineExecutor:
+    """Runs shard fan-out on this thread, where the query capture is installed."""
+
+    @staticmethod
+    def map(func, *iterables):
+        return map(func, *iterables)
+
+
+class Command(BaseCommand):
+    help = 'Run every page against a generated dataset and report full scans and sorts from its query plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--customers',
+            type=int,
+            default=2000,
+            help='Customers in the generated dataset (default: 2000)',
+        )
+        parser.add_argument(
+            '--purchases-per-customer',
+            type=int,
+            default=5,
+            help='Purchases generated per customer (default: 5)',
+        )
+        parser.add_argument(
+            '--min-rows',
+            type=int,
+            default=100,
+            help='Ignore plans on tables with fewer rows, which are cheaper to scan (default: 100)',
+        )
+        parser.add_argument(
+            '--fail-on-findings',
+            action='store_true',
+            help='Exit with an error when any suggested index is missing (for CI)',
+        )
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+        setup_test_environment()
+        # Test databases are created next to the real ones and dropped afterwards
+        old_config = setup_databases(verbosity=0, interactive=False, aliases=set(connections))
+        try:
+            with tempfile.TemporaryDirectory() as var_dir, override_settings(**self._isolated_settings(var_dir)):
+                dataset = self._generate(options['customers'], options['purchases_per_customer'])
+                for alias in connections:
+                    with connections[alias].cursor() as cursor:
+                        cursor.execute('ANALYZE')
+                suggestions = self._audit(dataset, verbosity, options['min_rows'])
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        if not suggestions:
+            self.stdout.write(self.style.SUCCESS('No missing indexes found'))
+            return
+        self.stdout.write('')
+        self.stdout.write(self.style.WARNING(f'{len(suggestions)} suggested indexes (add to Meta.indexes, then makemigrations):'))
+        for definition in sorted(suggestions):
+            self.stdout.write(f'  {definition}')
+        if options['fail_on_findings']:
+            raise CommandError(f'{len(suggestions)} missing indexes')
+
+    def _isolated_settings(self, var_dir):
+        # Keep pages from serving cached fragments, snapshots or jobs of the real installation
+        return {
+            'CACHES': {
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'audit'},
+                'template_fragments': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+                'versions': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'audit-versions'},
+            },
+            'JOB_RESULTS_DIR': f'{var_dir}/jobs',
+            'REPORT_SNAPSHOT_DIR': f'{var_dir}/reports',
+            'PURCHASE_STORE_DIR': f'{var_dir}/purchase_store',
+            'PROFILE_DIR': f'{var_dir}/profiles',
+        }
+
+    def _generate(self, customer_count, purchases_per_customer):
+        rng = random.Random(0)
+        admin = User.objects.create_superuser('audit', password=None)
+        operator = User.objects.create_user('audit-operator', password=None)
+        now = timezone.now()
+
+        by_shard = {}
+        for index in range(customer_count):
+            national_code = f'{index:010d}'
+            by_shard.setdefault(shard_for_national_code(national_code), []).append(Customer(
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=rng.choice(LAST_NAMES),
+                national_code=national_code,
+                phone_number=f'0912{rng.randrange(10 ** 7):07d}',
+                wallet_balance=Decimal(rng.randrange(0, 500000)),
+                created_by=operator,
+            ))
+        for alias, customers in by_shard.items():
+            Customer.objects.using(alias).bulk_create(customers, batch_size=1000)
+
+        logs = []
+        for alias in shard_aliases():
+            customers = list(Customer.objects.using(alias).order_by('pk'))
+            purchases, lots, debits = [], [], []
+            for customer in customers:
+                for _ in range(purchases_per_customer):
+                    amount = Decimal(rng.randrange(10000, 5000000, 1000))
+                    purchases.append(Purchase(customer=customer, amount=amount, cashback_amount=amount / 20,
+                                              created_by=operator))
+                debits.append(WalletDebit(customer=customer, amount=Decimal(1000), reason='audit',
+                                          created_by=operator))
+                logs.append(ActivityLog(user=operator, activity_type='purchase_create', description='audit',
+                                        customer_id=customer.pk))
+            purchases = Purchase.objects.using(alias).bulk_create(purchases, batch_size=1000)
+            for purchase in purchases:
+                lots.append(CashbackLot(customer_id=purchase.customer_id, purchase=purchase,
+                                        amount=purchase.cashback_amount, remaining=purchase.cashback_amount,
+                                        expires_at=now + timedelta(days=rng.randrange(-30, 365))))
+            CashbackLot.objects.using(alias).bulk_create(lots, batch_size=1000)
+            WalletDebit.objects.using(alias).bulk_create(debits, batch_size=1000)
+
+            CustomerToken.objects.bulk_create(
+                [CustomerToken(token=f'AUDIT-{customer.pk}', customer_id=customer.pk) for customer in customers],
+                batch_size=1000,
+            )
+        ActivityLog.objects.bulk_create(logs, batch_size=1000)
+
+        customer = Customer.objects.using(shard_aliases()[0]).order_by('pk').first()
+        token = CustomerToken.objects.get(customer_id=customer.pk)
+        job = Job.objects.create(kind='customer_export', status='succeeded', progress=100, created_by=admin)
+        return {'admin': admin, 'customer': customer, 'token': token, 'job': job}
+
+    def _requests(self, dataset):
+        """(url name, path) of every named route, with ids from the generated dataset."""
+        values = {
+            'national_code': dataset['customer'].national_code,
+            'token': dataset['token'].token,
+        }
+        for pattern in urls.urlpatterns:
+            if not isinstance(pattern, URLPattern) or not pattern.name or pattern.name in SKIPPED_URLS:
+                continue
+            kwargs = {}
+            for name in pattern.pattern.converters:
+                if name == 'pk' and pattern.name.startswith('job'):
+                    kwargs[name] = dataset['job'].pk
+                elif name == 'token_id':
+                    kwargs[name] = dataset['token'].pk
+                else:
+                    kwargs[name] = dataset['customer'].pk
+            path = reverse(pattern.name, kwargs=kwargs)
+            yield pattern.name, path
+            for query in EXTRA_REQUESTS.get(pattern.name, []):
+                yield pattern.name, path + query.format(**values)
+
+    def _audit(self, dataset, verbosity, min_rows):
+        self.min_rows = min_rows
+        self.table_rows = {}
+        client = Client()
+        suggestions = set()
+        explained = set()
+        sharding._executor = _InlineExecutor()
+        try:
+            for name, path in self._requests(dataset):
+                client.force_login(dataset['admin'])
+                captures = [CaptureQueriesContext(connections[alias]) for alias in connections]
+                for capture in captures:
+                    capture.__enter__()
+                try:
+                    response = client.get(path)
+                finally:
+                    for capture in reversed(captures):
+                        capture.__exit__(None, None, None)
+
+                queries = sum(len(capture) for capture in captures)
+                self.stdout.write(f'{name} {path} -> {response.status_code}, {queries} queries')
+                for capture in captures:
+                    for query in capture.captured_queries:
+                        shape = (capture.connection.alias, normalize(query['sql']))
+                        if shape in explained:
+                            continue
+                        explained.add(shape)
+                        suggestions |= self._report(capture.connection, query['sql'], verbosity)
+        finally:
+            sharding._executor = None
+        return suggestions
+
+    def _report(self, connection, sql, verbosity):
+        plan = explain(connection, sql)
+        if plan is None:
+            return set()
+        findings = [finding for finding in analyze(connection, sql, plan)
+                    if self._row_count(connection, finding.table) >= self.min_rows]
+        if not findings and verbosity < 2:
+            return set()
+
+        self.stdout.write(f'    {sql[:300]}{"..." if len(sql) > 300 else ""}')
+        for line in plan:
+            self.stdout.write(f'      | {line}')
+        suggestions = set()
+        for finding in findings:
+            if finding.index:
+                index_name = existing_index(connection, *finding.index)
+                if index_name:
+                    self.stdout.write(f'      [{finding.kind}] {finding.table}: index {index_name} exists '
+                                      f'but is not used for this statement')
+                    continue
+                suggestions.add(index_definition(*finding.index))
+            self.stdout.write(self.style.WARNING(f'      [{finding.kind}] {finding.table}: {finding.suggestion()}'))
+        return suggestions
+
+    def _row_count(self, connection, table):
+        key = (connection.alias, table)
+        if key not in self.table_rows:
+            with connection.cursor() as cursor:
+                cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+                self.table_rows[key] = cursor.fetchone()[0]
+        return self.table_rows[key]
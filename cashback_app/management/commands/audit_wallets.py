@@ -0,0 +1,117 @@
+import multiprocessing
+import os
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Max, Min
+from cashback_app.audit import audit_range, backfill_debits, repair_customer
+from cashback_app.models import Customer
+from cashback_app.sharding import shard_aliases
+
+
+def _init_worker():
+    # Forked workers must open their own database connections
+    for connection in connections.all():
+        connection.close()
+
+
+def _audit_task(task):
+    alias, lo, hi, sample_limit, repair = task
+    checked, drifted, total_drift, samples = audit_range(alias, lo, hi, sample_limit)
+    repaired = 0
+    if repair and drifted:
+        # Samples only hold the first few drifts; re-scan the range to fix all
+        _, _, _, all_drifts = audit_range(alias, lo, hi, sample_limit=drifted)
+        for customer_id, _, _ in all_drifts:
+            repair_customer(alias, customer_id)
+            repaired += 1
+    return alias, checked, drifted, total_drift, samples, repaired
+
+
+class Command(BaseCommand):
+    help = 'Recompute wallet balances from purchases, debits and expiries and report (or repair) drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes (default: CPU count)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=20000,
+            help='Customer ids per work unit (default: 20000)',
+        )
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            help='Overwrite drifted balances with the recomputed value',
+        )
+        parser.add_argument(
+            '--report-limit',
+            type=int,
+            default=20,
+            help='Number of drifted customers to list (default: 20)',
+        )
+        parser.add_argument(
+            '--backfill-debits',
+            action='store_true',
+            help='First create debit records from old wallet_reduction activity logs',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        report_limit = options['report_limit']
+
+        if options['backfill_debits']:
+            for alias in shard_aliases():
+                created, unparseable = backfill_debits(alias)
+                self.stdout.write(f'{alias}: backfilled {created} debits ({unparseable} logs not parseable)')
+
+        tasks = []
+        for alias in shard_aliases():
+            bounds = Customer.objects.using(alias).aggregate(lo=Min('pk'), hi=Max('pk'))
+            if bounds['lo'] is None:
+                continue
+            for lo in range(bounds['lo'], bounds['hi'] + 1, chunk_size):
+                tasks.append((alias, lo, lo + chunk_size, report_limit, options['repair']))
+
+        checked = drifted = repaired = 0
+        total_drift = Decimal(0)
+        samples = []
+
+        def collect(result):
+            nonlocal checked, drifted, repaired, total_drift
+            alias, range_checked, range_drifted, range_drift, range_samples, range_repaired = result
+            checked += range_checked
+            drifted += range_drifted
+            repaired += range_repaired
+            total_drift += range_drift
+            samples.extend((alias, *sample) for sample in range_samples[:report_limit - len(samples)])
+
+        workers = max(1, min(options['workers'], len(tasks)))
+        if workers == 1:
+            for task in tasks:
+                collect(_audit_task(task))
+        else:
+            for connection in connections.all():
+                connection.close()
+            context = multiprocessing.get_context('fork')
+            with context.Pool(workers, initializer=_init_worker) as pool:
+                # Results stream back as ranges finish; nothing is held per customer
+                for done, result in enumerate(pool.imap_unordered(_audit_task, tasks), start=1):
+                    collect(result)
+                    if done % 50 == 0:
+                        self.stdout.write(f'  {done}/{len(tasks)} ranges audited')
+
+        for alias, customer_id, stored, expected in samples:
+            self.stdout.write(f'  {alias} customer #{customer_id}: stored {stored:,} expected {expected:,} '
+                              f'(drift {stored - expected:+,})')
+        summary = f'Audited {checked} customers: {drifted} drifted, total drift {total_drift:,} ریال'
+        if options['repair']:
+            summary += f', {repaired} repaired'
+        style = self.style.SUCCESS if drifted == 0 or repaired == drifted else self.style.WARNING
+        self.stdout.write(style(summary))
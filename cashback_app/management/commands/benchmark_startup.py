@@ -0,0 +1,186 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: load the WSGI application like a worker does,
+# serve the first requests and report timings and memory as JSON. With
+# workers > 0 it loads once and forks, like gunicorn's preload_app.
+PROBE = '''
+import json, os, sys, time
+spawned, path, workers = float(sys.argv[1]), sys.argv[2], int(sys.argv[3])
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cashback_project.settings')
+started = time.perf_counter()
+from cashback_project.wsgi import application
+from cashback_app.startup import first_response, memory_kb
+loaded = time.perf_counter() - started
+
+def serve():
+    status, seconds = first_response(application, path)
+    ready_after = time.time()
+    for _ in range(20):
+        first_response(application, path)
+    return {'status': status, 'first_response': seconds, **memory_kb()}, ready_after
+
+if not workers:
+    result, ready_after = serve()
+    print(json.dumps({'load': loaded, 'ready_after': ready_after - spawned, **result}))
+    sys.exit()
+
+master = memory_kb()
+children = []
+for _ in range(workers):
+    read, write = os.pipe()
+    forked = time.time()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        result, ready_after = serve()
+        os.write(write, json.dumps({'ready_after': ready_after - forked, **result}).encode())
+        os._exit(0)
+    os.close(write)
+    children.append((pid, read))
+results = []
+for pid, read in children:
+    with os.fdopen(read) as f:
+        results.append(json.loads(f.read()))
+    os.waitpid(pid, 0)
+print(json.dumps({'load': loaded, 'master': master, 'workers': results}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Measure worker time-to-first-response and memory, cold and with a preloaded master'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Workers forked from the preloaded master (default: 4)',
+        )
+        parser.add_argument(
+            '--runs',
+            type=int,
+            default=3,
+            help='Cold worker starts to take the median of (default: 3)',
+        )
+        parser.add_argument(
+            '--path',
+            default='/login/',
+            help='Page requested by each worker (default: /login/, which needs no session)',
+        )
+        parser.add_argument(
+            '--imports',
+            type=int,
+            default=10,
+            help='Show the packages with the largest import time, this many (default: 10, 0 to skip)',
+        )
+        parser.add_argument(
+            '--no-record',
+            action='store_true',
+            help='Do not append the results to BENCHMARK_DIR/startup.jsonl',
+        )
+
+    def handle(self, *args, **options):
+        if not Path('/proc/self/smaps_rollup').exists():
+            raise CommandError('Needs Linux /proc to fork workers and read their memory')
+
+        cold = [self._probe(options['path'], 0, warmup=False) for _ in range(max(1, options['runs']))]
+        preload = self._probe(options['path'], options['workers'], warmup=True)
+        workers = preload['workers']
+        if any(run['status'] != '200 OK' for run in cold + workers):
+            raise CommandError(f'{options["path"]} did not answer 200 OK')
+
+        results = {
+            'cold_load_ms': statistics.median(run['load'] for run in cold) * 1000,
+            'cold_ready_ms': statistics.median(run['ready_after'] for run in cold) * 1000,
+            'cold_first_response_ms': statistics.median(run['first_response'] for run in cold) * 1000,
+            'cold_rss_mb': statistics.median(run['rss'] for run in cold) / 1024,
+            'preload_master_load_ms': preload['load'] * 1000,
+            'preload_master_rss_mb': preload['master']['rss'] / 1024,
+            'preload_ready_ms': statistics.median(run['ready_after'] for run in workers) * 1000,
+            'preload_first_response_ms': statistics.median(run['first_response'] for run in workers) * 1000,
+            'preload_worker_private_mb': statistics.median(run['private'] for run in workers) / 1024,
+        }
+        count = len(workers)
+        results[f'total_cold_{count}_workers_mb'] = results['cold_rss_mb'] * count
+        results[f'total_preload_{count}_workers_mb'] = (
+            results['preload_master_rss_mb'] + results['preload_worker_private_mb'] * count
+        )
+
+        previous = self._previous()
+        self.stdout.write(f'{"metric":<36}{"value":>10}{"previous":>12}')
+        for name, value in results.items():
+            before = previous.get(name)
+            self.stdout.write(f'{name:<36}{value:>10.1f}{"" if before is None else f"{before:>12.1f}"}')
+
+        if options['imports']:
+            self.stdout.write('')
+            self.stdout.write('Import time by package (cold worker, self time):')
+            for package, seconds in self._import_profile()[:options['imports']]:
+                self.stdout.write(f'  {package:<30}{seconds * 1000:>8.1f} ms')
+
+        if not options['no_record']:
+            self._record(results)
+        self.stdout.write(self.style.SUCCESS(
+            f'Preloaded workers are ready after {results["preload_ready_ms"]:.0f} ms '
+            f'(cold: {results["cold_ready_ms"]:.0f} ms) and use {results["preload_worker_private_mb"]:.1f} MB '
+            f'of their own memory (cold: {results["cold_rss_mb"]:.1f} MB)'
+        ))
+
+    def _run_probe(self, path, workers, warmup, extra_args=()):
+        env = {**os.environ, 'CASHBACK_WARMUP': '1' if warmup else '0'}
+        completed = subprocess.run(
+            [sys.executable, *extra_args, '-c', PROBE, str(time.time()), path, str(workers)],
+            capture_output=True, text=True, cwd=settings.BASE_DIR, env=env,
+        )
+        if completed.returncode != 0:
+            raise CommandError(f'Startup probe failed:\n{completed.stderr[-2000:]}')
+        return completed
+
+    def _probe(self, path, workers, warmup):
+        completed = self._run_probe(path, workers, warmup)
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def _import_profile(self):
+        """(top-level package, seconds) of a cold start's imports, largest first."""
+        completed = self._run_probe('/login/', 0, warmup=False, extra_args=('-X', 'importtime'))
+        totals = {}
+        for line in completed.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            own, _, name = line[len('import time:'):].split('|')
+            package = name.strip().split('.')[0]
+            totals[package] = totals.get(package, 0) + int(own) / 1e6
+        return sorted(totals.items(), key=lambda item: item[1], reverse=True)
+
+    def _history_path(self):
+        return Path(settings.BENCHMARK_DIR) / 'startup.jsonl'
+
+    def _previous(self):
+        try:
+            lines = self._history_path().read_text(encoding='utf-8').splitlines()
+        except FileNotFoundError:
+            return {}
+        return json.loads(lines[-1])['results'] if lines else {}
+
+    def _record(self, results):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                    cwd=settings.BASE_DIR).stdout.strip()
+        except OSError:
+            commit = ''
+        path = self._history_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit,
+                 'results': {name: round(value, 2) for name, value in results.items()}}
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+        self.stdout.write(f'Recorded in {path}')
@@ -0,0 +1,73 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from cashback_app import views
+from cashback_app.models import Customer
+
+
+class Command(BaseCommand):
+    help = 'Measure page render time with and without cached template fragments'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=50,
+            help='Number of renders per page and mode (default: 50)',
+        )
+        parser.add_argument(
+            '--username',
+            help='User to render pages as (default: first superuser)',
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        if options['username']:
+            user = User.objects.filter(username=options['username']).first()
+        else:
+            user = User.objects.filter(is_superuser=True).first()
+        if user is None:
+            raise CommandError('No user found to render pages as')
+
+        customer = Customer.objects.order_by('pk').first()
+        pages = [
+            ('dashboard', '/', views.dashboard, {}),
+            ('customer_list', '/customers/', views.customer_list, {}),
+        ]
+        if customer:
+            pages.append(('customer_detail', f'/customers/{customer.pk}/', views.customer_detail, {'pk': customer.pk}))
+
+        factory = RequestFactory()
+        fragments = caches['template_fragments']
+
+        def render(view, path, kwargs):
+            request = factory.get(path)
+            request.user = user
+            response = view(request, **kwargs)
+            return len(response.content)
+
+        self.stdout.write(f'{"page":<18}{"uncached ms":>14}{"cached ms":>12}{"speedup":>10}')
+        # Views may write activity logs; keep the benchmark from touching real data
+        with transaction.atomic():
+            for name, path, view, kwargs in pages:
+                elapsed = 0
+                for _ in range(iterations):
+                    fragments.clear()
+                    start = time.perf_counter()
+                    render(view, path, kwargs)
+                    elapsed += time.perf_counter() - start
+                cold = elapsed * 1000 / iterations
+
+                render(view, path, kwargs)
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    render(view, path, kwargs)
+                warm = (time.perf_counter() - start) * 1000 / iterations
+
+                speedup = cold / warm if warm else 0
+                self.stdout.write(f'{name:<18}{cold:>14.2f}{warm:>12.2f}{speedup:>9.1f}x')
+            transaction.set_rollback(True)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from cashback_app.jobs import enqueue
+from cashback_app.snapshots import build_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Precompute the reports page and CSV into a new snapshot (run nightly from cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--background',
+            action='store_true',
+            help='Queue the snapshot for the job workers instead of building it now',
+        )
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('report_snapshot')
+            self.stdout.write(self.style.SUCCESS(f'Queued report snapshot as job #{job.pk}'))
+            return
+
+        version = build_snapshot()
+        self.stdout.write(self.style.SUCCESS(f'Built report snapshot {version}'))
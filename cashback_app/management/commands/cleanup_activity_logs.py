@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from datetime import timedelta
+from cashback_app.jobs import enqueue
 from cashback_app.models import ActivityLog
 
 
@@ -19,10 +20,20 @@ class Command(BaseCommand):
             default=6,
             help='Number of months to keep (default: 6)',
         )
+        parser.add_argument(
+            '--background',
+            action='store_true',
+            help='Queue the cleanup for the job workers instead of running it now',
+        )
 
     def handle(self, *args, **options):
         months = options['months']
         dry_run = options['dry_run']
+
+        if options['background'] and not dry_run:
+            job = enqueue('cleanup_activity_logs', payload={'months': months})
+            self.stdout.write(self.style.SUCCESS(f'Queued cleanup as job #{job.pk}'))
+            return
         
         # Calculate the cutoff date
         cutoff_date = timezone.now() - timedelta(days=months * 30)
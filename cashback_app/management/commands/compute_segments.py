@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from cashback_app.jobs import enqueue
+from cashback_app.models import CustomerSegment
+from cashback_app.sharding import scatter
+
+
+class Command(BaseCommand):
+    help = ('Recompute the RFM customer segments: only customers with new purchases, or everyone with --full '
+            '(run --full nightly and the incremental refresh often, from cron)')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Score every customer and recompute the quintile edges',
+        )
+        parser.add_argument(
+            '--background',
+            action='store_true',
+            help='Queue the computation for the job workers instead of running it now',
+        )
+
+    def handle(self, *args, **options):
+        if options['background']:
+            job = enqueue('customer_segments', payload={'full': options['full']})
+            self.stdout.write(self.style.SUCCESS(f'Queued segment computation as job #{job.pk}'))
+            return
+
+        from cashback_app.segments import refresh_segments
+        started = time.perf_counter()
+        run = refresh_segments(full=options['full'])
+
+        sizes = {}
+        for shard in scatter(lambda alias: CustomerSegment.objects.using(alias).order_by()
+                             .values_list('segment').annotate(count=Count('pk'))):
+            for segment, count in shard:
+                sizes[segment] = sizes.get(segment, 0) + count
+        for segment, label in CustomerSegment.SEGMENTS:
+            self.stdout.write(f'  {segment:<20}{sizes.get(segment, 0):>10,}  {label}')
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Full' if run.full else 'Incremental'} run scored {run.customers:,} customers "
+            f"in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.utils import timezone
+from cashback_app.models import CashbackLot, ChangeEvent, Customer
+from cashback_app.sharding import shard_aliases
+from cashback_app.versioning import bump_version
+
+
+class Command(BaseCommand):
+    help = 'Expire cashback lots past their expiry date and deduct them from wallets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of customers handled per transaction (default: 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would expire without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+        now = timezone.now()
+        total_lots = total_customers = 0
+        total_amount = 0
+
+        for alias in shard_aliases():
+            # Only open lots are in the partial expiry index, so this never
+            # touches customers without something to expire
+            due = CashbackLot.objects.using(alias).filter(remaining__gt=0, expires_at__lte=now)
+
+            if dry_run:
+                summary = due.aggregate(amount=Sum('remaining'))
+                lots = due.count()
+                customers = due.order_by().values('customer_id').distinct().count()
+                self.stdout.write(f'  {alias}: {lots} lots of {customers} customers, {summary["amount"] or 0:,} ریال')
+                total_lots += lots
+                total_customers += customers
+                total_amount += summary['amount'] or 0
+                continue
+
+            while True:
+                customer_ids = list(due.order_by().values_list('customer_id', flat=True).distinct()[:batch_size])
+                if not customer_ids:
+                    break
+                with transaction.atomic(using=alias):
+                    # Lock the lots first, so a debit consuming one of them waits and both
+                    # UPDATEs below expire exactly the amounts read here
+                    rows = list(due.filter(customer_id__in=customer_ids).select_for_update()
+                                .values_list('pk', 'customer_id', 'remaining'))
+                    amounts = {}
+                    for _, customer_id, remaining in rows:
+                        amounts[customer_id] = amounts.get(customer_id, 0) + remaining
+                    lots = CashbackLot.objects.using(alias).filter(pk__in=[pk for pk, _, _ in rows]).update(
+                        expired_amount=F('remaining'), remaining=0, expired_at=now,
+                    )
+                    # One UPDATE for the whole batch, each customer losing its own total
+                    Customer.objects.using(alias).filter(pk__in=amounts).update(
+                        wallet_balance=F('wallet_balance') - Case(
+                            *[When(pk=customer_id, then=Value(amount)) for customer_id, amount in amounts.items()],
+                            output_field=DecimalField(max_digits=12, decimal_places=0),
+                        ),
+                        updated_at=now,
+                    )
+                    ChangeEvent.record_rows(Customer, alias, amounts)
+                total_lots += lots
+                total_customers += len(amounts)
+                total_amount += sum(amounts.values())
+
+        message = f'{total_lots} cashback lots of {total_customers} customers ({total_amount:,} ریال)'
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'DRY RUN: Would expire {message}'))
+        else:
+            if total_lots:
+                # Wallets changed with bulk UPDATEs, which send no signals
+                bump_version('stats')
+            self.stdout.write(self.style.SUCCESS(f'Successfully expired {message}'))
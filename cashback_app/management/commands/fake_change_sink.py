@@ -0,0 +1,108 @@
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from cashback_app.changefeed import read_chunk
+
+
+class FakeConsumer:
+    """State of the fake consumer: the last event id seen per shard and counters."""
+
+    def __init__(self, latency, fail_rate, output):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.output = output
+        self.lock = threading.Lock()
+        self.last_ids = {}
+        self.received = 0
+        self.duplicates = 0
+        self.chunks = 0
+        self.bytes = 0
+
+    def accept(self, shard, events, size):
+        with self.lock:
+            self.chunks += 1
+            self.bytes += size
+            for event in events:
+                # Events of a shard arrive in id order; anything not newer is a redelivery
+                if event['id'] <= self.last_ids.get(shard, 0):
+                    self.duplicates += 1
+                    continue
+                self.last_ids[shard] = event['id']
+                self.received += 1
+                if self.output:
+                    self.output.write(json.dumps(event, ensure_ascii=False) + '\n')
+            if self.output:
+                self.output.flush()
+
+
+def make_handler(consumer):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            try:
+                events = read_chunk(body)
+            except (OSError, EOFError, zlib.error, ValueError):
+                return self._reply(400, {'error': 'expected gzip-compressed JSON lines'})
+            if consumer.latency:
+                time.sleep(consumer.latency)
+            if random.random() < consumer.fail_rate:
+                return self._reply(503, {'error': 'simulated outage'})
+            consumer.accept(self.headers.get('X-Change-Shard', ''), events, len(body))
+            self._reply(200, {'accepted': len(events)})
+
+        def _reply(self, status, payload):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake change feed consumer for HttpSink (development and tests)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8026, help='Port to listen on (default: 8026)')
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.0,
+            help='Seconds each chunk takes to answer (default: 0)',
+        )
+        parser.add_argument(
+            '--fail-rate',
+            type=float,
+            default=0.0,
+            help='Fraction of chunks answered with 503 (default: 0)',
+        )
+        parser.add_argument('--output', help='Append received events to this JSON lines file')
+
+    def handle(self, *args, **options):
+        output = open(options['output'], 'a', encoding='utf-8') if options['output'] else None
+        consumer = FakeConsumer(options['latency'], options['fail_rate'], output)
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), make_handler(consumer))
+        self.stdout.write(f'Fake change feed consumer on http://127.0.0.1:{options["port"]}/ (Ctrl+C to stop)')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if output:
+                output.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Received {consumer.received} events in {consumer.chunks} chunks ({consumer.bytes:,} bytes), '
+            f'dropped {consumer.duplicates} redelivered events'
+        ))
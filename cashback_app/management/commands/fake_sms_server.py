@@ -0,0 +1,122 @@
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+
+class FakeGateway:
+    """State of the fake gateway: delivered ids (for deduplication) and a rate window."""
+
+    def __init__(self, latency, fail_rate, rate_limit, output):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rate_limit = rate_limit
+        self.output = output
+        self.lock = threading.Lock()
+        self.delivered = {}
+        self.duplicates = 0
+        self.window_start = time.monotonic()
+        self.window_count = 0
+
+    def over_rate(self, count):
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1:
+                self.window_start, self.window_count = now, 0
+            if self.window_count + count > self.rate_limit:
+                return True
+            self.window_count += count
+            return False
+
+    def deliver(self, message):
+        with self.lock:
+            if message['id'] in self.delivered:
+                self.duplicates += 1
+                return {'id': message['id'], 'status': 'duplicate', 'message_id': self.delivered[message['id']]}
+            message_id = uuid.uuid4().hex
+            self.delivered[message['id']] = message_id
+            if self.output:
+                self.output.write(json.dumps({**message, 'message_id': message_id}, ensure_ascii=False) + '\n')
+                self.output.flush()
+        return {'id': message['id'], 'status': 'sent', 'message_id': message_id}
+
+
+def make_handler(gateway):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)))
+                messages = body['messages']
+            except (ValueError, KeyError, TypeError):
+                return self._reply(400, {'error': 'expected {"messages": [...]}'})
+            if gateway.latency:
+                time.sleep(gateway.latency)
+            if random.random() < gateway.fail_rate:
+                return self._reply(503, {'error': 'simulated outage'})
+            if gateway.over_rate(len(messages)):
+                return self._reply(429, {'error': 'rate limit exceeded'}, {'Retry-After': '1'})
+            self._reply(200, {'results': [gateway.deliver(message) for message in messages]})
+
+        def _reply(self, status, payload, headers=None):
+            data = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake SMS gateway for HttpProvider (development and tests)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--port', type=int, default=8025, help='Port to listen on (default: 8025)')
+        parser.add_argument(
+            '--latency',
+            type=float,
+            default=0.05,
+            help='Seconds each batch takes to answer (default: 0.05)',
+        )
+        parser.add_argument(
+            '--fail-rate',
+            type=float,
+            default=0.0,
+            help='Fraction of batches answered with 503 (default: 0)',
+        )
+        parser.add_argument(
+            '--rate-limit',
+            type=int,
+            default=0,
+            help='Messages per second before answering 429 (default: unlimited)',
+        )
+        parser.add_argument('--output', help='Append delivered messages to this JSON lines file')
+
+    def handle(self, *args, **options):
+        output = open(options['output'], 'a', encoding='utf-8') if options['output'] else None
+        gateway = FakeGateway(options['latency'], options['fail_rate'], options['rate_limit'], output)
+        server = ThreadingHTTPServer(('127.0.0.1', options['port']), make_handler(gateway))
+        self.stdout.write(f'Fake SMS gateway on http://127.0.0.1:{options["port"]}/ (Ctrl+C to stop)')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if output:
+                output.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Delivered {len(gateway.delivered)} messages, rejected {gateway.duplicates} duplicates'
+        ))
@@ -0,0 +1,55 @@
+import time
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from cashback_app.importer import CustomerImportError, import_customers
+
+
+class Command(BaseCommand):
+    help = 'Bulk import customers from a CSV or XLSX file; rejected rows are written to an error CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file with first_name, last_name, national_code, phone_number columns')
+        parser.add_argument(
+            '--errors',
+            help='Where to write rejected rows (default: <file>.errors.csv next to the input)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=5000,
+            help='Rows checked and inserted per batch (default: 5000)',
+        )
+        parser.add_argument(
+            '--user',
+            help='Username recorded as the creator of the imported customers',
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'File not found: {path}')
+        error_path = Path(options['errors'] or path.with_name(f'{path.stem}.errors.csv'))
+
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Unknown user: {options['user']}")
+
+        def progress(percent, message):
+            self.stdout.write(f'  {percent:5.1f}%  {message}')
+
+        started = time.perf_counter()
+        try:
+            result = import_customers(path, error_path, created_by=user, chunk_size=options['chunk_size'],
+                                      progress=progress)
+        except CustomerImportError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.created:,} of {result.rows:,} rows in {time.perf_counter() - started:.1f}s'
+        ))
+        if result.rejected:
+            self.stdout.write(self.style.WARNING(f'{result.rejected:,} rows rejected, see {error_path}'))
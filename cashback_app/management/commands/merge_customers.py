@@ -0,0 +1,93 @@
+import csv
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from cashback_app.dedup import get_customer, merge_customers
+
+
+def _groups(pairs):
+    """Union pairs into groups of customer ids that should become one customer."""
+    parent = {}
+
+    def find(customer_id):
+        parent.setdefault(customer_id, customer_id)
+        while parent[customer_id] != customer_id:
+            parent[customer_id] = parent[parent[customer_id]]
+            customer_id = parent[customer_id]
+        return customer_id
+
+    for a, b in pairs:
+        parent[find(a)] = find(b)
+    groups = {}
+    for customer_id in parent:
+        groups.setdefault(find(customer_id), []).append(customer_id)
+    return list(groups.values())
+
+
+class Command(BaseCommand):
+    help = 'Merge duplicate customers into one: purchases, debits, wallet balance and activity logs move to the survivor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('customer_ids', nargs='*', type=int,
+                            help='Surviving customer id followed by the duplicate ids')
+        parser.add_argument(
+            '--from-file',
+            help='Merge the pairs listed by find_duplicate_customers; the oldest customer of each group survives',
+        )
+        parser.add_argument(
+            '--min-score',
+            type=float,
+            default=0.8,
+            help='With --from-file, only merge pairs scoring at least this (default: 0.8)',
+        )
+        parser.add_argument(
+            '--user',
+            help='Username recorded in the activity log for each merge',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show what would be merged without changing anything',
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Unknown user: {options['user']}")
+
+        if options['from_file']:
+            with open(options['from_file'], newline='', encoding='utf-8-sig') as f:
+                pairs = [(int(row['customer_id']), int(row['duplicate_id'])) for row in csv.DictReader(f)
+                         if float(row['score']) >= options['min_score']]
+            groups = [(None, group) for group in _groups(pairs)]
+        elif len(options['customer_ids']) >= 2:
+            groups = [(options['customer_ids'][0], options['customer_ids'])]
+        else:
+            raise CommandError('Give a surviving customer id and at least one duplicate id, or --from-file')
+
+        merged = 0
+        for keep_id, ids in groups:
+            customers = [customer for customer in map(get_customer, ids) if customer is not None]
+            if len(customers) < 2:
+                continue
+            if keep_id is None:
+                keep = min(customers, key=lambda customer: (customer.created_at, customer.pk))
+            else:
+                keep = next((customer for customer in customers if customer.pk == keep_id), None)
+                if keep is None:
+                    raise CommandError(f'Customer #{keep_id} not found')
+            duplicates = [customer for customer in customers if customer.pk != keep.pk]
+            label = ', '.join(f'#{dup.pk}' for dup in duplicates)
+            if options['dry_run']:
+                self.stdout.write(f'  would merge {label} into #{keep.pk} {keep}')
+            else:
+                keep = merge_customers(keep, duplicates, user=user)
+                self.stdout.write(f'  merged {label} into #{keep.pk} {keep} (wallet {keep.wallet_balance:,})')
+            merged += len(duplicates)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'DRY RUN: Would merge {merged} customers'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Merged {merged} duplicate customers'))
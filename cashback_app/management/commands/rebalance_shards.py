@@ -0,0 +1,54 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from cashback_app.models import Customer
+from cashback_app.sharding import move_customer, shard_aliases, shard_for_national_code
+
+
+class Command(BaseCommand):
+    help = 'Move customers (with their purchases) to the shard their national code hashes to'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Show how many customers would move without moving them',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of customers read per query (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+        moves = Counter()
+
+        for source in shard_aliases():
+            last_pk = 0
+            while True:
+                # Moved customers leave this shard, so page by id rather than offset
+                batch = list(Customer.objects.using(source).filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                for customer in batch:
+                    target = shard_for_national_code(customer.national_code)
+                    if target == source:
+                        continue
+                    moves[(source, target)] += 1
+                    if not dry_run:
+                        move_customer(customer, target)
+
+        if not moves:
+            self.stdout.write(self.style.SUCCESS('All customers are already on their shard'))
+            return
+        for (source, target), count in sorted(moves.items()):
+            self.stdout.write(f'  {source} -> {target}: {count} customers')
+        total = sum(moves.values())
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'DRY RUN: Would move {total} customers'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Successfully moved {total} customers'))
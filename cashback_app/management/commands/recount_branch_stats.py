@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from cashback_app import columnar
+from cashback_app.branches import assign_unassigned, assign_unassigned_logs, recount
+from cashback_app.models import Branch
+from cashback_app.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = "Rebuild each branch's customer, purchase and cashback counters from the tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--assign',
+            metavar='BRANCH_CODE',
+            help='First put customers, purchases and activity logs without a branch into this branch',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows assigned per transaction with --assign (default: 5000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report counters that differ from the tables',
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        if options['assign']:
+            try:
+                branch = Branch.objects.get(code=options['assign'])
+            except Branch.DoesNotExist:
+                raise CommandError(f"Unknown branch code: {options['assign']}")
+            if dry_run:
+                raise CommandError('--assign changes rows and cannot be combined with --dry-run')
+            for alias in shard_aliases():
+                assigned = assign_unassigned(alias, branch.pk, batch_size=options['batch_size'])
+                self.stdout.write(f'  {alias}: ' + ', '.join(f'{count} {name}' for name, count in assigned.items()))
+            logs = assign_unassigned_logs(branch.pk, batch_size=options['batch_size'])
+            self.stdout.write(f'  {logs} activity logs assigned to {branch}')
+            # The analytics store holds the purchases' old (empty) branch
+            columnar.refresh_all(rebuild=True)
+
+        total = 0
+        for alias in shard_aliases():
+            mismatches = recount(alias, dry_run=dry_run)
+            for branch_id, field, stored, counted in mismatches:
+                self.stdout.write(f'  {alias}: branch {branch_id} {field}: {stored} -> {counted}')
+            total += len(mismatches)
+
+        if not total:
+            self.stdout.write(self.style.SUCCESS('Branch counters match the tables'))
+        elif dry_run:
+            self.stdout.write(self.style.WARNING(f'{total} counters differ (dry run, nothing changed)'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{total} counters corrected'))
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+from cashback_app.columnar import read_meta, refresh_all
+from cashback_app.sharding import shard_aliases
+
+
+class Command(BaseCommand):
+    help = 'Append new purchases to the columnar analytics store (the report snapshot also does this)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50000,
+            help='Purchases read from the database per query (default: 50000)',
+        )
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Discard the store and export every purchase again (moves, merges and purchase edits do this by themselves)',
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        added = refresh_all(batch_size=options['batch_size'], rebuild=options['rebuild'])
+        for alias in shard_aliases():
+            meta = read_meta(alias)
+            self.stdout.write(
+                f"  {alias}: +{added[alias]:,} rows, {meta['rows']:,} total (up to purchase #{meta['high_water_mark']})"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Added {sum(added.values()):,} purchases in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,97 @@
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cashback_app.changefeed import SinkError, get_sink, purge_delivered, relay_shard
+from cashback_app.sharding import scatter
+
+
+class Command(BaseCommand):
+    help = 'Deliver new change feed events to downstream consumers in ordered, compressed chunks'
+
+    # Seconds between purges of events every consumer has received
+    purge_interval = 3600
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--consumer',
+            action='append',
+            dest='consumers',
+            help='Consumer from CHANGE_FEED_CONSUMERS to relay to; repeat for several (default: all)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=10000,
+            help='Events per chunk (default: 10000)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when there is nothing new (default: 1)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Deliver what is there and exit instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        consumers = options['consumers'] or list(settings.CHANGE_FEED_CONSUMERS)
+        if not consumers:
+            raise CommandError('No change feed consumers configured (CHANGE_FEED_CONSUMERS)')
+        try:
+            sinks = {consumer: get_sink(consumer) for consumer in consumers}
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        stopping = threading.Event()
+        if not options['once']:
+            # Finish the chunk in flight, then stop
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *args: stopping.set())
+
+        started = time.monotonic()
+        delivered = 0
+        purged_at = None
+        while not stopping.is_set():
+            if not options['once'] and (purged_at is None or time.monotonic() - purged_at >= self.purge_interval):
+                purged = purge_delivered(settings.CHANGE_FEED_KEEP_DAYS)
+                if purged:
+                    self.stdout.write(f'Purged {purged} delivered events')
+                purged_at = time.monotonic()
+
+            sent = failed = 0
+            for consumer, sink in sinks.items():
+                for alias, result in self._relay(consumer, sink, options['batch_size']):
+                    if isinstance(result, SinkError):
+                        failed += 1
+                        self.stderr.write(self.style.WARNING(f'  {consumer}/{alias}: {result}'))
+                    else:
+                        sent += result
+                        if result and options['verbosity'] > 1:
+                            self.stdout.write(f'  {consumer}/{alias}: {result} events')
+            delivered += sent
+            if options['once'] and not failed:
+                break
+            if not sent:
+                stopping.wait(options['poll_interval'])
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Delivered {delivered} events to {len(sinks)} consumers in {elapsed:.1f}s '
+            f'({delivered / elapsed if elapsed else 0:,.0f} events/s)'
+        ))
+
+    def _relay(self, consumer, sink, batch_size):
+        """(shard alias, events delivered or the SinkError) for every shard, relayed in parallel."""
+        def relay(alias):
+            try:
+                return alias, relay_shard(consumer, alias, sink, batch_size=batch_size)
+            except SinkError as e:
+                return alias, e
+        return scatter(relay)
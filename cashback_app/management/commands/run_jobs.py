@@ -0,0 +1,94 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from cashback_app.jobs import claim_job, run_job
+
+
+def worker_loop(index, poll_interval, lease_seconds, once):
+    """Claim and run jobs until stopped (or until the queue is empty with --once)."""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, stop)
+    while not stopping:
+        job = claim_job(worker_id, lease_seconds)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job, worker_id, lease_seconds)
+    connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=2,
+            help='Number of worker processes (default: 2)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait when the queue is empty (default: 2)',
+        )
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=300,
+            help='Seconds a job stays leased without a progress update (default: 300)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once the queue is empty instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options['concurrency'])
+        worker_args = (options['poll_interval'], options['lease'], options['once'])
+
+        self.stdout.write(f'Starting {concurrency} job worker(s)')
+        if concurrency == 1:
+            worker_loop(0, *worker_args)
+            return
+
+        # Children must not share the parent's database connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=worker_loop, args=(index, *worker_args), daemon=True)
+            for index in range(concurrency)
+        ]
+        for worker in workers:
+            worker.start()
+
+        def forward_stop(signum, frame):
+            # Let each worker finish its current job before exiting
+            for worker in workers:
+                worker.terminate()
+
+        signal.signal(signal.SIGTERM, forward_stop)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+        self.stdout.write(self.style.SUCCESS('Job workers stopped'))
@@ -0,0 +1,61 @@
+import asyncio
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from cashback_app.notifications import Dispatcher
+
+
+class Command(BaseCommand):
+    help = 'Send queued customer notifications (SMS) through the configured provider'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=4,
+            help='Batches sent at the same time (default: 4)',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Seconds to wait when nothing is due (default: 1)',
+        )
+        parser.add_argument(
+            '--lease',
+            type=int,
+            default=120,
+            help='Seconds a claimed batch stays leased before another dispatcher may retry it (default: 120)',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit once nothing is due instead of polling forever',
+        )
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        dispatcher = asyncio.run(self._run(options))
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {dispatcher.sent} of {dispatcher.attempted} attempted notifications in {elapsed:.1f}s'
+        ))
+
+    async def _run(self, options):
+        dispatcher = Dispatcher(concurrency=max(1, options['concurrency']), lease_seconds=options['lease'])
+        self.stdout.write(f'Sending notifications through {type(dispatcher.provider).__name__} '
+                          f'({dispatcher.worker_id})')
+        stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        # Stop claiming new batches; the ones in flight still record their results
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, stopping.set)
+        await dispatcher.run(
+            once=options['once'],
+            poll_interval=options['poll_interval'],
+            stopping=stopping,
+            keep_days=None if options['once'] else settings.NOTIFICATION_KEEP_DAYS,
+        )
+        return dispatcher
@@ -0,0 +1,384 @@
+import json
+import logging
+import multiprocessing
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections
+from django.db.models import Sum
+from django.test import Client
+from django.test.utils import (
+    override_settings, setup_databases, setup_test_environment, teardown_databases, teardown_test_environment,
+)
+from django.urls import reverse
+
+from cashback_app.models import Customer, Purchase, UserProfile, WalletDebit
+from cashback_app.sharding import shard_aliases, shard_for_national_code
+
+# Balance every generated customer starts with, so debits are rarely refused
+INITIAL_BALANCE = Decimal(50_000_000)
+WRITE_STATEMENTS = ('INSERT', 'UPDATE', 'DELETE')
+HISTORY_NAME = 'stress_tills.jsonl'
+
+
+def _init_worker():
+    # Forked tills must open their own database connections
+    for connection in connections.all():
+        connection.close()
+
+
+def _customer_weights(count, skew):
+    """Zipf weights: the customer of rank r is chosen in proportion to 1 / r ** skew (0 is uniform)."""
+    return [1 / (rank ** skew) for rank in range(1, count + 1)]
+
+
+def _run_till(task):
+    """
+    One till: post purchases and wallet debits through the real views and
+    time them. Returns the per-operation outcomes and the time its write
+    statements spent past the lock threshold.
+    """
+    till, session_key, customer_ids, weights, operations, debit_ratio, threshold, seed = task
+    rng = random.Random(seed)
+    client = Client()
+    client.cookies[settings.SESSION_COOKIE_NAME] = session_key
+    lock_wait = {'seconds': 0.0, 'statements': 0}
+
+    def timed(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            # A write that runs this long was waiting for another till's lock
+            if elapsed > threshold and sql.lstrip().upper().startswith(WRITE_STATEMENTS):
+                lock_wait['seconds'] += elapsed
+                lock_wait['statements'] += 1
+
+    outcomes = []
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timed))
+        for _ in range(operations):
+            customer_id = rng.choices(customer_ids, weights)[0]
+            if rng.random() < debit_ratio:
+                kind = 'debit'
+                path = reverse('wallet_reduction', kwargs={'pk': customer_id})
+                data = {'amount': rng.randrange(1000, 50000, 1000), 'reason': f'till {till}'}
+            else:
+                kind = 'purchase'
+                path = reverse('purchase_create_for_customer', kwargs={'customer_id': customer_id})
+                data = {'customer': customer_id, 'amount': rng.randrange(10000, 2000000, 1000)}
+            started = time.perf_counter()
+            try:
+                response = client.post(path, data)
+            except OperationalError as e:
+                result = 'locked' if 'locked' in str(e) else f'error:{type(e).__name__}'
+            except Exception as e:
+                result = f'error:{type(e).__name__}'
+            else:
+                if response.status_code == 302:
+                    result = 'ok'
+                elif response.status_code == 200:
+                    # The form was shown again, e.g. a debit above the balance
+                    result = 'rejected'
+                else:
+                    result = f'error:HTTP {response.status_code}'
+            outcomes.append((kind, result, time.perf_counter() - started))
+    connections.close_all()
+    return {'outcomes': outcomes, 'lock_wait': lock_wait}
+
+
+class Command(BaseCommand):
+    help = ('Record purchases and wallet debits from many tills at once against a file-backed copy of the '
+            'database and report throughput, lock waits, errors and lost wallet updates; fails if any '
+            'wallet update was lost')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tills', type=int, default=8, help='Concurrent tills (default: 8)')
+        parser.add_argument(
+            '--mode',
+            choices=['process', 'thread'],
+            default='process',
+            help='Run each till in its own process, like separate workers, or thread (default: process)',
+        )
+        parser.add_argument('--operations', type=int, default=200, help='Requests per till (default: 200)')
+        parser.add_argument('--customers', type=int, default=50, help='Customers the tills serve (default: 50)')
+        parser.add_argument(
+            '--skew',
+            type=float,
+            default=1.0,
+            help='Zipf exponent of customer popularity; 0 spreads requests evenly, higher values '
+                 'concentrate them on a few hot customers (default: 1.0)',
+        )
+        parser.add_argument(
+            '--debit-ratio',
+            type=float,
+            default=0.3,
+            help='Share of requests that are wallet debits rather than purchases (default: 0.3)',
+        )
+        parser.add_argument(
+            '--journal-mode',
+            choices=['delete', 'wal'],
+            help='SQLite journal mode of the stress databases (default: as configured)',
+        )
+        parser.add_argument(
+            '--busy-timeout',
+            type=float,
+            help='Seconds SQLite waits for a lock before "database is locked" (default: as configured)',
+        )
+        parser.add_argument(
+            '--lock-threshold-ms',
+            type=float,
+            default=1.0,
+            help='Writes slower than this are counted as lock waits (default: 1.0)',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+        parser.add_argument('--label', default='', help='Name of this configuration in the history')
+        parser.add_argument(
+            '--no-record',
+            action='store_true',
+            help=f'Do not append the results to BENCHMARK_DIR/{HISTORY_NAME}',
+        )
+
+    def handle(self, *args, **options):
+        if options['tills'] < 1 or options['operations'] < 1 or options['customers'] < 1:
+            raise CommandError('--tills, --operations and --customers must be at least 1')
+
+        with tempfile.TemporaryDirectory() as var_dir:
+            self._use_files(var_dir, options['busy_timeout'])
+            setup_test_environment()
+            old_config = setup_databases(verbosity=0, interactive=False, aliases=set(connections))
+            try:
+                with override_settings(**self._isolated_settings(var_dir)):
+                    if options['journal_mode']:
+                        self._set_journal_mode(options['journal_mode'])
+                    sessions, customers = self._generate(options['tills'], options['customers'])
+                    elapsed, results = self._run(sessions, customers, options)
+                    results = self._measure(elapsed, results)
+            finally:
+                teardown_databases(old_config, verbosity=0)
+                teardown_test_environment()
+
+        config = {name: options[name] for name in (
+            'label', 'tills', 'mode', 'operations', 'customers', 'skew', 'debit_ratio', 'journal_mode', 'busy_timeout',
+        )}
+        self._report(config, results)
+        if not options['no_record']:
+            self._record(config, results)
+        self._compare()
+        # Lock errors depend on the configuration; a wallet that disagrees with its ledger is a bug
+        if results['lost_updates']:
+            raise CommandError(f"{results['lost_updates']} customers' wallet balance drifted from their ledger")
+
+    def _use_files(self, var_dir, busy_timeout):
+        """Put SQLite test databases in files, which several processes can share, unlike memory."""
+        for alias in connections:
+            settings_dict = connections[alias].settings_dict
+            if connections[alias].vendor != 'sqlite':
+                continue
+            settings_dict['TEST']['NAME'] = str(Path(var_dir) / f'{alias}.sqlite3')
+            if busy_timeout is not None:
+                settings_dict['OPTIONS'] = {**settings_dict.get('OPTIONS', {}), 'timeout': busy_timeout}
+
+    def _isolated_settings(self, var_dir):
+        # A file cache is shared by the till processes, like in production
+        return {
+            'CACHES': {
+                'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                            'LOCATION': f'{var_dir}/cache/default'},
+                'template_fragments': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                       'LOCATION': f'{var_dir}/cache/fragments'},
+                'versions': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                             'LOCATION': f'{var_dir}/cache/versions'},
+            },
+            'JOB_RESULTS_DIR': f'{var_dir}/jobs',
+            'REPORT_SNAPSHOT_DIR': f'{var_dir}/reports',
+            'PURCHASE_STORE_DIR': f'{var_dir}/purchase_store',
+            'PROFILE_DIR': f'{var_dir}/profiles',
+        }
+
+    def _set_journal_mode(self, mode):
+        for alias in connections:
+            if connections[alias].vendor == 'sqlite':
+                with connections[alias].cursor() as cursor:
+                    cursor.execute(f'PRAGMA journal_mode={mode}')
+
+    def _generate(self, tills, customer_count):
+        """
+        Log in one operator per till and create the customers. Returns the
+        session keys and the customer ids, hottest first.
+        """
+        sessions = []
+        for till in range(tills):
+            user = User.objects.create_user(f'till-{till}', password=None, first_name=f'صندوق {till}')
+            UserProfile.objects.create(user=user, user_type='operator')
+            # Logging in writes too; do it before the tills compete for the lock
+            client = Client()
+            client.force_login(user)
+            sessions.append(client.session.session_key)
+        by_shard = {}
+        for index in range(customer_count):
+            national_code = f'{index + 1:010d}'
+            by_shard.setdefault(shard_for_national_code(national_code), []).append(Customer(
+                first_name='مشتری', last_name=str(index + 1), national_code=national_code,
+                phone_number=f'0912{index:07d}', wallet_balance=INITIAL_BALANCE,
+            ))
+        for alias, customers in by_shard.items():
+            Customer.objects.using(alias).bulk_create(customers)
+        ranked = sorted(row for alias in shard_aliases()
+                        for row in Customer.objects.using(alias).values_list('national_code', 'pk'))
+        return sessions, [pk for _, pk in ranked]
+
+    def _run(self, sessions, customer_ids, options):
+        weights = _customer_weights(len(customer_ids), options['skew'])
+        tasks = [
+            (till, sessions[till], customer_ids, weights, options['operations'], options['debit_ratio'],
+             options['lock_threshold_ms'] / 1000, options['seed'] * 1000 + till)
+            for till in range(options['tills'])
+        ]
+        self.stdout.write(f"{options['tills']} tills ({options['mode']}), {options['operations']} requests each...")
+        # Failed requests are counted; their tracebacks would bury the report
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.CRITICAL)
+        try:
+            return self._run_tills(tasks, options)
+        finally:
+            request_logger.setLevel(level)
+
+    def _run_tills(self, tasks, options):
+        started = time.perf_counter()
+        if options['mode'] == 'process':
+            _init_worker()
+            with multiprocessing.get_context('fork').Pool(options['tills'], initializer=_init_worker) as pool:
+                results = pool.map(_run_till, tasks)
+        else:
+            with ThreadPoolExecutor(max_workers=options['tills']) as executor:
+                results = list(executor.map(_run_till, tasks))
+        return time.perf_counter() - started, results
+
+    def _measure(self, elapsed, results):
+        outcomes = [outcome for till in results for outcome in till['outcomes']]
+        counts = Counter(result for _, result, _ in outcomes)
+        latencies = sorted(seconds for _, _, seconds in outcomes)
+        errors = sum(count for result, count in counts.items() if result not in ('ok', 'rejected'))
+        lock_seconds = sum(till['lock_wait']['seconds'] for till in results)
+
+        # Every committed purchase and debit is in the ledger; the wallet column must agree with it
+        lost_updates = 0
+        drift = Decimal(0)
+        for alias in shard_aliases():
+            credits = dict(Purchase.objects.using(alias).order_by().values('customer_id')
+                           .annotate(total=Sum('cashback_amount')).values_list('customer_id', 'total'))
+            debits = dict(WalletDebit.objects.using(alias).order_by().values('customer_id')
+                          .annotate(total=Sum('amount')).values_list('customer_id', 'total'))
+            for pk, balance in Customer.objects.using(alias).values_list('pk', 'wallet_balance'):
+                expected = INITIAL_BALANCE + credits.get(pk, 0) - debits.get(pk, 0)
+                if balance != expected:
+                    lost_updates += 1
+                    drift += abs(balance - expected)
+        ok = Counter(kind for kind, result, _ in outcomes if result == 'ok')
+        committed = {
+            'purchase': sum(Purchase.objects.using(alias).count() for alias in shard_aliases()),
+            'debit': sum(WalletDebit.objects.using(alias).count() for alias in shard_aliases()),
+        }
+
+        def percentile(fraction):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000
+
+        return {
+            'requests': len(outcomes),
+            'seconds': round(elapsed, 3),
+            'throughput': round(counts['ok'] / elapsed, 1),
+            'p50_ms': round(percentile(0.5), 1),
+            'p95_ms': round(percentile(0.95), 1),
+            'p99_ms': round(percentile(0.99), 1),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 1),
+            'ok': counts['ok'],
+            'rejected': counts['rejected'],
+            'locked': counts['locked'],
+            'errors': errors,
+            'error_rate': round(errors / len(outcomes), 4),
+            'error_kinds': {result: count for result, count in counts.items() if result.startswith('error')},
+            'lock_wait_ms': round(lock_seconds * 1000, 1),
+            'lock_wait_ms_per_request': round(lock_seconds * 1000 / len(outcomes), 2),
+            'lock_waits': sum(till['lock_wait']['statements'] for till in results),
+            'lost_updates': lost_updates,
+            'balance_drift': int(drift),
+            # Successful responses without their ledger row (or the reverse) would show up here
+            'unmatched_purchases': committed['purchase'] - ok['purchase'],
+            'unmatched_debits': committed['debit'] - ok['debit'],
+        }
+
+    def _report(self, config, results):
+        self.stdout.write('')
+        self.stdout.write(', '.join(f'{name}={value}' for name, value in config.items() if value not in (None, '')))
+        rows = [
+            ('requests', f"{results['requests']} in {results['seconds']:.1f} s"),
+            ('throughput', f"{results['throughput']} successful requests/s"),
+            ('latency p50/p95/p99', f"{results['p50_ms']} / {results['p95_ms']} / {results['p99_ms']} ms"),
+            ('outcomes', f"{results['ok']} ok, {results['rejected']} rejected, {results['locked']} database locked, "
+                         f"{results['errors'] - results['locked']} other errors"),
+            ('error rate', f"{results['error_rate']:.2%}"),
+            ('lock wait', f"{results['lock_wait_ms']} ms over {results['lock_waits']} writes "
+                          f"({results['lock_wait_ms_per_request']} ms per request)"),
+            ('lost updates', f"{results['lost_updates']} customers, {results['balance_drift']:,} ریال off the ledger"),
+            ('unmatched rows', f"{results['unmatched_purchases']} purchases, {results['unmatched_debits']} debits"),
+        ]
+        for name, value in rows:
+            self.stdout.write(f'  {name:<22}{value}')
+        for kind, count in sorted(results['error_kinds'].items()):
+            self.stdout.write(f'    {kind}: {count}')
+        style = self.style.SUCCESS if not results['lost_updates'] and not results['errors'] else self.style.WARNING
+        self.stdout.write(style(
+            f"{results['lost_updates']} lost wallet updates, {results['errors']} failed requests"
+        ))
+
+    def _history_path(self):
+        return Path(settings.BENCHMARK_DIR) / HISTORY_NAME
+
+    def _record(self, config, results):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                    cwd=settings.BASE_DIR).stdout.strip()
+        except OSError:
+            commit = ''
+        path = self._history_path()
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'config': config,
+                 'results': results}
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def _compare(self, limit=10):
+        """The latest recorded runs side by side."""
+        try:
+            lines = self._history_path().read_text(encoding='utf-8').splitlines()[-limit:]
+        except FileNotFoundError:
+            return
+        if len(lines) < 2:
+            return
+        self.stdout.write('')
+        self.stdout.write(f'{"run":<20}{"commit":<9}{"label":<12}{"tills":>6}{"mode":>8}{"skew":>6}{"journal":>8}'
+                          f'{"req/s":>8}{"p95 ms":>8}{"errors":>8}{"wait/req":>9}{"lost":>6}')
+        for line in lines:
+            entry = json.loads(line)
+            config, results = entry['config'], entry['results']
+            self.stdout.write(
+                f"{entry['recorded_at']:<20}{entry['commit']:<9}{config['label'][:11]:<12}{config['tills']:>6}"
+                f"{config['mode']:>8}{config['skew']:>6}{config['journal_mode'] or '-':>8}"
+                f"{results['throughput']:>8}{results['p95_ms']:>8}{results['error_rate']:>8.1%}"
+                f"{results['lock_wait_ms_per_request']:>9}{results['lost_updates']:>6}"
+            )
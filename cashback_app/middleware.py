@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.gzip import GZipMiddleware as BaseGZipMiddleware
+from django.utils import timezone
+
+from .models import LoginSession
+from .profiling import matching_rule, profile_request
+
+
+class LastSeenMiddleware:
+    """
+    Refresh the current LoginSession's last_seen_at at most once every
+    LAST_SEEN_INTERVAL seconds per session. The throttle lives in the cache, so
+    requests in between neither write to the database nor modify the session.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        session_key = request.session.session_key
+        if session_key and request.user.is_authenticated:
+            interval = settings.LAST_SEEN_INTERVAL
+            # cache.add only succeeds for the first request of each interval
+            if cache.add(f'last_seen:{session_key}', 1, timeout=interval):
+                LoginSession.objects.filter(session_key=session_key, ended_at=None).update(
+                    last_seen_at=timezone.now()
+                )
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profile requests that match an active ProfilingRule (see profiling.py).
+    Requests outside every rule go straight through.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        rule = matching_rule(request)
+        if rule is None:
+            return self.get_response(request)
+        return profile_request(rule, request, self.get_response)
+
+
+class GZipMiddleware(BaseGZipMiddleware):
+    """
+    GZipMiddleware that leaves Server-Sent Events alone: the compressor holds
+    small writes back, so events and heartbeats would not reach the browser.
+    """
+
+    def process_response(self, request, response):
+        if response.get('Content-Type', '').startswith('text/event-stream'):
+            return response
+        return super().process_response(request, response)
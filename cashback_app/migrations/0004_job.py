@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cashback_app', '0003_customer_created_by'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50, verbose_name='نوع کار')),
+                ('payload', models.JSONField(blank=True, default=dict, verbose_name='پارامترها')),
+                ('status', models.CharField(choices=[('pending', 'در صف'), ('running', 'در حال اجرا'), ('succeeded', 'انجام شده'), ('failed', 'ناموفق')], default='pending', max_length=10, verbose_name='وضعیت')),
+                ('progress', models.PositiveSmallIntegerField(default=0, verbose_name='پیشرفت (درصد)')),
+                ('progress_message', models.CharField(blank=True, max_length=200, verbose_name='پیام پیشرفت')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='تعداد تلاش')),
+                ('max_attempts', models.PositiveIntegerField(default=3, verbose_name='حداکثر تلاش')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='زمان اجرا')),
+                ('locked_by', models.CharField(blank=True, max_length=100, verbose_name='پردازشگر')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='مهلت اجاره')),
+                ('result_file', models.CharField(blank=True, max_length=255, verbose_name='فایل نتیجه')),
+                ('error', models.TextField(blank=True, verbose_name='خطا')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ثبت')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان شروع')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان پایان')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='ثبت کننده')),
+            ],
+            options={
+                'verbose_name': 'کار پس\u200cزمینه',
+                'verbose_name_plural': 'کارهای پس\u200cزمینه',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cashback_app', '0005_shard_cross_database_relations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletDebit',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=0, max_digits=12, verbose_name='مبلغ کسر')),
+                ('reason', models.CharField(max_length=200, verbose_name='دلیل کسر')),
+                ('activity_log_id', models.BigIntegerField(blank=True, null=True, unique=True, verbose_name='شناسه گزارش فعالیت')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='تاریخ ثبت')),
+                ('created_by', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='ثبت کننده')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='debits', to='cashback_app.customer', verbose_name='مشتری')),
+            ],
+            options={
+                'verbose_name': 'کسر از کیف پول',
+                'verbose_name_plural': 'کسرهای کیف پول',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
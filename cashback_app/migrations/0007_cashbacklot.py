@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:19
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashback_app', '0006_walletdebit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CashbackLot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=0, max_digits=12, verbose_name='مبلغ کش\u200cبک')),
+                ('remaining', models.DecimalField(decimal_places=0, max_digits=12, verbose_name='مانده')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='تاریخ انقضا')),
+                ('expired_amount', models.DecimalField(decimal_places=0, default=0, max_digits=12, verbose_name='مبلغ منقضی شده')),
+                ('expired_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان انقضا')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='تاریخ ثبت')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cashback_lots', to='cashback_app.customer', verbose_name='مشتری')),
+                ('purchase', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='cashback_lot', to='cashback_app.purchase', verbose_name='خرید')),
+            ],
+            options={
+                'verbose_name': 'بسته کش\u200cبک',
+                'verbose_name_plural': 'بسته\u200cهای کش\u200cبک',
+                'indexes': [models.Index(fields=['customer', 'expires_at'], name='lot_customer_expiry_idx'), models.Index(condition=models.Q(('remaining__gt', 0)), fields=['expires_at', 'customer'], name='lot_open_expiry_idx')],
+            },
+        ),
+    ]
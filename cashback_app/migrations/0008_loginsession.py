@@ -0,0 +1,34 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:21
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cashback_app', '0007_cashbacklot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LoginSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40, unique=True, verbose_name='کلید نشست')),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True, verbose_name='آدرس IP')),
+                ('started_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='زمان ورود')),
+                ('last_seen_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='آخرین فعالیت')),
+                ('ended_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان خروج')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='login_sessions', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'نشست کاربر',
+                'verbose_name_plural': 'نشست\u200cهای کاربران',
+                'ordering': ['-started_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:32
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashback_app', '0009_index_created_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CustomerToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64, unique=True, verbose_name='شناسه')),
+                ('kind', models.CharField(choices=[('card', 'کارت وفاداری'), ('qr', 'کد QR')], default='card', max_length=10, verbose_name='نوع')),
+                ('is_active', models.BooleanField(default=True, verbose_name='فعال')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='تاریخ صدور')),
+                ('customer', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='cashback_app.customer', verbose_name='مشتری')),
+            ],
+            options={
+                'verbose_name': 'کارت مشتری',
+                'verbose_name_plural': 'کارت\u200cهای مشتریان',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:35
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cashback_app', '0010_customertoken'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view_name', models.CharField(blank=True, help_text='نام URL مانند customer_detail؛ خالی یعنی همه صفحات', max_length=100, verbose_name='نام مسیر')),
+                ('sample_rate', models.FloatField(default=0.1, help_text='سهم درخواست\u200cهای منطبق که پروفایل می\u200cشوند، بین 0 و 1', validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)], verbose_name='نرخ نمونه\u200cبرداری')),
+                ('mode', models.CharField(choices=[('cprofile', 'cProfile (همه فراخوانی\u200cها)'), ('sample', 'نمونه\u200cبرداری از پشته')], default='cprofile', max_length=10, verbose_name='روش')),
+                ('is_active', models.BooleanField(default=True, verbose_name='فعال')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='پایان اعتبار')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')),
+                ('user', models.ForeignKey(blank=True, help_text='خالی یعنی همه کاربران', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='profiling_rules', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'قاعده پروفایل',
+                'verbose_name_plural': 'قواعد پروفایل',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
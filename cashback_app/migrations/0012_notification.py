@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashback_app', '0011_profilingrule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('credit', 'افزایش موجودی'), ('debit', 'کسر از موجودی')], max_length=10, verbose_name='نوع')),
+                ('dedup_key', models.CharField(max_length=100, unique=True, verbose_name='کلید یکتا')),
+                ('phone_number', models.CharField(max_length=11, verbose_name='شماره موبایل')),
+                ('text', models.CharField(max_length=500, verbose_name='متن پیام')),
+                ('status', models.CharField(choices=[('pending', 'در صف'), ('sending', 'در حال ارسال'), ('sent', 'ارسال شده'), ('failed', 'ناموفق')], default='pending', max_length=10, verbose_name='وضعیت')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='تعداد تلاش')),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='زمان تلاش بعدی')),
+                ('locked_by', models.CharField(blank=True, max_length=100, verbose_name='ارسال کننده')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='مهلت اجاره')),
+                ('provider_message_id', models.CharField(blank=True, max_length=100, verbose_name='شناسه پیام در سرویس')),
+                ('error', models.CharField(blank=True, max_length=500, verbose_name='خطا')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='تاریخ ایجاد')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان ارسال')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='cashback_app.customer', verbose_name='مشتری')),
+            ],
+            options={
+                'verbose_name': 'پیامک مشتری',
+                'verbose_name_plural': 'پیامک\u200cهای مشتریان',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'next_attempt_at'], name='notification_due_idx')],
+            },
+        ),
+    ]
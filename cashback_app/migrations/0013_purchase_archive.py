@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cashback_app', '0012_notification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='ماه')),
+                ('purchase_count', models.PositiveIntegerField(default=0, verbose_name='تعداد خرید')),
+                ('total_amount', models.DecimalField(decimal_places=0, default=0, max_digits=14, verbose_name='جمع مبلغ خرید')),
+                ('total_cashback', models.DecimalField(decimal_places=0, default=0, max_digits=14, verbose_name='جمع کش\u200cبک')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='purchase_summaries', to='cashback_app.customer', verbose_name='مشتری')),
+            ],
+            options={
+                'verbose_name': 'خلاصه خریدهای بایگانی شده',
+                'verbose_name_plural': 'خلاصه خریدهای بایگانی شده',
+                'ordering': ['-month'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedPurchase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purchase_id', models.BigIntegerField(db_index=True, verbose_name='شناسه خرید')),
+                ('amount', models.DecimalField(decimal_places=0, max_digits=12, verbose_name='مبلغ خرید')),
+                ('cashback_amount', models.DecimalField(decimal_places=0, max_digits=12, verbose_name='مبلغ کش\u200cبک')),
+                ('created_at', models.DateTimeField(verbose_name='تاریخ ثبت')),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='تاریخ بایگانی')),
+                ('created_by', models.ForeignKey(db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='ثبت کننده')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_purchases', to='cashback_app.customer', verbose_name='مشتری')),
+            ],
+            options={
+                'verbose_name': 'خرید بایگانی شده',
+                'verbose_name_plural': 'خریدهای بایگانی شده',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='purchasesummary',
+            constraint=models.UniqueConstraint(fields=('customer', 'month'), name='purchase_summary_customer_month'),
+        ),
+    ]
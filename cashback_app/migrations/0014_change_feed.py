@@ -0,0 +1,49 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:49
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashback_app', '0013_purchase_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entity', models.CharField(choices=[('customer', 'مشتری'), ('purchase', 'خرید'), ('walletdebit', 'کسر از کیف پول')], max_length=20, verbose_name='موجودیت')),
+                ('entity_id', models.BigIntegerField(verbose_name='شناسه')),
+                ('operation', models.CharField(choices=[('create', 'ایجاد'), ('update', 'ویرایش'), ('delete', 'حذف'), ('move', 'انتقال به پایگاه داده دیگر')], max_length=10, verbose_name='عملیات')),
+                ('data', models.TextField(verbose_name='داده\u200cها')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='زمان تغییر')),
+            ],
+            options={
+                'verbose_name': 'رویداد تغییر',
+                'verbose_name_plural': 'رویدادهای تغییر',
+                'ordering': ['id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ChangeFeedOffset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.CharField(max_length=50, verbose_name='مصرف کننده')),
+                ('shard', models.CharField(max_length=50, verbose_name='پایگاه داده')),
+                ('last_event_id', models.BigIntegerField(default=0, verbose_name='آخرین رویداد تحویل شده')),
+                ('events_delivered', models.BigIntegerField(default=0, verbose_name='تعداد رویدادهای تحویل شده')),
+                ('delivered_at', models.DateTimeField(blank=True, null=True, verbose_name='آخرین تحویل')),
+            ],
+            options={
+                'verbose_name': 'موقعیت مصرف کننده تغییرات',
+                'verbose_name_plural': 'موقعیت مصرف کنندگان تغییرات',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='changefeedoffset',
+            constraint=models.UniqueConstraint(fields=('consumer', 'shard'), name='change_feed_offset_consumer_shard'),
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 4.2.7 on 2026-10-19 12:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashback_app', '0014_change_feed'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Branch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='نام')),
+                ('code', models.SlugField(max_length=20, unique=True, verbose_name='کد شعبه')),
+                ('is_active', models.BooleanField(default=True, verbose_name='فعال')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ایجاد')),
+            ],
+            options={
+                'verbose_name': 'شعبه',
+                'verbose_name_plural': 'شعبه\u200cها',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='BranchStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('customers', models.BigIntegerField(default=0, verbose_name='تعداد مشتریان')),
+                ('purchases', models.BigIntegerField(default=0, verbose_name='تعداد خریدها')),
+                ('cashback', models.DecimalField(decimal_places=0, default=0, max_digits=16, verbose_name='مجموع کش\u200cبک')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='تاریخ بروزرسانی')),
+            ],
+            options={
+                'verbose_name': 'آمار شعبه',
+                'verbose_name_plural': 'آمار شعبه\u200cها',
+            },
+        ),
+        migrations.AddField(
+            model_name='branchstats',
+            name='branch',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='cashback_app.branch', verbose_name='شعبه'),
+        ),
+        migrations.AddField(
+            model_name='activitylog',
+            name='branch',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='cashback_app.branch', verbose_name='شعبه'),
+        ),
+        migrations.AddField(
+            model_name='archivedpurchase',
+            name='branch',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='cashback_app.branch', verbose_name='شعبه'),
+        ),
+        migrations.AddField(
+            model_name='customer',
+            name='branch',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='cashback_app.branch', verbose_name='شعبه'),
+        ),
+        migrations.AddField(
+            model_name='purchase',
+            name='branch',
+            field=models.ForeignKey(blank=True, db_constraint=False, db_index=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='cashback_app.branch', verbose_name='شعبه'),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='branch',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='profiles', to='cashback_app.branch', verbose_name='شعبه'),
+        ),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['branch', 'created_at'], name='activitylog_branch_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['branch', 'wallet_balance'], name='customer_branch_wallet_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='customer',
+            index=models.Index(fields=['branch', 'created_at'], name='customer_branch_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['branch', 'created_at'], name='purchase_branch_created_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='branchstats',
+            constraint=models.UniqueConstraint(fields=('branch',), name='branch_stats_branch'),
+        ),
+    ]
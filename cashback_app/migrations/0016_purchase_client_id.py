@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashback_app', '0015_branches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='purchase',
+            name='client_id',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True, verbose_name='شناسه صندوق'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashback_app', '0016_purchase_client_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SegmentationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='زمان شروع')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان پایان')),
+                ('full', models.BooleanField(default=True, verbose_name='محاسبه کامل')),
+                ('customers', models.PositiveIntegerField(default=0, verbose_name='تعداد مشتریان محاسبه شده')),
+                ('edges', models.JSONField(default=dict, verbose_name='مرزهای امتیازدهی')),
+            ],
+            options={
+                'verbose_name': 'اجرای بخش\u200cبندی',
+                'verbose_name_plural': 'اجراهای بخش\u200cبندی',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CustomerSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment', models.CharField(choices=[('champions', 'مشتریان برتر'), ('loyal', 'وفادار'), ('high_value_lapsed', 'پرارزش غیرفعال'), ('new', 'جدید'), ('promising', 'امیدوارکننده'), ('need_attention', 'نیازمند توجه'), ('hibernating', 'کم\u200cفعال'), ('lost', 'از دست رفته'), ('no_purchases', 'بدون خرید')], max_length=20, verbose_name='بخش')),
+                ('recency_days', models.PositiveIntegerField(blank=True, null=True, verbose_name='روز از آخرین خرید')),
+                ('frequency', models.PositiveIntegerField(default=0, verbose_name='تعداد خرید')),
+                ('monetary', models.DecimalField(decimal_places=0, default=0, max_digits=16, verbose_name='جمع مبلغ خرید')),
+                ('last_purchase_at', models.DateTimeField(blank=True, null=True, verbose_name='آخرین خرید')),
+                ('recency_score', models.PositiveSmallIntegerField(default=0, verbose_name='امتیاز تازگی')),
+                ('frequency_score', models.PositiveSmallIntegerField(default=0, verbose_name='امتیاز تکرار')),
+                ('monetary_score', models.PositiveSmallIntegerField(default=0, verbose_name='امتیاز مبلغ')),
+                ('computed_at', models.DateTimeField(verbose_name='زمان محاسبه')),
+                ('customer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='segment', to='cashback_app.customer', verbose_name='مشتری')),
+            ],
+            options={
+                'verbose_name': 'بخش مشتری',
+                'verbose_name_plural': 'بخش\u200cهای مشتریان',
+                'indexes': [models.Index(fields=['segment', '-monetary'], name='segment_segment_monetary_idx')],
+            },
+        ),
+    ]
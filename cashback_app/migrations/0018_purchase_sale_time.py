@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-19 13:34
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cashback_app', '0017_customer_segments'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='purchase',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, editable=False, verbose_name='تاریخ ثبت'),
+        ),
+    ]
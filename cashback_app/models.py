@@ -1,8 +1,44 @@
-from django.db import models
+import json
+
+from django.db import IntegrityError, models, router, transaction
 from django.contrib.auth.models import User
-from django.core.validators import RegexValidator
+from django.core.exceptions import ObjectDoesNotExist
+from django.core.validators import MaxValueValidator, MinValueValidator, RegexValidator
+from django.utils import timezone
+from .sharding import is_sharded, shard_for_national_code
 import re
 
+# Map Persian (۰-۹) and Arabic-Indic (٠-٩) digits to ASCII (0-9)
+DIGIT_TRANSLATION = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+PHONE_NUMBER_RE = re.compile(r'^09\d{9}$')
+
+
+class Branch(models.Model):
+    """A store. Operators work at one branch and only see its customers, purchases and logs."""
+    name = models.CharField(max_length=100, verbose_name="نام")
+    code = models.SlugField(max_length=20, unique=True, verbose_name="کد شعبه")
+    is_active = models.BooleanField(default=True, verbose_name="فعال")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ایجاد")
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        verbose_name = "شعبه"
+        verbose_name_plural = "شعبه‌ها"
+        ordering = ['name']
+
+
+def branch_id_of(user):
+    """Id of the branch a user works at, or None for users who see every branch."""
+    if user is None or not user.is_authenticated:
+        return None
+    try:
+        return user.userprofile.branch_id
+    except ObjectDoesNotExist:
+        return None
+
+
 class Customer(models.Model):
     first_name = models.CharField(max_length=100, verbose_name="نام")
     last_name = models.CharField(max_length=100, verbose_name="نام خانوادگی")
@@ -27,24 +63,45 @@ class Customer(models.Model):
             ),
         ]
     )
+    # Customers may live on a shard database without the users table
     created_by = models.ForeignKey(
         User,
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
+        db_constraint=False,
         verbose_name="ثبت کننده"
     )
+    # Branches live on 'default'; the composite indexes below lead with this column
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.DO_NOTHING,
+        null=True,
+        blank=True,
+        db_constraint=False,
+        db_index=False,
+        related_name='+',
+        verbose_name="شعبه"
+    )
     wallet_balance = models.DecimalField(
         max_digits=12, 
         decimal_places=0, 
         default=0, 
         verbose_name="موجودی کیف پول"
     )
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ثبت")
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="تاریخ ثبت")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="تاریخ بروزرسانی")
 
     def __str__(self):
         return f"{self.first_name} {self.last_name} - {self.national_code}"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'branch_id' in field_names:
+            # Remembered so that save() can move the customer to its new branch's counters
+            instance._loaded_branch_id = values[field_names.index('branch_id')]
+        return instance
     
     def save(self, *args, **kwargs):
         # Normalize and validate national code
@@ -52,23 +109,47 @@ class Customer(models.Model):
         if not self.is_valid_national_code(self.national_code):
             from django.core.exceptions import ValidationError
             raise ValidationError("کد ملی باید دقیقاً 10 رقم باشد")
-        super().save(*args, **kwargs)
+        creating = self._state.adding
+        if creating and self.branch_id is None:
+            self.branch_id = branch_id_of(self.created_by)
+        if creating and is_sharded():
+            # New customers go to their shard whichever manager created them
+            kwargs['using'] = shard_for_national_code(self.national_code)
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(Customer, instance=self),
+                                savepoint=False):
+            super().save(*args, **kwargs)
+            ChangeEvent.record(self, 'create' if creating else 'update')
+            loaded_branch_id = getattr(self, '_loaded_branch_id', self.branch_id)
+            if creating:
+                BranchStats.add(self._state.db, self.branch_id, customers=1)
+            elif loaded_branch_id != self.branch_id:
+                BranchStats.add(self._state.db, loaded_branch_id, customers=-1)
+                BranchStats.add(self._state.db, self.branch_id, customers=1)
+            self._loaded_branch_id = self.branch_id
     
     @staticmethod
     def normalize_national_code(national_code: str) -> str:
         """Convert Persian/Arabic-Indic digits to ASCII and strip non-digit chars."""
         if national_code is None:
             return ''
-        # Map Persian (۰-۹) and Arabic-Indic (٠-٩) digits to ASCII (0-9)
-        trans = str.maketrans(
-            '۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩',
-            '01234567890123456789'
-        )
-        normalized = str(national_code).translate(trans)
+        normalized = str(national_code).translate(DIGIT_TRANSLATION)
         # Remove any non-digit characters (spaces, dashes, etc.)
         normalized = re.sub(r'\D', '', normalized)
         return normalized
 
+    @staticmethod
+    def normalize_phone_number(phone_number: str) -> str:
+        """Convert Persian/Arabic-Indic digits to ASCII and strip non-digit chars."""
+        if phone_number is None:
+            return ''
+        normalized = str(phone_number).strip().translate(DIGIT_TRANSLATION)
+        return re.sub(r'\D', '', normalized)
+
+    @staticmethod
+    def is_valid_phone_number(phone_number):
+        """Mobile numbers are 11 digits starting with 09."""
+        return bool(PHONE_NUMBER_RE.match(phone_number))
+
     @staticmethod
     def is_valid_national_code(national_code):
         """Validate national code as exactly 10 digits after normalization."""
@@ -78,6 +159,11 @@ class Customer(models.Model):
     class Meta:
         verbose_name = "مشتری"
         verbose_name_plural = "مشتریان"
+        indexes = [
+            # A branch's customer list, by wallet balance or by registration
+            models.Index(fields=['branch', 'wallet_balance'], name='customer_branch_wallet_idx'),
+            models.Index(fields=['branch', 'created_at'], name='customer_branch_created_idx'),
+        ]
 
 
 class Purchase(models.Model):
@@ -97,25 +183,79 @@ class Purchase(models.Model):
         decimal_places=0, 
         verbose_name="مبلغ کش‌بک"
     )
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ثبت")
+    # When the sale was made; a till that queued it offline sends this along (see till_sync.py)
+    created_at = models.DateTimeField(default=timezone.now, editable=False, db_index=True, verbose_name="تاریخ ثبت")
     created_by = models.ForeignKey(
         User, 
         on_delete=models.SET_NULL, 
         null=True,
+        db_constraint=False,
         verbose_name="ثبت کننده"
     )
+    # The branch the purchase was made at, which may not be the customer's
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.DO_NOTHING,
+        null=True,
+        blank=True,
+        db_constraint=False,
+        db_index=False,
+        related_name='+',
+        verbose_name="شعبه"
+    )
+    # Id the till gave a purchase it queued offline; a retried sync finds it
+    # here instead of recording the sale twice (see till_sync.py)
+    client_id = models.CharField(
+        max_length=64,
+        null=True,
+        blank=True,
+        unique=True,
+        editable=False,
+        verbose_name="شناسه صندوق"
+    )
 
     def save(self, *args, **kwargs):
         from decimal import Decimal
-        # Calculate cashback (5% of purchase amount)
+        creating = self._state.adding
+        if creating and self.branch_id is None:
+            self.branch_id = branch_id_of(self.created_by) or self.customer.branch_id
+        # Calculate cashback (5% of purchase amount), rounded to whole rials
+        # exactly as the column stores it so wallet and history agree
         if not self.cashback_amount:
-            self.cashback_amount = self.amount * Decimal('0.05')
-        
-        # Add cashback to customer wallet
-        self.customer.wallet_balance += self.cashback_amount
-        self.customer.save()
+            self.cashback_amount = (self.amount * Decimal('0.05')).quantize(Decimal('1'))
         
-        super().save(*args, **kwargs)
+        if is_sharded():
+            # Purchases always live next to their customer
+            kwargs['using'] = self.customer._state.db
+        alias = kwargs.get('using') or self.customer._state.db
+        with transaction.atomic(using=alias):
+            if creating:
+                # Add cashback to customer wallet in one UPDATE, so a sale at another
+                # till in the meantime is added to rather than overwritten; edits
+                # keep the cashback the purchase was credited with
+                Customer.objects.using(alias).filter(pk=self.customer_id).update(
+                    wallet_balance=models.F('wallet_balance') + self.cashback_amount,
+                    updated_at=timezone.now(),
+                )
+                self.customer.refresh_from_db(using=alias, fields=['wallet_balance', 'updated_at'])
+                ChangeEvent.record_rows(Customer, alias, [self.customer_id])
+
+            super().save(*args, **kwargs)
+            ChangeEvent.record(self, 'create' if creating else 'update')
+            if creating:
+                BranchStats.add(self._state.db, self.branch_id, purchases=1, cashback=self.cashback_amount)
+
+            if creating and self.cashback_amount > 0:
+                # One credit lot per purchase, consumed by debits and expired by sweeps
+                self.customer.cashback_lots.create(
+                    purchase=self,
+                    amount=self.cashback_amount,
+                    remaining=self.cashback_amount,
+                    expires_at=CashbackLot.expiry_for(self.created_at),
+                    created_at=self.created_at,
+                )
+            if creating:
+                Notification.wallet_credit(self)
     
     def __str__(self):
         return f"{self.customer} - {self.amount} - {self.created_at.strftime('%Y-%m-%d')}"
@@ -124,6 +264,492 @@ class Purchase(models.Model):
         verbose_name = "خرید"
         verbose_name_plural = "خریدها"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['branch', 'created_at'], name='purchase_branch_created_idx'),
+        ]
+
+
+class ArchivedPurchase(models.Model):
+    """A purchase moved out of the hot Purchase table by ``manage.py archive_purchases``."""
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='archived_purchases',
+        verbose_name="مشتری"
+    )
+    # Id the row had in Purchase (this table numbers its own rows)
+    purchase_id = models.BigIntegerField(db_index=True, verbose_name="شناسه خرید")
+    amount = models.DecimalField(max_digits=12, decimal_places=0, verbose_name="مبلغ خرید")
+    cashback_amount = models.DecimalField(max_digits=12, decimal_places=0, verbose_name="مبلغ کش‌بک")
+    created_at = models.DateTimeField(verbose_name="تاریخ ثبت")
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        db_constraint=False,
+        verbose_name="ثبت کننده"
+    )
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.DO_NOTHING,
+        null=True,
+        blank=True,
+        db_constraint=False,
+        db_index=False,
+        related_name='+',
+        verbose_name="شعبه"
+    )
+    archived_at = models.DateTimeField(default=timezone.now, verbose_name="تاریخ بایگانی")
+
+    def __str__(self):
+        return f"{self.customer} - {self.amount} - {self.created_at.strftime('%Y-%m-%d')}"
+
+    class Meta:
+        verbose_name = "خرید بایگانی شده"
+        verbose_name_plural = "خریدهای بایگانی شده"
+        ordering = ['-created_at']
+
+
+class PurchaseSummary(models.Model):
+    """Totals of a customer's archived purchases in one (local) calendar month."""
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='purchase_summaries',
+        verbose_name="مشتری"
+    )
+    month = models.DateField(verbose_name="ماه")
+    purchase_count = models.PositiveIntegerField(default=0, verbose_name="تعداد خرید")
+    total_amount = models.DecimalField(max_digits=14, decimal_places=0, default=0, verbose_name="جمع مبلغ خرید")
+    total_cashback = models.DecimalField(max_digits=14, decimal_places=0, default=0, verbose_name="جمع کش‌بک")
+
+    def __str__(self):
+        return f"{self.customer} - {self.month:%Y-%m}"
+
+    class Meta:
+        verbose_name = "خلاصه خریدهای بایگانی شده"
+        verbose_name_plural = "خلاصه خریدهای بایگانی شده"
+        ordering = ['-month']
+        constraints = [
+            models.UniqueConstraint(fields=['customer', 'month'], name='purchase_summary_customer_month'),
+        ]
+
+
+class BranchStats(models.Model):
+    """
+    Running totals of one branch on one shard: customers registered there and
+    purchases made there, archived ones included. Adjusted in the same
+    transaction as each change, so a branch's dashboard reads one row per
+    shard instead of counting its tables. ``manage.py recount_branch_stats``
+    rebuilds them from the tables.
+    """
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+        verbose_name="شعبه"
+    )
+    customers = models.BigIntegerField(default=0, verbose_name="تعداد مشتریان")
+    purchases = models.BigIntegerField(default=0, verbose_name="تعداد خریدها")
+    cashback = models.DecimalField(max_digits=16, decimal_places=0, default=0, verbose_name="مجموع کش‌بک")
+    updated_at = models.DateTimeField(default=timezone.now, verbose_name="تاریخ بروزرسانی")
+
+    def __str__(self):
+        return f"{self.branch_id}: {self.customers} / {self.purchases}"
+
+    @classmethod
+    def add(cls, using, branch_id, customers=0, purchases=0, cashback=0):
+        """Adjust a branch's counters on one shard; call inside the change's transaction."""
+        if branch_id is None:
+            return
+        deltas = {'customers': customers, 'purchases': purchases, 'cashback': cashback}
+        changes = {name: models.F(name) + delta for name, delta in deltas.items() if delta}
+        if not changes:
+            return
+        rows = cls.objects.using(using).filter(branch_id=branch_id)
+        if rows.update(**changes, updated_at=timezone.now()):
+            return
+        try:
+            with transaction.atomic(using=using):
+                cls.objects.using(using).create(branch_id=branch_id, **deltas)
+        except IntegrityError:
+            # Another transaction created the row first
+            rows.update(**changes, updated_at=timezone.now())
+
+    class Meta:
+        verbose_name = "آمار شعبه"
+        verbose_name_plural = "آمار شعبه‌ها"
+        constraints = [
+            models.UniqueConstraint(fields=['branch'], name='branch_stats_branch'),
+        ]
+
+
+class CustomerSegment(models.Model):
+    """
+    A customer's recency/frequency/monetary (RFM) scores and the marketing
+    segment they fall in, precomputed by ``manage.py compute_segments`` (see
+    segments.py) so campaigns select a segment with one indexed query.
+    """
+    SEGMENTS = (
+        ('champions', 'مشتریان برتر'),
+        ('loyal', 'وفادار'),
+        ('high_value_lapsed', 'پرارزش غیرفعال'),
+        ('new', 'جدید'),
+        ('promising', 'امیدوارکننده'),
+        ('need_attention', 'نیازمند توجه'),
+        ('hibernating', 'کم‌فعال'),
+        ('lost', 'از دست رفته'),
+        ('no_purchases', 'بدون خرید'),
+    )
+
+    customer = models.OneToOneField(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='segment',
+        verbose_name="مشتری"
+    )
+    segment = models.CharField(max_length=20, choices=SEGMENTS, verbose_name="بخش")
+    recency_days = models.PositiveIntegerField(null=True, blank=True, verbose_name="روز از آخرین خرید")
+    frequency = models.PositiveIntegerField(default=0, verbose_name="تعداد خرید")
+    monetary = models.DecimalField(max_digits=16, decimal_places=0, default=0, verbose_name="جمع مبلغ خرید")
+    last_purchase_at = models.DateTimeField(null=True, blank=True, verbose_name="آخرین خرید")
+    # Quintiles 1 (worst) to 5 (best); 0 for customers without purchases
+    recency_score = models.PositiveSmallIntegerField(default=0, verbose_name="امتیاز تازگی")
+    frequency_score = models.PositiveSmallIntegerField(default=0, verbose_name="امتیاز تکرار")
+    monetary_score = models.PositiveSmallIntegerField(default=0, verbose_name="امتیاز مبلغ")
+    computed_at = models.DateTimeField(verbose_name="زمان محاسبه")
+
+    def __str__(self):
+        return f"{self.customer_id}: {self.get_segment_display()}"
+
+    class Meta:
+        verbose_name = "بخش مشتری"
+        verbose_name_plural = "بخش‌های مشتریان"
+        indexes = [
+            # A segment's customers, most valuable first
+            models.Index(fields=['segment', '-monetary'], name='segment_segment_monetary_idx'),
+        ]
+
+
+class SegmentationRun(models.Model):
+    """
+    One run of ``compute_segments``. A full run scores every customer and
+    stores the quantile edges; incremental runs score the customers with new
+    purchases against the edges of the last full run.
+    """
+    started_at = models.DateTimeField(default=timezone.now, db_index=True, verbose_name="زمان شروع")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="زمان پایان")
+    full = models.BooleanField(default=True, verbose_name="محاسبه کامل")
+    customers = models.PositiveIntegerField(default=0, verbose_name="تعداد مشتریان محاسبه شده")
+    # Inner quintile edges: recency in days, frequency in purchases, monetary in rials
+    edges = models.JSONField(default=dict, verbose_name="مرزهای امتیازدهی")
+
+    def __str__(self):
+        return f"{self.started_at:%Y-%m-%d %H:%M} ({'کامل' if self.full else 'افزایشی'})"
+
+    class Meta:
+        verbose_name = "اجرای بخش‌بندی"
+        verbose_name_plural = "اجراهای بخش‌بندی"
+        ordering = ['-started_at']
+
+
+class WalletDebit(models.Model):
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='debits',
+        verbose_name="مشتری"
+    )
+    amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        verbose_name="مبلغ کسر"
+    )
+    reason = models.CharField(max_length=200, verbose_name="دلیل کسر")
+    # Links the debit to the ActivityLog written for it (which lives on 'default')
+    activity_log_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        unique=True,
+        verbose_name="شناسه گزارش فعالیت"
+    )
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_constraint=False,
+        verbose_name="ثبت کننده"
+    )
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="تاریخ ثبت")
+
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(WalletDebit, instance=self),
+                                savepoint=False):
+            super().save(*args, **kwargs)
+            ChangeEvent.record(self, 'create' if creating else 'update')
+
+    def __str__(self):
+        return f"{self.customer} - {self.amount} - {self.created_at.strftime('%Y-%m-%d')}"
+
+    class Meta:
+        verbose_name = "کسر از کیف پول"
+        verbose_name_plural = "کسرهای کیف پول"
+        ordering = ['-created_at']
+
+
+class CashbackLot(models.Model):
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='cashback_lots',
+        verbose_name="مشتری"
+    )
+    purchase = models.OneToOneField(
+        Purchase,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='cashback_lot',
+        verbose_name="خرید"
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=0, verbose_name="مبلغ کش‌بک")
+    remaining = models.DecimalField(max_digits=12, decimal_places=0, verbose_name="مانده")
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name="تاریخ انقضا")
+    expired_amount = models.DecimalField(
+        max_digits=12,
+        decimal_places=0,
+        default=0,
+        verbose_name="مبلغ منقضی شده"
+    )
+    expired_at = models.DateTimeField(null=True, blank=True, verbose_name="زمان انقضا")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="تاریخ ثبت")
+
+    def __str__(self):
+        return f"{self.customer} - {self.remaining}/{self.amount}"
+
+    @staticmethod
+    def expiry_for(credited_at):
+        """Expiry date for cashback credited at the given time, or None if it never expires."""
+        from django.conf import settings
+        from datetime import timedelta
+        days = settings.CASHBACK_EXPIRY_DAYS
+        if not days:
+            return None
+        return (credited_at or timezone.now()) + timedelta(days=days)
+
+    @classmethod
+    def consume(cls, customer, amount):
+        """
+        Take a debit out of the customer's open lots, soonest-expiring first.
+        Call inside the transaction that reduces the wallet. Any part of the
+        debit beyond the open lots comes out of balance that predates lots.
+        """
+        now = timezone.now()
+        lots = customer.cashback_lots.select_for_update().filter(
+            models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=now),
+            remaining__gt=0,
+        ).order_by(models.F('expires_at').asc(nulls_last=True), 'pk')
+
+        changed = []
+        for lot in lots.iterator(chunk_size=100):
+            if amount <= 0:
+                break
+            taken = min(lot.remaining, amount)
+            lot.remaining -= taken
+            amount -= taken
+            changed.append(lot)
+        if changed:
+            cls.objects.using(customer._state.db).bulk_update(changed, ['remaining'])
+
+    class Meta:
+        verbose_name = "بسته کش‌بک"
+        verbose_name_plural = "بسته‌های کش‌بک"
+        indexes = [
+            # Upcoming expiries on the detail page and FIFO consumption
+            models.Index(fields=['customer', 'expires_at'], name='lot_customer_expiry_idx'),
+            # Expiry sweeps only ever look at lots that still hold cashback
+            models.Index(
+                fields=['expires_at', 'customer'],
+                condition=models.Q(remaining__gt=0),
+                name='lot_open_expiry_idx',
+            ),
+        ]
+
+
+class Notification(models.Model):
+    """
+    Outbox of messages to a customer, written in the same transaction as the
+    wallet change it reports and sent by ``manage.py send_notifications``.
+    """
+    KINDS = (
+        ('credit', 'افزایش موجودی'),
+        ('debit', 'کسر از موجودی'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'در صف'),
+        ('sending', 'در حال ارسال'),
+        ('sent', 'ارسال شده'),
+        ('failed', 'ناموفق'),
+    )
+
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='notifications',
+        verbose_name="مشتری"
+    )
+    kind = models.CharField(max_length=10, choices=KINDS, verbose_name="نوع")
+    # One message per event however often the event is retried or replayed
+    dedup_key = models.CharField(max_length=100, unique=True, verbose_name="کلید یکتا")
+    phone_number = models.CharField(max_length=11, verbose_name="شماره موبایل")
+    text = models.CharField(max_length=500, verbose_name="متن پیام")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name="وضعیت")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="تعداد تلاش")
+    next_attempt_at = models.DateTimeField(default=timezone.now, verbose_name="زمان تلاش بعدی")
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name="ارسال کننده")
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name="مهلت اجاره")
+    provider_message_id = models.CharField(max_length=100, blank=True, verbose_name="شناسه پیام در سرویس")
+    error = models.CharField(max_length=500, blank=True, verbose_name="خطا")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="تاریخ ایجاد")
+    sent_at = models.DateTimeField(null=True, blank=True, verbose_name="زمان ارسال")
+
+    def __str__(self):
+        return f"{self.phone_number} - {self.get_kind_display()} - {self.get_status_display()}"
+
+    @classmethod
+    def wallet_credit(cls, purchase):
+        """Queue the message for a purchase's cashback; call inside the purchase's transaction."""
+        customer = purchase.customer
+        return customer.notifications.create(
+            kind='credit',
+            dedup_key=f'purchase:{purchase.pk}',
+            phone_number=customer.phone_number,
+            text=(f"خرید {purchase.amount:,.0f} ریالی شما ثبت شد و {purchase.cashback_amount:,.0f} ریال "
+                  f"کش‌بک به کیف پولتان اضافه شد. موجودی: {customer.wallet_balance:,.0f} ریال"),
+        )
+
+    @classmethod
+    def wallet_debit(cls, debit):
+        """Queue the message for a wallet debit; call inside the debit's transaction."""
+        customer = debit.customer
+        return customer.notifications.create(
+            kind='debit',
+            dedup_key=f'debit:{debit.pk}',
+            phone_number=customer.phone_number,
+            text=(f"{debit.amount:,.0f} ریال از کیف پول شما کسر شد. "
+                  f"موجودی: {customer.wallet_balance:,.0f} ریال"),
+        )
+
+    class Meta:
+        verbose_name = "پیامک مشتری"
+        verbose_name_plural = "پیامک‌های مشتریان"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='notification_due_idx'),
+        ]
+
+
+class ChangeEvent(models.Model):
+    """
+    Change feed of customers, purchases and wallet debits for downstream
+    systems, written in the same transaction as the change and delivered by
+    ``manage.py relay_changes`` (see changefeed.py), which reads each shard's
+    events in id order.
+    """
+    ENTITIES = (
+        ('customer', 'مشتری'),
+        ('purchase', 'خرید'),
+        ('walletdebit', 'کسر از کیف پول'),
+    )
+    OPERATIONS = (
+        ('create', 'ایجاد'),
+        ('update', 'ویرایش'),
+        ('delete', 'حذف'),
+        ('move', 'انتقال به پایگاه داده دیگر'),
+    )
+    # Columns copied into an event's data, per entity
+    FIELDS = {
+        'customer': ('first_name', 'last_name', 'national_code', 'phone_number', 'wallet_balance', 'branch_id',
+                     'updated_at'),
+        'purchase': ('customer_id', 'amount', 'cashback_amount', 'created_at', 'created_by_id', 'branch_id'),
+        'walletdebit': ('customer_id', 'amount', 'reason', 'created_at', 'created_by_id'),
+    }
+
+    entity = models.CharField(max_length=20, choices=ENTITIES, verbose_name="موجودیت")
+    entity_id = models.BigIntegerField(verbose_name="شناسه")
+    operation = models.CharField(max_length=10, choices=OPERATIONS, verbose_name="عملیات")
+    # JSON object of FIELDS[entity], stored encoded so the relay copies it as is
+    data = models.TextField(verbose_name="داده‌ها")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="زمان تغییر")
+
+    def __str__(self):
+        return f"{self.get_entity_display()} {self.entity_id} - {self.get_operation_display()}"
+
+    @staticmethod
+    def encode(values):
+        """Compact JSON of an event's data; whole rial amounts become integers."""
+        def default(value):
+            if hasattr(value, 'isoformat'):
+                return value.isoformat()
+            if value == value.to_integral_value():
+                return int(value)
+            return str(value)
+        return json.dumps(values, ensure_ascii=False, separators=(',', ':'), default=default)
+
+    @classmethod
+    def record(cls, instance, operation, using=None, **extra):
+        """Append one event for a saved or deleted row; call inside the change's transaction."""
+        entity = instance._meta.model_name
+        values = {field: getattr(instance, field) for field in cls.FIELDS[entity]}
+        values.update(extra)
+        return cls.objects.using(using or instance._state.db).create(
+            entity=entity, entity_id=instance.pk, operation=operation, data=cls.encode(values),
+        )
+
+    @classmethod
+    def record_rows(cls, model, alias, pks, operation='update'):
+        """Append events for rows changed by a bulk UPDATE, read back in the same transaction."""
+        entity = model._meta.model_name
+        pks = list(pks)
+        now = timezone.now()
+        recorded = 0
+        for start in range(0, len(pks), 1000):
+            rows = model._base_manager.using(alias).filter(pk__in=pks[start:start + 1000]).order_by('pk')
+            events = [
+                cls(entity=entity, entity_id=values.pop('id'), operation=operation,
+                    data=cls.encode(values), created_at=now)
+                for values in rows.values('id', *cls.FIELDS[entity])
+            ]
+            cls.objects.using(alias).bulk_create(events)
+            recorded += len(events)
+        return recorded
+
+    class Meta:
+        verbose_name = "رویداد تغییر"
+        verbose_name_plural = "رویدادهای تغییر"
+        ordering = ['id']
+
+
+class ChangeFeedOffset(models.Model):
+    """How far a downstream consumer has received one shard's change feed."""
+    consumer = models.CharField(max_length=50, verbose_name="مصرف کننده")
+    shard = models.CharField(max_length=50, verbose_name="پایگاه داده")
+    last_event_id = models.BigIntegerField(default=0, verbose_name="آخرین رویداد تحویل شده")
+    events_delivered = models.BigIntegerField(default=0, verbose_name="تعداد رویدادهای تحویل شده")
+    delivered_at = models.DateTimeField(null=True, blank=True, verbose_name="آخرین تحویل")
+
+    def __str__(self):
+        return f"{self.consumer} / {self.shard}: {self.last_event_id}"
+
+    class Meta:
+        verbose_name = "موقعیت مصرف کننده تغییرات"
+        verbose_name_plural = "موقعیت مصرف کنندگان تغییرات"
+        constraints = [
+            models.UniqueConstraint(fields=['consumer', 'shard'], name='change_feed_offset_consumer_shard'),
+        ]
 
 
 class ActivityLog(models.Model):
@@ -146,11 +772,13 @@ class ActivityLog(models.Model):
         verbose_name="نوع فعالیت"
     )
     description = models.TextField(verbose_name="توضیحات")
+    # The customer may live on another shard database
     customer = models.ForeignKey(
         'Customer',
         on_delete=models.SET_NULL,
         null=True,
         blank=True,
+        db_constraint=False,
         verbose_name="مشتری مرتبط"
     )
     ip_address = models.GenericIPAddressField(
@@ -158,7 +786,22 @@ class ActivityLog(models.Model):
         blank=True,
         verbose_name="آدرس IP"
     )
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ثبت")
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        db_index=False,
+        related_name='+',
+        verbose_name="شعبه"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="تاریخ ثبت")
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.branch_id is None:
+            # Logged under the branch of the user who did it
+            self.branch_id = branch_id_of(self.user)
+        super().save(*args, **kwargs)
     
     def __str__(self):
         return f"{self.user.username} - {self.get_activity_type_display()} - {self.created_at.strftime('%Y-%m-%d %H:%M')}"
@@ -188,6 +831,9 @@ class ActivityLog(models.Model):
         verbose_name = "گزارش فعالیت"
         verbose_name_plural = "گزارش فعالیت‌ها"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['branch', 'created_at'], name='activitylog_branch_created_idx'),
+        ]
 
 
 class UserProfile(models.Model):
@@ -207,6 +853,15 @@ class UserProfile(models.Model):
         default='operator',
         verbose_name="نوع کاربر"
     )
+    # Empty for users who work across all branches
+    branch = models.ForeignKey(
+        Branch,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='profiles',
+        verbose_name="شعبه"
+    )
     
     def __str__(self):
         return f"{self.user.username} - {self.get_user_type_display()}"
@@ -214,3 +869,156 @@ class UserProfile(models.Model):
     class Meta:
         verbose_name = "پروفایل کاربر"
         verbose_name_plural = "پروفایل کاربران"
+
+
+class Job(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'در صف'),
+        ('running', 'در حال اجرا'),
+        ('succeeded', 'انجام شده'),
+        ('failed', 'ناموفق'),
+    )
+
+    kind = models.CharField(max_length=50, verbose_name="نوع کار")
+    payload = models.JSONField(default=dict, blank=True, verbose_name="پارامترها")
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default='pending',
+        verbose_name="وضعیت"
+    )
+    progress = models.PositiveSmallIntegerField(default=0, verbose_name="پیشرفت (درصد)")
+    progress_message = models.CharField(max_length=200, blank=True, verbose_name="پیام پیشرفت")
+    attempts = models.PositiveIntegerField(default=0, verbose_name="تعداد تلاش")
+    max_attempts = models.PositiveIntegerField(default=3, verbose_name="حداکثر تلاش")
+    run_after = models.DateTimeField(default=timezone.now, verbose_name="زمان اجرا")
+    locked_by = models.CharField(max_length=100, blank=True, verbose_name="پردازشگر")
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name="مهلت اجاره")
+    result_file = models.CharField(max_length=255, blank=True, verbose_name="فایل نتیجه")
+    error = models.TextField(blank=True, verbose_name="خطا")
+    created_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name="ثبت کننده"
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ثبت")
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name="زمان شروع")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="زمان پایان")
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} - {self.get_status_display()}"
+
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
+
+    class Meta:
+        verbose_name = "کار پس‌زمینه"
+        verbose_name_plural = "کارهای پس‌زمینه"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
+
+
+class LoginSession(models.Model):
+    """One row per login, closed on logout; last_seen_at is refreshed by LastSeenMiddleware."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='login_sessions',
+        verbose_name="کاربر"
+    )
+    session_key = models.CharField(max_length=40, unique=True, verbose_name="کلید نشست")
+    ip_address = models.GenericIPAddressField(null=True, blank=True, verbose_name="آدرس IP")
+    started_at = models.DateTimeField(default=timezone.now, verbose_name="زمان ورود")
+    last_seen_at = models.DateTimeField(default=timezone.now, verbose_name="آخرین فعالیت")
+    ended_at = models.DateTimeField(null=True, blank=True, verbose_name="زمان خروج")
+
+    def __str__(self):
+        return f"{self.user.username} - {self.started_at.strftime('%Y-%m-%d %H:%M')}"
+
+    class Meta:
+        verbose_name = "نشست کاربر"
+        verbose_name_plural = "نشست‌های کاربران"
+        ordering = ['-started_at']
+
+
+class CustomerToken(models.Model):
+    """Scannable loyalty card number or QR payload; the directory lives on 'default'."""
+    KINDS = (
+        ('card', 'کارت وفاداری'),
+        ('qr', 'کد QR'),
+    )
+
+    token = models.CharField(max_length=64, unique=True, verbose_name="شناسه")
+    kind = models.CharField(max_length=10, choices=KINDS, default='card', verbose_name="نوع")
+    # The customer may live on another shard database
+    customer = models.ForeignKey(
+        Customer,
+        on_delete=models.CASCADE,
+        related_name='tokens',
+        db_constraint=False,
+        verbose_name="مشتری"
+    )
+    is_active = models.BooleanField(default=True, verbose_name="فعال")
+    created_at = models.DateTimeField(default=timezone.now, verbose_name="تاریخ صدور")
+
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.token}"
+
+    class Meta:
+        verbose_name = "کارت مشتری"
+        verbose_name_plural = "کارت‌های مشتریان"
+        ordering = ['-created_at']
+
+
+class ProfilingRule(models.Model):
+    """Which requests ProfilingMiddleware profiles; see cashback_app/profiling.py."""
+    MODES = (
+        ('cprofile', 'cProfile (همه فراخوانی‌ها)'),
+        ('sample', 'نمونه‌برداری از پشته'),
+    )
+
+    view_name = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name="نام مسیر",
+        help_text="نام URL مانند customer_detail؛ خالی یعنی همه صفحات"
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='profiling_rules',
+        verbose_name="کاربر",
+        help_text="خالی یعنی همه کاربران"
+    )
+    sample_rate = models.FloatField(
+        default=0.1,
+        validators=[MinValueValidator(0), MaxValueValidator(1)],
+        verbose_name="نرخ نمونه‌برداری",
+        help_text="سهم درخواست‌های منطبق که پروفایل می‌شوند، بین 0 و 1"
+    )
+    mode = models.CharField(max_length=10, choices=MODES, default='cprofile', verbose_name="روش")
+    is_active = models.BooleanField(default=True, verbose_name="فعال")
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name="پایان اعتبار")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="تاریخ ایجاد")
+
+    def __str__(self):
+        return f"{self.view_name or 'همه صفحات'} ({self.sample_rate:.0%})"
+
+    def matches(self, view_name, user_id):
+        if self.view_name and self.view_name != view_name:
+            return False
+        if self.user_id and self.user_id != user_id:
+            return False
+        return self.expires_at is None or self.expires_at > timezone.now()
+
+    class Meta:
+        verbose_name = "قاعده پروفایل"
+        verbose_name_plural = "قواعد پروفایل"
+        ordering = ['-created_at']
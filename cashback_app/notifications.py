@@ -0,0 +1,301 @@
+"""
+Customer notifications (SMS) sent from the Notification outbox.
+
+Wallet changes only insert an outbox row inside their own transaction, so a
+checkout never waits for the SMS gateway and a rolled-back purchase never
+sends a message. ``manage.py send_notifications`` runs ``Dispatcher``, an
+asyncio loop that leases due rows from every shard in batches and hands them
+to the configured provider. Concurrency is bounded and the provider's rate
+limit is respected. Failed messages are retried with backoff.
+
+Rows are claimed the same way jobs.py claims jobs: a conditional UPDATE
+marks them 'sending' with a lease. A dispatcher that dies mid-batch leaves
+rows that another dispatcher reclaims once the lease runs out. Each message
+carries its outbox ``dedup_key`` as idempotency key, so a provider that
+honours it never delivers a reclaimed message twice.
+
+Providers are configured with NOTIFICATION_PROVIDER (see settings.py).
+``ConsoleProvider`` logs messages, and ``HttpProvider`` posts batches to an
+HTTP gateway such as the one ``manage.py fake_sms_server`` runs for tests.
+"""
+import asyncio
+import json
+import logging
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Notification
+from .sharding import shard_aliases
+
+logger = logging.getLogger(__name__)
+
+# Delay before retry n is RETRY_BASE_DELAY * 2 ** (n - 1)
+RETRY_BASE_DELAY = timedelta(seconds=30)
+
+
+class ProviderError(Exception):
+    """The whole batch failed and should be retried; ``retry_after`` is in seconds."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SendResult:
+    def __init__(self, dedup_key, ok, message_id='', error=''):
+        self.dedup_key = dedup_key
+        self.ok = ok
+        self.message_id = message_id
+        self.error = error
+
+
+class BaseProvider:
+    """
+    Sends batches of messages. ``send_batch`` receives dicts with 'id' (the
+    dedup key), 'to' and 'text'. It returns one SendResult per message or
+    raises ProviderError when the batch as a whole should be retried.
+    Called from a worker thread.
+    """
+    batch_size = 50
+    # Messages per second the provider accepts; None for no limit
+    rate_limit = None
+
+    def __init__(self, batch_size=None, rate_limit=None, **options):
+        if batch_size:
+            self.batch_size = batch_size
+        if rate_limit:
+            self.rate_limit = rate_limit
+
+    def send_batch(self, messages):
+        raise NotImplementedError
+
+
+class ConsoleProvider(BaseProvider):
+    """Logs messages instead of sending them (development)."""
+
+    def send_batch(self, messages):
+        for message in messages:
+            logger.info("SMS to %s: %s", message['to'], message['text'])
+        return [SendResult(message['id'], True) for message in messages]
+
+
+class HttpProvider(BaseProvider):
+    """
+    JSON batch gateway: POST {"messages": [{"id", "to", "text"}]} to ``url``
+    and expect {"results": [{"id", "status": "sent"|"duplicate"|"failed",
+    "message_id", "error"}]}. 429 and 5xx responses retry the batch.
+    """
+
+    def __init__(self, url, api_key='', timeout=10, **options):
+        super().__init__(**options)
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def send_batch(self, messages):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({'messages': messages}).encode('utf-8'),
+            headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {self.api_key}'},
+            method='POST',
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                body = json.load(response)
+        except urllib.error.HTTPError as e:
+            if e.code == 429 or e.code >= 500:
+                retry_after = e.headers.get('Retry-After')
+                raise ProviderError(f'HTTP {e.code}', float(retry_after) if retry_after else None)
+            # Anything else means the request itself is wrong; retrying will not help
+            error = f'HTTP {e.code}: {e.read()[:200].decode("utf-8", "replace")}'
+            return [SendResult(message['id'], False, error=error) for message in messages]
+        except (OSError, ValueError) as e:
+            raise ProviderError(str(e))
+
+        results = {result.get('id'): result for result in body.get('results', [])}
+        return [
+            SendResult(
+                message['id'],
+                results.get(message['id'], {}).get('status') in ('sent', 'duplicate'),
+                message_id=str(results.get(message['id'], {}).get('message_id', '')),
+                error=results.get(message['id'], {}).get('error', 'missing from gateway response'),
+            )
+            for message in messages
+        ]
+
+
+def get_provider():
+    config = dict(settings.NOTIFICATION_PROVIDER)
+    return import_string(config.pop('BACKEND'))(**{key.lower(): value for key, value in config.items()})
+
+
+class RateLimiter:
+    """Token bucket shared by the dispatcher's concurrent sends."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, count):
+        if not self.rate:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                # A batch larger than the bucket waits until the bucket is full
+                needed = min(count, self.rate)
+                if self.tokens >= needed:
+                    self.tokens -= count
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+
+def _claimable(alias, now):
+    return Notification.objects.using(alias).filter(
+        Q(status='pending', next_attempt_at__lte=now) |
+        Q(status='sending', locked_until__lt=now)
+    )
+
+
+def claim_batch(alias, worker_id, limit, lease_seconds=120):
+    """Lease up to ``limit`` due notifications of one shard for this worker."""
+    now = timezone.now()
+    candidates = list(_claimable(alias, now).order_by('next_attempt_at').values_list('pk', flat=True)[:limit])
+    if not candidates:
+        return []
+    # Rows another worker claimed in the meantime no longer match the filter
+    _claimable(alias, now).filter(pk__in=candidates).update(
+        status='sending',
+        locked_by=worker_id,
+        locked_until=now + timedelta(seconds=lease_seconds),
+        attempts=F('attempts') + 1,
+    )
+    return list(Notification.objects.using(alias).filter(pk__in=candidates, locked_by=worker_id, status='sending'))
+
+
+def record_results(alias, worker_id, notifications, results, retry_after=None):
+    """Store the outcome of one sent batch; ``results`` is None when the whole batch failed."""
+    now = timezone.now()
+    by_key = {result.dedup_key: result for result in results or []}
+    sent, retry, failed = [], {}, {}
+    for notification in notifications:
+        result = by_key.get(notification.dedup_key)
+        if result is not None and result.ok:
+            notification.provider_message_id = result.message_id[:100]
+            sent.append(notification)
+            continue
+        error = (result.error if result is not None else 'provider unavailable')[:500]
+        if notification.attempts < settings.NOTIFICATION_MAX_ATTEMPTS:
+            delay = RETRY_BASE_DELAY * (2 ** (notification.attempts - 1))
+            if retry_after:
+                delay = max(delay, timedelta(seconds=retry_after))
+            retry.setdefault((now + delay, error), []).append(notification.pk)
+        else:
+            failed.setdefault(error, []).append(notification.pk)
+
+    owned = Notification.objects.using(alias).filter(locked_by=worker_id, status='sending')
+    if sent:
+        owned.filter(pk__in=[notification.pk for notification in sent]).update(
+            status='sent', sent_at=now, locked_by='', locked_until=None, error=''
+        )
+        with_ids = [notification for notification in sent if notification.provider_message_id]
+        if with_ids:
+            Notification.objects.using(alias).bulk_update(with_ids, ['provider_message_id'])
+    for (next_attempt_at, error), ids in retry.items():
+        owned.filter(pk__in=ids).update(status='pending', next_attempt_at=next_attempt_at,
+                                        locked_by='', locked_until=None, error=error)
+    for error, ids in failed.items():
+        owned.filter(pk__in=ids).update(status='failed', locked_by='', locked_until=None, error=error)
+    return len(sent)
+
+
+def purge_sent(keep_days):
+    """Delete sent and failed notifications older than ``keep_days``; returns the count."""
+    cutoff = timezone.now() - timedelta(days=keep_days)
+    deleted = 0
+    for alias in shard_aliases():
+        deleted += Notification.objects.using(alias).filter(
+            status__in=['sent', 'failed'], created_at__lt=cutoff
+        )._raw_delete(alias)
+    return deleted
+
+
+class Dispatcher:
+    """Drains the outbox of every shard with bounded concurrency."""
+
+    # Seconds between purges of old sent and failed notifications
+    purge_interval = 3600
+
+    def __init__(self, provider=None, concurrency=4, lease_seconds=120):
+        self.provider = provider or get_provider()
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.worker_id = f'notify-{uuid.uuid4().hex[:12]}'
+        self.sent = 0
+        self.attempted = 0
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.limiter = RateLimiter(self.provider.rate_limit)
+
+    async def run(self, once=False, poll_interval=1.0, stopping=None, keep_days=None):
+        """
+        Send until ``stopping`` (an asyncio.Event) is set; with ``once``, stop
+        when nothing is due. Batches in flight always finish recording their
+        results. With ``keep_days``, old notifications are purged hourly.
+        """
+        stopping = stopping or asyncio.Event()
+        purged_at = None
+        while not stopping.is_set():
+            if keep_days is not None and (purged_at is None or time.monotonic() - purged_at >= self.purge_interval):
+                purged = await sync_to_async(purge_sent)(keep_days)
+                if purged:
+                    logger.info("Purged %s old notifications", purged)
+                purged_at = time.monotonic()
+            if await self.dispatch_once():
+                continue
+            if once:
+                return
+            try:
+                await asyncio.wait_for(stopping.wait(), poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch_once(self):
+        """Claim one round of batches from every shard and send them; returns the rows claimed."""
+        limit = self.provider.batch_size * self.concurrency
+        claims = await asyncio.gather(*(
+            sync_to_async(claim_batch)(alias, self.worker_id, limit, self.lease_seconds)
+            for alias in shard_aliases()
+        ))
+        sends = []
+        for alias, notifications in zip(shard_aliases(), claims):
+            for start in range(0, len(notifications), self.provider.batch_size):
+                sends.append(self._send(alias, notifications[start:start + self.provider.batch_size]))
+        await asyncio.gather(*sends)
+        return sum(len(notifications) for notifications in claims)
+
+    async def _send(self, alias, notifications):
+        messages = [{'id': n.dedup_key, 'to': n.phone_number, 'text': n.text} for n in notifications]
+        async with self.semaphore:
+            await self.limiter.acquire(len(messages))
+            try:
+                results = await asyncio.to_thread(self.provider.send_batch, messages)
+                retry_after = None
+            except ProviderError as e:
+                logger.warning("Notification batch of %s failed: %s", len(messages), e)
+                results, retry_after = None, e.retry_after
+        self.attempted += len(notifications)
+        sent = await sync_to_async(record_results)(alias, self.worker_id, notifications, results, retry_after)
+        self.sent += sent
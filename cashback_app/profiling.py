@@ -0,0 +1,214 @@
+"""
+On-demand request profiling controlled by ProfilingRule rows in the admin.
+
+ProfilingMiddleware (middleware.py) keeps the active rules in process memory
+and reloads them every PROFILING_RULES_TTL seconds, so with no rules a
+request costs one clock read. A request that matches a rule's view and user is profiled with
+probability ``sample_rate``, either with cProfile (``.prof``, readable by
+pstats, snakeviz or flameprof) or with a stack sampler that writes folded
+stacks (``.folded``, the input of flamegraph.pl and speedscope).
+
+Profiles are stored in PROFILE_DIR next to a small JSON description. Only
+the newest PROFILE_RING_SIZE are kept, so the directory stays bounded.
+"""
+import cProfile
+import io
+import json
+import marshal
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+from django.utils import timezone
+
+from .models import ProfilingRule
+
+META_SUFFIX = '.json'
+PROFILE_NAME_RE = re.compile(r'^[\w-]+$')
+
+
+class RuleCache:
+    """Active rules of this process, reloaded at most every ``ttl`` seconds."""
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.rules = []
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        if self.loaded_at is None or now - self.loaded_at >= self.ttl:
+            with self.lock:
+                if self.loaded_at is None or now - self.loaded_at >= self.ttl:
+                    self.rules = list(ProfilingRule.objects.filter(is_active=True, sample_rate__gt=0))
+                    self.loaded_at = now
+        return self.rules
+
+    def clear(self):
+        self.loaded_at = None
+
+
+rule_cache = RuleCache(settings.PROFILING_RULES_TTL)
+
+
+def matching_rule(request):
+    """The first active rule this request falls under after sampling, or None."""
+    rules = rule_cache.get()
+    if not rules:
+        return None
+    try:
+        view_name = resolve(request.path_info).view_name
+    except Resolver404:
+        return None
+    user_id = request.user.pk if request.user.is_authenticated else None
+    for rule in rules:
+        if rule.matches(view_name, user_id) and random.random() < rule.sample_rate:
+            return rule
+    return None
+
+
+class StackSampler:
+    """Samples one thread's stack every ``interval`` seconds from a helper thread."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiling-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def profile_dir():
+    path = Path(settings.PROFILE_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def profile_request(rule, request, get_response):
+    """Run ``get_response`` under the rule's profiler and store the result."""
+    started = time.perf_counter()
+    if rule.mode == 'sample':
+        profiler = StackSampler(settings.PROFILE_SAMPLE_INTERVAL)
+        profiler.start()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.stop()
+        data, suffix = profiler.folded().encode('utf-8'), '.folded'
+    else:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this process
+            return get_response(request)
+        try:
+            response = get_response(request)
+        finally:
+            profiler.disable()
+        profiler.create_stats()
+        data, suffix = marshal.dumps(profiler.stats), '.prof'
+    duration_ms = (time.perf_counter() - started) * 1000
+
+    save_profile(data, suffix, {
+        'rule_id': rule.pk,
+        'mode': rule.mode,
+        'method': request.method,
+        'url': request.get_full_path()[:500],
+        'view_name': getattr(request.resolver_match, 'view_name', ''),
+        'user': request.user.get_username() if request.user.is_authenticated else '',
+        'status': response.status_code,
+        'duration_ms': round(duration_ms, 1),
+    })
+    return response
+
+
+def save_profile(data, suffix, meta):
+    directory = profile_dir()
+    now = timezone.now()
+    name = f"{now:%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:6]}"
+    (directory / f'{name}{suffix}').write_bytes(data)
+    meta = {**meta, 'name': name, 'file': f'{name}{suffix}', 'created_at': now.isoformat()}
+    # The description is written last; list_profiles only shows complete profiles
+    tmp_path = directory / f'{name}.tmp'
+    tmp_path.write_text(json.dumps(meta), encoding='utf-8')
+    os.replace(tmp_path, directory / f'{name}{META_SUFFIX}')
+    _trim(directory)
+    return name
+
+
+def _trim(directory):
+    metas = sorted(directory.glob(f'*{META_SUFFIX}'))
+    for meta_path in metas[:max(len(metas) - settings.PROFILE_RING_SIZE, 0)]:
+        for path in directory.glob(f'{meta_path.stem}.*'):
+            path.unlink(missing_ok=True)
+
+
+def list_profiles():
+    """Descriptions of the stored profiles, newest first."""
+    profiles = []
+    for meta_path in sorted(profile_dir().glob(f'*{META_SUFFIX}'), reverse=True):
+        try:
+            profiles.append(json.loads(meta_path.read_text(encoding='utf-8')))
+        except (FileNotFoundError, ValueError):
+            # Trimmed by another process while listing
+            continue
+    return profiles
+
+
+def get_profile(name):
+    """Description of one stored profile with its data file's 'path', or None."""
+    if not PROFILE_NAME_RE.match(name):
+        return None
+    directory = profile_dir()
+    try:
+        meta = json.loads((directory / f'{name}{META_SUFFIX}').read_text(encoding='utf-8'))
+    except (FileNotFoundError, ValueError):
+        return None
+    meta['path'] = directory / meta['file']
+    return meta if meta['path'].exists() else None
+
+
+def summarize(profile, limit=40):
+    """Human-readable top of a profile: pstats by cumulative time, or the heaviest stacks."""
+    if profile['mode'] == 'sample':
+        lines = profile['path'].read_text(encoding='utf-8').splitlines()
+        return '\n'.join(lines[:limit])
+    import pstats
+
+    output = io.StringIO()
+    stats = pstats.Stats(str(profile['path']), stream=output)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return output.getvalue()
+
@@ -0,0 +1,184 @@
+"""
+Query plan inspection for ``manage.py audit_query_plans``.
+
+``explain`` asks the database how it would run a captured statement and
+``analyze`` turns the plan into findings: full table scans, sorts through
+temporary B-trees and ``LIKE '%...%'`` filters that no B-tree index can serve.
+Where an index would help, the finding carries a ``models.Index`` definition
+for the model that owns the table, ready to be added to its Meta and turned
+into a migration.
+"""
+import re
+
+from django.apps import apps
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+STRING_LITERAL_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+SQLITE_SCAN_RE = re.compile(r'^SCAN (\w+)(?: AS \w+)?(?P<index> USING (?:COVERING )?INDEX \w+)?')
+SQLITE_TEMP_RE = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT|RIGHT PART OF ORDER BY)')
+WHERE_RE = re.compile(r'\bWHERE\b(.*?)(?:\bGROUP BY\b|\bORDER BY\b|\bLIMIT\b|$)', re.S)
+ORDER_BY_RE = re.compile(r'\bORDER BY\b(.*?)(?:\bLIMIT\b|\bOFFSET\b|$)', re.S)
+FILTER_COLUMN_RE = re.compile(r'"(\w+)"\."(\w+)"\s*(?:=|<|>|<=|>=|IN\b|IS\b|BETWEEN\b)')
+LIKE_COLUMN_RE = re.compile(r'"(\w+)"\."(\w+)"\s+LIKE\s+\'%')
+ORDER_COLUMN_RE = re.compile(r'"(\w+)"\."(\w+)"(\s+DESC)?')
+
+
+class Finding:
+    def __init__(self, kind, table, detail, index=None, note=''):
+        self.kind = kind
+        self.table = table
+        self.detail = detail
+        # (model, fields) of a suggested index, or None
+        self.index = index
+        self.note = note
+
+    def suggestion(self):
+        if self.index:
+            return index_definition(*self.index)
+        return self.note
+
+
+def normalize(sql):
+    """Statement shape with literals replaced, so repeated queries are explained once."""
+    return NUMBER_RE.sub('?', STRING_LITERAL_RE.sub('?', sql))
+
+
+def explain(connection, sql):
+    """The plan of ``sql`` as a list of lines, or None if it cannot be explained here."""
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            depths = {0: -1}
+            lines = []
+            for node_id, parent, _, detail in cursor.fetchall():
+                depths[node_id] = depths.get(parent, -1) + 1
+                lines.append('  ' * depths[node_id] + detail)
+            return lines
+        if connection.vendor == 'postgresql':
+            cursor.execute(f'EXPLAIN {sql}')
+            return [row[0] for row in cursor.fetchall()]
+    return None
+
+
+def _model_for_table(table):
+    for model in apps.get_models():
+        if model._meta.db_table == table:
+            return model
+    return None
+
+
+def _field_name(model, column):
+    for field in model._meta.concrete_fields:
+        if field.column == column:
+            return field.name
+    return column
+
+
+def _clause(regex, sql):
+    match = regex.search(sql)
+    return match.group(1) if match else ''
+
+
+def _suggest(table, sql, order_columns=()):
+    """(model, fields) for an index serving the WHERE equality columns then the ORDER BY."""
+    model = _model_for_table(table)
+    if model is None:
+        return None
+    fields = []
+    for column_table, column in FILTER_COLUMN_RE.findall(_clause(WHERE_RE, sql)):
+        name = _field_name(model, column)
+        if column_table == table and name not in fields:
+            fields.append(name)
+    # An index can be read backwards, so a uniform direction needs no '-'
+    uniform = len({descending for _, descending in order_columns}) <= 1
+    for column, descending in order_columns:
+        name = _field_name(model, column)
+        if name not in fields:
+            fields.append(f'-{name}' if descending and not uniform else name)
+    return (model, fields) if fields else None
+
+
+def _order_columns(table, sql):
+    columns = ORDER_COLUMN_RE.findall(_clause(ORDER_BY_RE, sql))
+    if not columns or any(column_table != table for column_table, _, _ in columns):
+        return None
+    return [(column, bool(descending)) for _, column, descending in columns]
+
+
+def _scan_findings(table, sql, detail):
+    findings = []
+    like_columns = [column for column_table, column in LIKE_COLUMN_RE.findall(sql) if column_table == table]
+    if like_columns:
+        findings.append(Finding(
+            'like', table, detail,
+            note=f"LIKE '%...%' on {', '.join(sorted(set(like_columns)))} cannot use a B-tree index; "
+                 f"use a trigram (pg_trgm GIN) or full-text index, or a prefix search",
+        ))
+    index = _suggest(table, sql)
+    if index:
+        findings.append(Finding('scan', table, detail, index=index))
+    elif not like_columns:
+        findings.append(Finding('scan', table, detail,
+                                note='reads every row; filter, paginate or add a LIMIT if that is not intended'))
+    return findings
+
+
+def analyze(connection, sql, plan):
+    """Findings for one statement given its ``explain`` lines."""
+    findings = []
+    tables = re.findall(r'\bFROM "(\w+)"', sql)
+    # A scan in key order with a LIMIT and no filter stops after LIMIT rows
+    stops_early = (re.search(r'\bLIMIT\b', sql) and not WHERE_RE.search(sql)
+                   and not any(SQLITE_TEMP_RE.search(line) for line in plan))
+    for line in plan:
+        detail = line.strip()
+        if connection.vendor == 'sqlite':
+            scan = SQLITE_SCAN_RE.match(detail)
+            if scan and not scan.group('index') and not stops_early:
+                findings.extend(_scan_findings(scan.group(1), sql, detail))
+            temp = SQLITE_TEMP_RE.search(detail)
+            if temp:
+                findings.append(_sort_finding(tables, sql, detail, temp.group(1) != 'ORDER BY'))
+        elif connection.vendor == 'postgresql':
+            scan = re.search(r'Seq Scan on (\w+)', detail)
+            if scan:
+                findings.extend(_scan_findings(scan.group(1), sql, detail))
+            if re.search(r'->\s+(?:Incremental )?Sort\b|^Sort\b', detail):
+                findings.append(_sort_finding(tables, sql, detail, False))
+            elif re.search(r'HashAggregate|GroupAggregate', detail):
+                findings.append(_sort_finding(tables, sql, detail, True))
+    return findings
+
+
+def _sort_finding(tables, sql, detail, grouping):
+    table = tables[0] if tables else ''
+    if grouping:
+        return Finding('temp', table, detail,
+                       note='aggregation builds a temporary table; precompute it if this runs per request')
+    order_columns = _order_columns(table, sql)
+    index = _suggest(table, sql, order_columns) if order_columns else None
+    if index:
+        return Finding('temp', table, detail, index=index)
+    return Finding('temp', table, detail,
+                   note='sorts in a temporary B-tree; the ORDER BY spans tables or expressions no index covers')
+
+
+def existing_index(connection, model, fields):
+    """Name of an index on the model's table that already starts with ``fields``, or None."""
+    columns = [model._meta.get_field(field.lstrip('-')).column for field in fields]
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+    for name, constraint in constraints.items():
+        if constraint['index'] and constraint['columns'][:len(columns)] == columns:
+            return name
+    return None
+
+
+def index_definition(model, fields):
+    """Source of a ``models.Index`` for the model's Meta.indexes."""
+    stem = '_'.join(field.lstrip('-') for field in fields)
+    name = f'{model._meta.model_name}_{stem}'[:26].rstrip('_') + '_idx'
+    return f"{model.__name__}: models.Index(fields={fields!r}, name='{name}')"
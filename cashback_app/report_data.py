@@ -0,0 +1,106 @@
+"""
+Report figures computed from the columnar purchase store with numpy; see
+snapshots.py for how they are published.
+"""
+from datetime import date, timedelta
+
+import numpy as np
+from django.utils import timezone
+
+from . import analytics
+from .branches import scoped
+from .columnar import load, refresh_all
+from .models import Customer
+from .sharding import scatter, shard_aliases, shard_for_pk
+from .snapshots import DAILY_REPORT_DAYS
+
+EPOCH_DATE = date(1970, 1, 1)
+
+
+def _customer_names(customer_ids):
+    """Name and national code of the given customers, looked up on their shards."""
+    by_shard = {}
+    for customer_id in customer_ids:
+        by_shard.setdefault(shard_for_pk(customer_id), []).append(customer_id)
+    customers = {}
+    for alias, ids in by_shard.items():
+        if alias is not None:
+            customers.update(Customer.objects.using(alias).in_bulk(ids))
+    return customers
+
+
+def _shard_analytics(alias, since, utc_offset, branch_id=None):
+    """Per-shard aggregates; customer ids never repeat across shards, so they concatenate."""
+    columns = load(alias)
+    if branch_id is not None:
+        in_branch = columns['branch'] == branch_id
+        columns = {name: values[in_branch] for name, values in columns.items()}
+    customer_ids, _, spend = analytics.group_sum(columns['customer_id'], columns['amount'])
+    return {
+        'purchases': len(columns['id']),
+        'cashback': int(columns['cashback'].sum()),
+        'customer_ids': customer_ids,
+        'spend': spend,
+        'amounts': columns['amount'],
+        'daily': analytics.daily_totals(
+            columns['created_at'], (columns['amount'], columns['cashback']), since, utc_offset
+        ),
+    }
+
+
+def compute_report_data(branch_id=None, refresh=True):
+    """
+    Refresh the columnar purchase store and compute the reports from it, for
+    every branch or for the customers and purchases of one. Only the customer
+    count and the top customers' names come from the database.
+    """
+    if refresh:
+        refresh_all()
+    # Local calendar days, using the current offset of TIME_ZONE
+    utc_offset = int(timezone.localtime().utcoffset().total_seconds())
+    since = int((timezone.now() - timedelta(days=DAILY_REPORT_DAYS)).timestamp())
+    shards = [_shard_analytics(alias, since, utc_offset, branch_id) for alias in shard_aliases()]
+
+    total_customers = sum(scatter(lambda alias: scoped(Customer.objects.using(alias), branch_id).count()))
+    total_purchases = sum(shard['purchases'] for shard in shards)
+    total_cashback = sum(shard['cashback'] for shard in shards)
+    average_cashback = total_cashback / total_purchases if total_purchases > 0 else 0
+
+    spend = np.concatenate([shard['spend'] for shard in shards])
+    top_ids, top_totals = analytics.largest(np.concatenate([shard['customer_ids'] for shard in shards]), spend)
+    names = _customer_names(top_ids.tolist())
+    top_customers = [
+        {
+            'first_name': names[customer_id].first_name,
+            'last_name': names[customer_id].last_name,
+            'national_code': names[customer_id].national_code,
+            'total_purchase': int(total),
+        }
+        for customer_id, total in zip(top_ids.tolist(), top_totals.tolist())
+        if customer_id in names
+    ]
+
+    # Merge the shards' daily rows: (days, counts, amounts, cashbacks) each
+    days, counts, amounts, cashbacks = (np.concatenate(parts) for parts in zip(*(shard['daily'] for shard in shards)))
+    days, _, counts, amounts, cashbacks = analytics.group_sum(days, counts, amounts, cashbacks)
+    daily = [
+        {
+            'date': (EPOCH_DATE + timedelta(days=int(day))).isoformat(),
+            'purchases': int(count),
+            'amount': int(amount),
+            'cashback': int(cashback),
+        }
+        for day, count, amount, cashback in zip(days, counts, amounts, cashbacks)
+    ]
+
+    amounts = shards[0]['amounts'] if len(shards) == 1 else np.concatenate([shard['amounts'] for shard in shards])
+    return {
+        'total_customers': total_customers,
+        'total_purchases': total_purchases,
+        'total_cashback': total_cashback,
+        'average_cashback': float(average_cashback),
+        'top_customers': top_customers,
+        'daily_totals': daily,
+        'purchase_amount_percentiles': analytics.percentiles(amounts),
+        'customer_spend_percentiles': analytics.percentiles(spend),
+    }
@@ -0,0 +1,207 @@
+"""
+Recency/frequency/monetary (RFM) segmentation of customers for campaigns.
+
+``refresh_segments`` streams per-customer purchase aggregates (number of
+purchases, total amount, last purchase) from each shard with one GROUP BY
+over purchases and one over archived purchases, scores them into quintiles
+with numpy and upserts one CustomerSegment row per customer. Pages and
+exports then select a segment through its index instead of aggregating
+purchases per request.
+
+A full run scores every customer and stores the quintile edges in its
+SegmentationRun; run it nightly, since recency changes for everyone as days
+pass. Incremental runs, every few minutes or hourly, only re-score the
+customers with purchases since the previous run and those without a segment
+yet (new or merged customers) against the last full run's edges. A purchase
+a till synced late carries its earlier sale time, so customers whose row
+changed since the previous run (every purchase credits the wallet) are
+re-scored as well.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from . import analytics
+from .models import ArchivedPurchase, Customer, CustomerSegment, Purchase, SegmentationRun
+from .sharding import scatter, shard_aliases
+from .versioning import bump_version
+
+AGGREGATE_CHUNK_SIZE = 5000
+WRITE_BATCH_SIZE = 2000
+# Customer ids per IN (...) filter of an incremental run
+ID_CHUNK_SIZE = 500
+# Incremental runs also look this far before the previous run, at purchases
+# that were saved before it started but committed after it read them
+REFRESH_OVERLAP = timedelta(minutes=5)
+SCORE_FIELDS = [
+    'segment', 'recency_days', 'frequency', 'monetary', 'last_purchase_at', 'recency_score', 'frequency_score',
+    'monetary_score', 'computed_at',
+]
+# First matching rule wins; r, f and m are quintile scores, 5 is best
+SEGMENT_RULES = [
+    ('champions', lambda r, f, m: (r >= 4) & (f >= 4) & (m >= 4)),
+    ('loyal', lambda r, f, m: (r >= 3) & (f >= 4)),
+    ('high_value_lapsed', lambda r, f, m: (r <= 2) & ((m >= 4) | (f >= 4))),
+    ('new', lambda r, f, m: (r >= 4) & (f <= 1)),
+    ('promising', lambda r, f, m: r >= 4),
+    ('need_attention', lambda r, f, m: r == 3),
+    ('lost', lambda r, f, m: (r == 1) & (f <= 2) & (m <= 2)),
+]
+DEFAULT_SEGMENT = 'hibernating'
+
+
+def _id_chunks(customer_ids):
+    if customer_ids is None:
+        return [None]
+    customer_ids = sorted(customer_ids)
+    return [customer_ids[start:start + ID_CHUNK_SIZE] for start in range(0, len(customer_ids), ID_CHUNK_SIZE)]
+
+
+def purchase_aggregates(alias, customer_ids=None):
+    """
+    Purchases of a shard's customers (or of ``customer_ids`` only) summed per
+    customer, archived ones included: arrays (customer ids, counts, amounts,
+    last purchase as Unix time) in customer id order.
+    """
+    keys, counts, amounts, lasts = [], [], [], []
+    for model in (Purchase, ArchivedPurchase):
+        for chunk in _id_chunks(customer_ids):
+            rows = model.objects.using(alias).order_by()
+            if chunk is not None:
+                rows = rows.filter(customer_id__in=chunk)
+            rows = (rows.values('customer_id')
+                    .annotate(count=Count('pk'), amount=Sum('amount'), last=Max('created_at'))
+                    .values_list('customer_id', 'count', 'amount', 'last'))
+            for customer_id, count, amount, last in rows.iterator(chunk_size=AGGREGATE_CHUNK_SIZE):
+                keys.append(customer_id)
+                counts.append(count)
+                amounts.append(int(amount))
+                lasts.append(int(last.timestamp()))
+    keys = np.array(keys, dtype=np.int64)
+    # A customer with live and archived purchases has a row from each table
+    unique_keys, _, total_counts, total_amounts = analytics.group_sum(
+        keys, np.array(counts, dtype=np.int64), np.array(amounts, dtype=np.int64)
+    )
+    _, last_purchases = analytics.group_max(keys, np.array(lasts, dtype=np.int64))
+    return unique_keys, total_counts, total_amounts, last_purchases
+
+
+def _recency_days(last_purchases, now):
+    return np.maximum(int(now.timestamp()) - last_purchases, 0) // analytics.SECONDS_PER_DAY
+
+
+def score_edges(aggregates):
+    """Quintile edges of recency, frequency and monetary value over customers with purchases."""
+    keys, counts, amounts, lasts, now = aggregates
+    return {
+        'recency': analytics.quantile_edges(_recency_days(lasts, now)),
+        'frequency': analytics.quantile_edges(counts),
+        'monetary': analytics.quantile_edges(amounts),
+    }
+
+
+def score(recency_days, frequency, monetary, edges):
+    """Quintile scores and segment names of customers with purchases, as arrays (r, f, m, segments)."""
+    r = analytics.bin_scores(recency_days, edges['recency'], reverse=True)
+    f = analytics.bin_scores(frequency, edges['frequency'])
+    m = analytics.bin_scores(monetary, edges['monetary'])
+    segments = np.select([rule(r, f, m) for _, rule in SEGMENT_RULES], [name for name, _ in SEGMENT_RULES],
+                         default=DEFAULT_SEGMENT)
+    return r, f, m, segments
+
+
+def _segments(customer_ids, aggregates, edges, now):
+    """Unsaved CustomerSegment rows for ``customer_ids`` (a sorted array)."""
+    keys, counts, amounts, lasts = aggregates
+    positions = np.minimum(np.searchsorted(keys, customer_ids), max(len(keys) - 1, 0))
+    bought = (keys[positions] == customer_ids) if len(keys) else np.zeros(len(customer_ids), dtype=bool)
+    positions = positions[bought]
+    recency = _recency_days(lasts[positions], now)
+    r, f, m, names = score(recency, counts[positions], amounts[positions], edges)
+
+    rows = []
+    scored = iter(zip(recency.tolist(), counts[positions].tolist(), amounts[positions].tolist(),
+                      lasts[positions].tolist(), r.tolist(), f.tolist(), m.tolist(), names.tolist()))
+    for customer_id, has_purchases in zip(customer_ids.tolist(), bought.tolist()):
+        if not has_purchases:
+            rows.append(CustomerSegment(customer_id=customer_id, segment='no_purchases', computed_at=now))
+            continue
+        days, count, amount, last, r_score, f_score, m_score, name = next(scored)
+        rows.append(CustomerSegment(
+            customer_id=customer_id, segment=name, recency_days=days, frequency=count, monetary=amount,
+            last_purchase_at=datetime.fromtimestamp(last, tz=dt_timezone.utc),
+            recency_score=r_score, frequency_score=f_score, monetary_score=m_score, computed_at=now,
+        ))
+    return rows
+
+
+def _write(alias, customer_ids, aggregates, edges, now):
+    """Upsert the segments of ``customer_ids`` in batches; returns the number written."""
+    written = 0
+    customer_ids = np.array(sorted(customer_ids), dtype=np.int64)
+    for start in range(0, len(customer_ids), WRITE_BATCH_SIZE):
+        batch = customer_ids[start:start + WRITE_BATCH_SIZE]
+        # Customers deleted since they were listed would break the foreign key.
+        # Read before the transaction: SQLite refuses to turn a transaction's
+        # read lock into a write lock while another writer waits for it.
+        existing = np.array(sorted(Customer.objects.using(alias).filter(pk__in=batch.tolist())
+                                   .values_list('pk', flat=True)), dtype=np.int64)
+        with transaction.atomic(using=alias):
+            CustomerSegment.objects.using(alias).bulk_create(
+                _segments(existing, aggregates, edges, now),
+                update_conflicts=True, unique_fields=['customer'], update_fields=SCORE_FIELDS,
+            )
+            written += len(existing)
+    return written
+
+
+def _changed_customers(alias, since):
+    """Customers of a shard with purchases or changes since ``since``, or without a segment."""
+    changed = set(Purchase.objects.using(alias).filter(created_at__gte=since).order_by()
+                  .values_list('customer_id', flat=True).distinct())
+    changed.update(Customer.objects.using(alias).filter(Q(segment__isnull=True) | Q(updated_at__gte=since))
+                   .values_list('pk', flat=True))
+    return changed
+
+
+def refresh_segments(full=False, progress=None):
+    """
+    Recompute customer segments: all of them with ``full`` (or when no full
+    run finished yet), else those whose purchases changed since the last
+    run. Returns the finished SegmentationRun.
+    """
+    finished = SegmentationRun.objects.filter(finished_at__isnull=False)
+    last_full = finished.filter(full=True).first()
+    previous = finished.first()
+    full = full or last_full is None
+    run = SegmentationRun.objects.create(full=full)
+    now = run.started_at
+    aliases = shard_aliases()
+
+    if full:
+        shards = scatter(purchase_aggregates)
+        combined = [np.concatenate([shard[index] for shard in shards]) for index in range(4)]
+        edges = score_edges((*combined, now))
+        targets = [Customer.objects.using(alias).values_list('pk', flat=True) for alias in aliases]
+    else:
+        edges = last_full.edges
+        since = previous.started_at - REFRESH_OVERLAP
+        targets = [_changed_customers(alias, since) for alias in aliases]
+        shards = [purchase_aggregates(alias, customer_ids) for alias, customer_ids in zip(aliases, targets)]
+
+    written = 0
+    for index, (alias, customer_ids, aggregates) in enumerate(zip(aliases, targets, shards)):
+        written += _write(alias, customer_ids, aggregates, edges, now)
+        if progress:
+            progress((index + 1) * 100 / len(aliases), f"{written:,} مشتری بخش‌بندی شد")
+
+    run.edges = edges
+    run.customers = written
+    run.finished_at = timezone.now()
+    run.save(update_fields=['edges', 'customers', 'finished_at'])
+    bump_version('segments')
+    return run
+
@@ -0,0 +1,218 @@
+"""
+Hash-sharded storage for customers and their purchases.
+
+Each customer lives on one of ``settings.SHARD_DATABASES``, chosen by a stable
+hash of the national code; rows that belong to a customer (purchases, ...) live
+on the same database. Everything else (users, activity logs, jobs) stays on
+'default'. Primary keys on shard ``i`` start at ``i * SHARD_ID_SPAN``, so the
+shard of any customer id is known without asking every database.
+
+With a single shard (the default) every helper here degrades to plain
+'default' queries.
+"""
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+from django.http import Http404
+
+SHARD_ID_SPAN = 10 ** 12
+
+# Models stored next to their customer, parents before children
+SHARDED_MODELS = [
+    'customer', 'purchase', 'walletdebit', 'cashbacklot', 'notification', 'archivedpurchase', 'purchasesummary',
+    'changeevent', 'branchstats', 'customersegment',
+]
+
+_executor = None
+
+
+def shard_aliases():
+    return settings.SHARD_DATABASES
+
+
+def is_sharded():
+    return len(shard_aliases()) > 1
+
+
+def sharded_models():
+    return [apps.get_model('cashback_app', name) for name in SHARDED_MODELS]
+
+
+def customer_child_models():
+    """Sharded models whose rows belong to one customer through a ``customer`` foreign key."""
+    return [
+        model for model in sharded_models()
+        if any(field.name == 'customer' and field.is_relation for field in model._meta.concrete_fields)
+    ]
+
+
+def is_sharded_model(model):
+    # Accepts a model class or instance (including lazy request.user)
+    return model._meta.app_label == 'cashback_app' and model._meta.model_name in SHARDED_MODELS
+
+
+def shard_for_national_code(national_code):
+    """Database alias that owns the customer with this (normalized) national code."""
+    aliases = shard_aliases()
+    return aliases[zlib.crc32(str(national_code).encode('utf-8')) % len(aliases)]
+
+
+def shard_for_pk(pk):
+    """Database alias holding the row with this id, or None for an impossible id."""
+    aliases = shard_aliases()
+    index = int(pk) // SHARD_ID_SPAN
+    return aliases[index] if 0 <= index < len(aliases) else None
+
+
+def _shard_for_instance(instance):
+    if is_sharded_model(instance) and instance._state.db:
+        return instance._state.db
+    if is_sharded_model(instance) and instance._meta.model_name == 'customer':
+        return shard_for_national_code(instance.normalize_national_code(instance.national_code))
+    customer = instance._state.fields_cache.get('customer')
+    if customer is not None:
+        return _shard_for_instance(customer)
+    customer_id = getattr(instance, 'customer_id', None)
+    if customer_id is not None:
+        return shard_for_pk(customer_id)
+    return None
+
+
+class ShardRouter:
+    """Send sharded models to their customer's database and the rest to 'default'."""
+
+    def db_for_read(self, model, **hints):
+        if not is_sharded_model(model):
+            return 'default'
+        instance = hints.get('instance')
+        return _shard_for_instance(instance) if instance is not None else None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Sharded rows may point at users and be pointed at by activity logs
+        # across databases; two sharded rows must share a database.
+        if is_sharded_model(obj1) and is_sharded_model(obj2):
+            db1, db2 = obj1._state.db, obj2._state.db
+            return db1 is None or db2 is None or db1 == db2
+        return True
+
+
+def scatter(func):
+    """
+    Call ``func(alias)`` for every shard, in parallel when there is more than
+    one, and return the results in shard order.
+    """
+    global _executor
+    aliases = shard_aliases()
+    if len(aliases) == 1:
+        return [func(aliases[0])]
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=len(aliases), thread_name_prefix='shard')
+    return list(_executor.map(func, aliases))
+
+
+def get_customer_or_404(pk):
+    from .models import Customer
+    alias = shard_for_pk(pk)
+    if alias is None:
+        raise Http404
+    try:
+        return Customer.objects.using(alias).get(pk=pk)
+    except Customer.DoesNotExist:
+        raise Http404
+
+
+def customers_by_national_code(national_code):
+    """Queryset of customers with this normalized national code, on the right shard."""
+    from .models import Customer
+    return Customer.objects.using(shard_for_national_code(national_code)).filter(national_code=national_code)
+
+
+def seed_shard_sequences(sender, using, **kwargs):
+    """post_migrate: start each shard's id sequences at its own id range."""
+    aliases = shard_aliases()
+    if using not in aliases or aliases.index(using) == 0:
+        return
+    offset = aliases.index(using) * SHARD_ID_SPAN
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        for model in sharded_models():
+            table = model._meta.db_table
+            if connection.vendor == 'sqlite':
+                cursor.execute(
+                    "UPDATE sqlite_sequence SET seq = %s WHERE name = %s AND seq < %s",
+                    [offset, table, offset],
+                )
+                cursor.execute(
+                    "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                    "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                    [table, offset, table],
+                )
+            elif connection.vendor == 'postgresql':
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, 'id'), "
+                    f"GREATEST(%s, (SELECT COALESCE(MAX(id), 0) FROM {connection.ops.quote_name(table)})))",
+                    [table, offset],
+                )
+
+
+def _copy_row(obj, target, new_ids):
+    model = type(obj)
+    old_pk = obj.pk
+    for field in model._meta.concrete_fields:
+        if field.is_relation and is_sharded_model(field.related_model):
+            old_value = getattr(obj, field.attname)
+            if old_value is not None:
+                setattr(obj, field.attname, new_ids[(field.related_model, old_value)])
+    obj.pk = None
+    obj._state.adding = True
+    obj._state.fields_cache = {}
+    # raw=True keeps created_at/updated_at instead of re-stamping them
+    obj.save_base(raw=True, using=target, force_insert=True)
+    new_ids[(model, old_pk)] = obj.pk
+
+
+def move_customer(customer, target):
+    """
+    Move a customer and every row that belongs to it to another shard.
+    The customer gets a new id in the target shard's id range; activity logs
+    and tokens are repointed. Returns the moved customer.
+    """
+    from .branches import count_branches
+    from .models import ActivityLog, BranchStats, ChangeEvent, CustomerToken
+    from .versioning import bump_version_on_commit
+    source = customer._state.db or 'default'
+    if source == target:
+        return customer
+    children = customer_child_models()
+    old_pk = customer.pk
+    new_ids = {}
+
+    with transaction.atomic(using=source), transaction.atomic(using=target):
+        # The customer's share of the branch counters moves with its rows
+        for branch_id, counts in count_branches(source, customer_id=old_pk).items():
+            BranchStats.add(source, branch_id, **{name: -value for name, value in counts.items()})
+            BranchStats.add(target, branch_id, **counts)
+        _copy_row(customer, target, new_ids)
+        for model in children:
+            for row in model._base_manager.using(source).filter(customer_id=old_pk).order_by('pk'):
+                _copy_row(row, target, new_ids)
+        ActivityLog.objects.filter(customer_id=old_pk).update(customer_id=customer.pk)
+        CustomerToken.objects.filter(customer_id=old_pk).update(customer_id=customer.pk)
+        # Downstream systems remap the customer's rows with the old and new ids listed here
+        ChangeEvent.record(customer, 'move', using=target, old_id=old_pk, old_shard=source, ids={
+            model._meta.model_name: {old_id: new_id for (row_model, old_id), new_id in new_ids.items()
+                                     if row_model is model}
+            for model in children if model._meta.model_name in ChangeEvent.FIELDS
+        })
+        for model in reversed(children):
+            model._base_manager.using(source).filter(customer_id=old_pk)._raw_delete(source)
+        type(customer)._base_manager.using(source).filter(pk=old_pk)._raw_delete(source)
+        # The moved purchases have new ids on the target; both analytics stores rebuild
+        bump_version_on_commit(f'purchase_store:{source}', using=source)
+        bump_version_on_commit(f'purchase_store:{target}', using=target)
+    return customer
@@ -0,0 +1,111 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    ActivityLog, ArchivedPurchase, BranchStats, ChangeEvent, Customer, CustomerToken, LoginSession, Purchase, WalletDebit,
+)
+from .versioning import bump_version_on_commit
+
+
+@receiver(post_save, sender=Customer)
+@receiver(post_delete, sender=Customer)
+def customer_changed(sender, instance, using, **kwargs):
+    """
+    Invalidate cached fragments that show this customer or global totals.
+    Saves run inside a transaction, so the stamps move once it commits; a page
+    rendered in between would otherwise cache the old rows under the new stamp.
+    """
+    bump_version_on_commit('stats', using=using)
+    bump_version_on_commit(f'customer:{instance.pk}', using=using)
+
+
+@receiver(post_save, sender=Purchase)
+@receiver(post_delete, sender=Purchase)
+def purchase_changed(sender, instance, using, **kwargs):
+    """Invalidate the owning customer's purchase table and global totals, once the save commits."""
+    bump_version_on_commit('stats', using=using)
+    bump_version_on_commit(f'customer:{instance.customer_id}', using=using)
+
+
+@receiver(post_save, sender=Purchase)
+@receiver(post_delete, sender=Purchase)
+def purchase_store_changed(sender, instance, using, created=False, **kwargs):
+    """The analytics store only appends new purchases; edited and deleted ones make it rebuild (see columnar.py)."""
+    if not created:
+        bump_version_on_commit(f'purchase_store:{using}', using=using)
+
+
+@receiver(post_save, sender=CustomerToken)
+@receiver(post_delete, sender=CustomerToken)
+def customer_token_changed(sender, instance, signal, using, **kwargs):
+    """The customer page lists the customer's active cards."""
+    bump_version_on_commit(f'customer:{instance.customer_id}', using=using)
+    if signal is post_delete or not instance.is_active:
+        # Every process's scan cache drops what it cached before (see tokens.py)
+        bump_version_on_commit('customer_tokens', using=using)
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Purchase)
+@receiver(post_delete, sender=WalletDebit)
+def record_deletion(sender, instance, using, **kwargs):
+    """Deletes run their signals inside the delete's transaction, so the event commits with it."""
+    ChangeEvent.record(instance, 'delete', using=using)
+
+
+@receiver(post_delete, sender=Customer)
+@receiver(post_delete, sender=Purchase)
+@receiver(post_delete, sender=ArchivedPurchase)
+def update_branch_stats(sender, instance, using, **kwargs):
+    """Take deleted customers and purchases off their branch's counters, in the delete's transaction."""
+    if sender is Customer:
+        BranchStats.add(using, instance.branch_id, customers=-1)
+    else:
+        BranchStats.add(using, instance.branch_id, purchases=-1, cashback=-instance.cashback_amount)
+
+
+@receiver(post_delete, sender=Customer)
+def unlink_sharded_customer_logs(sender, instance, using, **kwargs):
+    """Activity logs and tokens stay on 'default', out of reach of a shard's cascades."""
+    if using != 'default':
+        ActivityLog.objects.filter(customer_id=instance.pk).update(customer=None)
+        CustomerToken.objects.filter(customer_id=instance.pk).delete()
+
+
+@receiver(user_logged_in)
+def record_login(sender, request, user, **kwargs):
+    """Log each login once and open a LoginSession for the new session key."""
+    ip_address = request.META.get('REMOTE_ADDR')
+    ActivityLog.log_activity(
+        user=user,
+        activity_type='user_login',
+        description=f"کاربر {user.username} وارد سیستم شد",
+        ip_address=ip_address,
+    )
+    if request.session.session_key:
+        now = timezone.now()
+        LoginSession.objects.update_or_create(
+            session_key=request.session.session_key,
+            defaults={'user': user, 'ip_address': ip_address, 'started_at': now, 'last_seen_at': now,
+                      'ended_at': None},
+        )
+
+
+@receiver(user_logged_out)
+def record_logout(sender, request, user, **kwargs):
+    """Log the logout and close the session's LoginSession."""
+    if user is None:
+        return
+    ActivityLog.log_activity(
+        user=user,
+        activity_type='user_logout',
+        description=f"کاربر {user.username} از سیستم خارج شد",
+        ip_address=request.META.get('REMOTE_ADDR'),
+    )
+    if request.session.session_key:
+        now = timezone.now()
+        LoginSession.objects.filter(session_key=request.session.session_key, ended_at=None).update(
+            ended_at=now, last_seen_at=now
+        )
@@ -0,0 +1,150 @@
+"""
+Precomputed report snapshots.
+
+A snapshot is a versioned directory under REPORT_SNAPSHOT_DIR holding the
+reports page data as JSON and the downloadable CSV, for all branches and for
+each branch on its own. ``manifest.json`` points at the latest version, so
+serving the reports page only reads files. The
+reports are computed by report_data.py, which needs numpy; it is imported
+when a snapshot is built, so web workers that only serve snapshots never
+load numpy.
+"""
+import csv
+import json
+import os
+import shutil
+from datetime import date, datetime
+from pathlib import Path
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Branch
+
+# Days covered by the daily totals of the reports
+DAILY_REPORT_DAYS = 30
+MANIFEST_NAME = 'manifest.json'
+DATA_NAME = 'report.json'
+CSV_NAME = 'report.csv'
+
+# (manifest mtime, snapshot) for the last snapshot loaded by this process
+_loaded = (None, None)
+
+
+def snapshot_dir():
+    path = Path(settings.REPORT_SNAPSHOT_DIR)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def branch_csv_name(branch_id):
+    return f'report-branch-{branch_id}.csv'
+
+
+def write_report_csv(data, path):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['گزارشات کلی'])
+        writer.writerow(['تعداد کل مشتریان', data['total_customers']])
+        writer.writerow(['تعداد کل خریدها', data['total_purchases']])
+        writer.writerow(['مجموع کشبک', data['total_cashback']])
+        writer.writerow(['میانگین کشبک', f"{data['average_cashback']:.2f}"])
+        writer.writerow([])
+        writer.writerow(['10 مشتری برتر بر اساس مبلغ خرید'])
+        writer.writerow(['نام مشتری', 'مبلغ کل خرید'])
+        for customer in data['top_customers']:
+            writer.writerow([f"{customer['first_name']} {customer['last_name']}", customer['total_purchase']])
+        writer.writerow([])
+        writer.writerow([f'خریدهای {DAILY_REPORT_DAYS} روز اخیر'])
+        writer.writerow(['تاریخ', 'تعداد خرید', 'مبلغ خرید', 'کشبک'])
+        for day in data['daily_totals']:
+            writer.writerow([day['date'], day['purchases'], day['amount'], day['cashback']])
+
+
+def build_snapshot(progress=None):
+    """Compute the reports once and publish them as the latest snapshot."""
+    generated_at = timezone.now()
+    version = generated_at.strftime('%Y%m%dT%H%M%S%f')
+    root = snapshot_dir()
+    target = root / version
+    target.mkdir()
+
+    from .report_data import compute_report_data
+
+    data = compute_report_data()
+    if progress:
+        progress(40, 'محاسبه گزارش شعبه‌ها')
+    # The store was refreshed for the totals above; each branch is a filter over it
+    data['branches'] = {
+        str(branch_id): compute_report_data(branch_id, refresh=False)
+        for branch_id in Branch.objects.values_list('pk', flat=True)
+    }
+    if progress:
+        progress(70, 'ذخیره فایل‌های گزارش')
+    data['generated_at'] = generated_at.isoformat()
+    with open(target / DATA_NAME, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    write_report_csv(data, target / CSV_NAME)
+    for branch_id, branch_data in data['branches'].items():
+        write_report_csv(branch_data, target / branch_csv_name(branch_id))
+
+    # Publish atomically so readers never see a half-written manifest
+    manifest = {'version': version, 'generated_at': data['generated_at']}
+    tmp_path = root / f'.{MANIFEST_NAME}.{os.getpid()}'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, root / MANIFEST_NAME)
+
+    prune_snapshots(keep=settings.REPORT_SNAPSHOT_KEEP)
+    return version
+
+
+def prune_snapshots(keep):
+    root = snapshot_dir()
+    versions = sorted(p for p in root.iterdir() if p.is_dir())
+    for path in versions[:-keep] if keep > 0 else []:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_latest():
+    """
+    Return the latest snapshot as a dict with its data, 'as_of' datetime and
+    'csv_path', or None if no snapshot has been built yet.
+    """
+    global _loaded
+    manifest_path = snapshot_dir() / MANIFEST_NAME
+    try:
+        mtime = manifest_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _loaded[0] == mtime:
+        return _loaded[1]
+
+    with open(manifest_path, encoding='utf-8') as f:
+        manifest = json.load(f)
+    version_dir = snapshot_dir() / manifest['version']
+    with open(version_dir / DATA_NAME, encoding='utf-8') as f:
+        snapshot = json.load(f)
+    snapshot['version'] = manifest['version']
+    snapshot['as_of'] = datetime.fromisoformat(snapshot['generated_at'])
+    snapshot['csv_path'] = version_dir / CSV_NAME
+    for branch_id, data in snapshot.setdefault('branches', {}).items():
+        data['csv_path'] = version_dir / branch_csv_name(branch_id)
+    for data in [snapshot, *snapshot['branches'].values()]:
+        for row in data.get('daily_totals', []):
+            row['date'] = date.fromisoformat(row['date'])
+    _loaded = (mtime, snapshot)
+    return snapshot
+
+
+def for_branch(snapshot, branch_id):
+    """
+    The snapshot as seen from one branch: that branch's figures and CSV, or
+    None if the snapshot predates the branch. None as branch_id means all.
+    """
+    if branch_id is None:
+        return snapshot
+    data = snapshot['branches'].get(str(branch_id))
+    if data is None:
+        return None
+    return {**data, 'version': snapshot['version'], 'as_of': snapshot['as_of']}
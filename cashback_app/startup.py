@@ -0,0 +1,108 @@
+"""
+Worker startup: warmup for preforking servers and memory readings.
+
+With gunicorn's ``preload_app`` (see gunicorn.conf.py) the master imports the
+application once and forks the workers from it. ``warmup`` also does the
+one-time work that would otherwise happen on each worker's first requests.
+It populates the URL resolver, compiles the templates into the cached
+template loader and loads the time zone and Jalali calendar data. Workers
+start ready to serve and share those pages with the master copy-on-write.
+
+``gc.freeze`` then moves everything allocated so far out of the garbage
+collector's reach. Otherwise the first collection in each worker would write
+to every shared object and copy its page.
+
+Heavy modules that only some requests need (numpy for building reports) are
+imported where they are used, not at startup; see report_data.py.
+"""
+import gc
+import logging
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def _template_names(directory):
+    directory = Path(directory)
+    return [str(path.relative_to(directory)) for path in sorted(directory.rglob('*.html'))]
+
+
+def warmup():
+    """Do the lazy one-time work of a worker now; returns a summary dict."""
+    import jdatetime
+    from django.db import connections
+    from django.template import engines
+    from django.template.utils import get_app_template_dirs
+    from django.urls import get_resolver
+    from django.utils import timezone
+
+    started = time.perf_counter()
+    get_resolver().reverse_dict
+
+    compiled = failed = 0
+    for engine in engines.all():
+        for directory in [*engine.engine.dirs, *get_app_template_dirs('templates')]:
+            for name in _template_names(directory):
+                try:
+                    engine.get_template(name)
+                    compiled += 1
+                except Exception:
+                    # Fragments of other templates may not compile alone
+                    failed += 1
+
+    jdatetime.date.fromgregorian(date=timezone.localdate(timezone.now()))
+
+    # Children must open their own connections, never reuse the master's sockets
+    connections.close_all()
+    gc.collect()
+    gc.freeze()
+    summary = {'templates': compiled, 'skipped_templates': failed,
+               'seconds': round(time.perf_counter() - started, 3)}
+    logger.info("Warmup done: %s", summary)
+    return summary
+
+
+def _status_fields(path, names):
+    values = dict.fromkeys(names, 0)
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in values:
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+def memory_kb(pid='self'):
+    """
+    Resident and private (not shared with any other process) memory in KiB,
+    from /proc; zeros where /proc is unavailable.
+    """
+    rollup = _status_fields(f'/proc/{pid}/smaps_rollup', ('Rss', 'Private_Clean', 'Private_Dirty'))
+    if rollup['Rss']:
+        return {'rss': rollup['Rss'], 'private': rollup['Private_Clean'] + rollup['Private_Dirty']}
+    status = _status_fields(f'/proc/{pid}/status', ('VmRSS',))
+    return {'rss': status['VmRSS'], 'private': status['VmRSS']}
+
+
+def first_response(application, path):
+    """Serve one GET of ``path`` through the WSGI application; returns (status, seconds)."""
+    from io import BytesIO
+    from wsgiref.util import setup_testing_defaults
+
+    environ = {'PATH_INFO': path, 'HTTP_HOST': 'localhost', 'SERVER_NAME': 'localhost',
+               'wsgi.input': BytesIO()}
+    setup_testing_defaults(environ)
+    status = []
+    started = time.perf_counter()
+    body = application(environ, lambda code, headers, exc_info=None: status.append(code))
+    try:
+        for _ in body:
+            pass
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return status[0], time.perf_counter() - started
@@ -0,0 +1,83 @@
+"""Background job handlers; see jobs.py for the queue itself."""
+import csv
+from datetime import timedelta
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from .branches import scoped
+from .importer import import_customers
+from .jobs import job_handler
+from .models import ActivityLog, Customer
+from .sharding import scatter, shard_aliases
+from .snapshots import build_snapshot
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+@job_handler('customer_export')
+def customer_export(context):
+    """Write all customers (or one branch's, or one segment's), shard by shard, to a CSV result file."""
+    fields = ('id', 'first_name', 'last_name', 'national_code', 'phone_number', 'created_at')
+    customers = scoped(Customer.objects, context.payload.get('branch_id'))
+    if context.payload.get('segment'):
+        customers = customers.filter(segment__segment=context.payload['segment'])
+    total = sum(scatter(lambda alias: customers.using(alias).count())) or 1
+
+    written = 0
+    with open(context.result_file_path('.csv'), 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ID', 'First Name', 'Last Name', 'National Code', 'Phone', 'Created At'])
+        for alias in shard_aliases():
+            rows = customers.using(alias).order_by('pk').values_list(*fields)
+            for customer in rows.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                writer.writerow(customer)
+                written += 1
+                if written % EXPORT_CHUNK_SIZE == 0:
+                    context.set_progress(written * 100 / total, f"{written:,} از {total:,} مشتری")
+
+
+@job_handler('report_snapshot')
+def report_snapshot(context):
+    """Rebuild the precomputed reports snapshot."""
+    context.set_progress(5, 'محاسبه گزارش‌ها')
+    build_snapshot(progress=context.set_progress)
+
+
+@job_handler('customer_segments')
+def customer_segments(context):
+    """Recompute the RFM customer segments (all of them with payload 'full')."""
+    # Imported here so the web workers, which load this module too, never import numpy
+    from .segments import refresh_segments
+    run = refresh_segments(full=context.payload.get('full', False), progress=context.set_progress)
+    context.set_progress(100, f"{run.customers:,} مشتری بخش‌بندی شد")
+
+
+@job_handler('cleanup_activity_logs')
+def cleanup_activity_logs(context):
+    """Delete old activity logs in batches so the table is never locked for long."""
+    months = context.payload.get('months', 6)
+    batch_size = context.payload.get('batch_size', 5000)
+    cutoff_date = timezone.now() - timedelta(days=months * 30)
+    old_logs = ActivityLog.objects.filter(created_at__lt=cutoff_date)
+    total = old_logs.count() or 1
+
+    deleted = 0
+    while True:
+        batch = list(old_logs.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not batch:
+            break
+        deleted += ActivityLog.objects.filter(pk__in=batch).delete()[0]
+        context.set_progress(deleted * 100 / total, f"{deleted:,} گزارش حذف شد")
+
+
+@job_handler('customer_import')
+def customer_import(context):
+    """Import an uploaded customer file; the rejected rows become the result file."""
+    path = Path(context.payload['path'])
+    user = User.objects.filter(pk=context.payload.get('user_id')).first()
+    result = import_customers(path, context.result_file_path('.csv'), created_by=user,
+                              progress=context.set_progress)
+    context.set_progress(100, str(result))
+    path.unlink(missing_ok=True)
@@ -1,7 +1,6 @@
 from django import template
 from django.utils import timezone
 import jdatetime
-import pytz
 
 register = template.Library()
 
@@ -9,10 +8,9 @@ register = template.Library()
 def persian_date(value):
     if value is None:
         return ''
-    # Convert to Tehran timezone if it's a timezone-aware datetime
+    # Aware datetimes are shown in TIME_ZONE (Asia/Tehran)
     if hasattr(value, 'tzinfo') and value.tzinfo is not None:
-        tehran_tz = pytz.timezone('Asia/Tehran')
-        value = value.astimezone(tehran_tz)
+        value = timezone.localtime(value)
     jalali_date = jdatetime.date.fromgregorian(date=value)
     return jalali_date.strftime('%Y/%m/%d')
 
@@ -20,9 +18,13 @@ def persian_date(value):
 def persian_datetime(value):
     if value is None:
         return ''
-    # Convert to Tehran timezone if it's a timezone-aware datetime
+    # Aware datetimes are shown in TIME_ZONE (Asia/Tehran)
     if hasattr(value, 'tzinfo') and value.tzinfo is not None:
-        tehran_tz = pytz.timezone('Asia/Tehran')
-        value = value.astimezone(tehran_tz)
+        value = timezone.localtime(value)
     jalali_date = jdatetime.datetime.fromgregorian(datetime=value)
-    return jalali_date.strftime('%Y/%m/%d %H:%M:%S')
\ No newline at end of file
+    return jalali_date.strftime('%Y/%m/%d %H:%M:%S')
+@register.filter
+def persian_month(value):
+    if value is None:
+        return ''
+    return jdatetime.date.fromgregorian(date=value).strftime('%Y/%m')
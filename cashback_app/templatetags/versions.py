@@ -0,0 +1,14 @@
+from django import template
+
+from cashback_app.versioning import get_version
+
+register = template.Library()
+
+
+@register.simple_tag
+def version_stamp(*parts):
+    """
+    Return the version stamp for a scope, for use as a {% cache %} key.
+    Usage: {% version_stamp 'customer' customer.pk as purchases_version %}
+    """
+    return get_version(':'.join(str(part) for part in parts))
@@ -0,0 +1,6 @@
+# Version stamps, fragments and cached sessions stay in memory, so test runs
+# neither see nor fill the installation's var/cache
+TEST_CACHES = {
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'test-{alias}'}
+    for alias in ('default', 'template_fragments', 'versions')
+}
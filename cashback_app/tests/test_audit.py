@@ -0,0 +1,49 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from cashback_app.audit import audit_range, repair_customer
+from cashback_app.models import Customer, Purchase
+from cashback_app.sharding import SHARD_ID_SPAN
+from cashback_app.tests import TEST_CACHES
+from cashback_app.versioning import get_version
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RepairCustomerTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('operator', password='pw')
+        self.customer = Customer.objects.create(
+            first_name='علی', last_name='رضایی', national_code='0012345678', phone_number='09120000001',
+            created_by=self.user,
+        )
+        Purchase.objects.create(customer=self.customer, amount=Decimal(200000), created_by=self.user)
+        self.alias = self.customer._state.db
+
+    def test_repair_restores_balance_and_invalidates_pages(self):
+        Customer.objects.using(self.alias).filter(pk=self.customer.pk).update(wallet_balance=Decimal(1))
+        stale_updated_at = Customer.objects.using(self.alias).get(pk=self.customer.pk).updated_at
+        customer_version = get_version(f'customer:{self.customer.pk}')
+        stats_version = get_version('stats')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            balance = repair_customer(self.alias, self.customer.pk)
+
+        repaired = Customer.objects.using(self.alias).get(pk=self.customer.pk)
+        self.assertEqual(balance, Decimal(10000))
+        self.assertEqual(repaired.wallet_balance, Decimal(10000))
+        self.assertGreater(repaired.updated_at, stale_updated_at)
+        self.assertNotEqual(get_version(f'customer:{self.customer.pk}'), customer_version)
+        self.assertNotEqual(get_version('stats'), stats_version)
+        checked, drifted, _, _ = audit_range(self.alias, 0, SHARD_ID_SPAN * 100)
+        self.assertEqual((checked, drifted), (1, 0))
+
+    def test_consistent_customer_is_left_alone(self):
+        customer_version = get_version(f'customer:{self.customer.pk}')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            repair_customer(self.alias, self.customer.pk)
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_version(f'customer:{self.customer.pk}'), customer_version)
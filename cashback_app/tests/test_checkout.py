@@ -0,0 +1,53 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from cashback_app.models import Customer, Purchase
+from cashback_app.tests import TEST_CACHES
+from cashback_app.tokens import issue_token, resolve_token
+
+
+@override_settings(CACHES=TEST_CACHES)
+class CheckoutTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('operator', password='pw')
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(
+            first_name='رضا', last_name='محمدی', national_code='0034567890', phone_number='09120000003',
+            created_by=self.user,
+        )
+        self.alias = self.customer._state.db
+        self.token = issue_token(self.customer).token
+
+    def purchases(self):
+        return Purchase.objects.using(self.alias).filter(customer_id=self.customer.pk)
+
+    def checkout(self, client_id):
+        return self.client.post(reverse('checkout'), {'token': self.token, 'amount': 100000, 'client_id': client_id})
+
+    def test_sale_redirects_to_the_receipt(self):
+        response = self.checkout('a1b2c3d4e5f6')
+        self.assertRedirects(response, f"{reverse('checkout')}?last={self.customer.pk}")
+        self.assertEqual(self.purchases().count(), 1)
+
+    def test_resubmitted_sale_is_recorded_once(self):
+        self.checkout('a1b2c3d4e5f6')
+        balance = Customer.objects.using(self.alias).get(pk=self.customer.pk).wallet_balance
+        response = self.checkout('a1b2c3d4e5f6')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.purchases().count(), 1)
+        self.assertEqual(Customer.objects.using(self.alias).get(pk=self.customer.pk).wallet_balance, balance)
+        self.assertGreater(balance, Decimal(0))
+
+    def test_revoked_card_stops_resolving_after_it_was_cached(self):
+        self.assertEqual(resolve_token(self.token).pk, self.customer.pk)
+        # Revoked the way another process would, without touching this process's cache
+        token = self.customer.tokens.get(token=self.token)
+        token.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            token.save(update_fields=['is_active'])
+        self.assertIsNone(resolve_token(self.token))
@@ -0,0 +1,107 @@
+import tempfile
+import unittest
+from contextlib import ExitStack, contextmanager
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+
+from cashback_app import columnar
+from cashback_app.dedup import merge_customers
+from cashback_app.models import Customer, Purchase
+from cashback_app.sharding import is_sharded, move_customer, shard_aliases
+from cashback_app.tests import TEST_CACHES
+
+
+@override_settings(CACHES=TEST_CACHES)
+class PurchaseStoreTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        store_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(store_dir.cleanup)
+        settings_override = override_settings(PURCHASE_STORE_DIR=store_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user('operator', password='pw')
+
+    def create_customer(self, national_code, *amounts):
+        customer = Customer.objects.create(
+            first_name='رضا', last_name=national_code, national_code=national_code,
+            phone_number=f'0912{national_code[-7:]}', created_by=self.user,
+        )
+        for amount in amounts:
+            Purchase.objects.create(customer=customer, amount=Decimal(amount), created_by=self.user)
+        return customer
+
+    @contextmanager
+    def committing(self):
+        """Run the on-commit callbacks of every shard, as a real commit would."""
+        with ExitStack() as stack:
+            for alias in shard_aliases():
+                stack.enter_context(self.captureOnCommitCallbacks(using=alias, execute=True))
+            yield
+
+    def database_spend(self):
+        spend = {}
+        for alias in shard_aliases():
+            for customer_id, amount in Purchase.objects.using(alias).values_list('customer_id', 'amount'):
+                spend[customer_id] = spend.get(customer_id, 0) + int(amount)
+        return spend
+
+    def store_spend(self):
+        spend = {}
+        for alias in shard_aliases():
+            # One by one: refresh_all's shard threads have their own connections, outside the test's transaction
+            columnar.refresh(alias)
+            columns = columnar.load(alias)
+            for customer_id, amount in zip(columns['customer_id'].tolist(), columns['amount'].tolist()):
+                spend[customer_id] = spend.get(customer_id, 0) + amount
+        return spend
+
+    def test_new_purchases_are_appended(self):
+        customer = self.create_customer('0034567890', 100000)
+        self.assertEqual(self.store_spend(), {customer.pk: 100000})
+        Purchase.objects.create(customer=customer, amount=Decimal(50000), created_by=self.user)
+        self.assertEqual(self.store_spend(), {customer.pk: 150000})
+
+    def test_merge_rebuilds_the_store(self):
+        keep = self.create_customer('0034567890', 100000, 20000)
+        duplicate = self.create_customer('0034567891', 70000)
+        self.store_spend()
+
+        with self.committing():
+            merge_customers(keep, [duplicate])
+
+        self.assertEqual(self.database_spend(), {keep.pk: 190000})
+        self.assertEqual(self.store_spend(), self.database_spend())
+
+    def test_deleted_purchase_leaves_the_store(self):
+        customer = self.create_customer('0034567890', 100000, 20000)
+        self.store_spend()
+        with self.committing():
+            Purchase.objects.using(customer._state.db).filter(amount=20000).delete()
+        self.assertEqual(self.store_spend(), {customer.pk: 100000})
+
+    @unittest.skipUnless(is_sharded(), 'needs CASHBACK_SHARDS > 1')
+    def test_move_does_not_count_purchases_twice(self):
+        customer = self.create_customer('0034567890', 100000, 20000)
+        self.create_customer('0045678901', 30000)
+        self.store_spend()
+        target = next(alias for alias in shard_aliases() if alias != customer._state.db)
+
+        with self.committing():
+            moved = move_customer(customer, target)
+
+        self.assertEqual(Purchase.objects.using(target).filter(customer_id=moved.pk).count(), 2)
+        self.assertEqual(self.store_spend(), self.database_spend())
+        self.assertEqual(sum(len(columnar.load(alias)['id']) for alias in shard_aliases()), 3)
+
+    def test_culled_cache_does_not_rebuild_the_store(self):
+        customer = self.create_customer('0034567890', 100000)
+        self.store_spend()
+        # Customer stamps, sessions and live totals fill the default cache until it culls
+        caches['default'].clear()
+        self.assertEqual([columnar.refresh(alias) for alias in shard_aliases()], [0] * len(shard_aliases()))
+        self.assertEqual(self.store_spend(), {customer.pk: 100000})
@@ -0,0 +1,41 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from cashback_app.models import CashbackLot, Customer, Purchase
+from cashback_app.tests import TEST_CACHES
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ExpireCashbackTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        user = User.objects.create_user('operator', password='pw')
+        self.customer = Customer.objects.create(
+            first_name='زهرا', last_name='نوری', national_code='0045678901', phone_number='09120000004',
+            created_by=user,
+        )
+        self.alias = self.customer._state.db
+        for amount in (200000, 100000):
+            Purchase.objects.create(customer=self.customer, amount=Decimal(amount), created_by=user)
+        self.lots = CashbackLot.objects.using(self.alias).filter(customer_id=self.customer.pk)
+
+    def test_wallet_loses_what_the_lots_record_as_expired(self):
+        expired, kept = self.lots.order_by('pk')
+        CashbackLot.objects.using(self.alias).filter(pk=expired.pk).update(
+            remaining=Decimal(4000), expires_at=timezone.now() - timedelta(days=1),
+        )
+        call_command('expire_cashback', stdout=StringIO())
+
+        expired.refresh_from_db()
+        self.assertEqual((expired.remaining, expired.expired_amount), (Decimal(0), Decimal(4000)))
+        kept.refresh_from_db()
+        self.assertEqual(kept.remaining, Decimal(5000))
+        balance = Customer.objects.using(self.alias).get(pk=self.customer.pk).wallet_balance
+        self.assertEqual(balance, Decimal(15000) - Decimal(4000))
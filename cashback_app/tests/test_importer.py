@@ -0,0 +1,73 @@
+import csv
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from cashback_app.importer import import_customers
+from cashback_app.models import Branch, BranchStats, Customer, UserProfile
+from cashback_app.sharding import shard_aliases
+from cashback_app.tests import TEST_CACHES
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ImportCustomersTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        self.user = User.objects.create_user('operator', password='pw')
+        branch = Branch.objects.create(name='مرکزی', code='central')
+        UserProfile.objects.update_or_create(user=self.user, defaults={'branch': branch})
+
+    def run_import(self, rows):
+        path = self.directory / 'customers.csv'
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['نام', 'نام خانوادگی', 'کد ملی', 'شماره موبایل'])
+            writer.writerows(rows)
+        error_path = self.directory / 'customers.errors.csv'
+        result = import_customers(path, error_path, created_by=self.user)
+        with open(error_path, encoding='utf-8-sig') as f:
+            return result, list(csv.reader(f))[1:]
+
+    def counted_customers(self):
+        # Customers imported into the operator's branch, by its counters
+        return sum(stats.customers for alias in shard_aliases() for stats in BranchStats.objects.using(alias).all())
+
+    def test_existing_codes_are_rejected(self):
+        Customer.objects.create(first_name='سارا', last_name='کریمی', national_code='0056789012',
+                                phone_number='09120000005')
+        result, errors = self.run_import([
+            ['سارا', 'کریمی', '0056789012', '09120000005'],
+            ['نادر', 'صادقی', '0067890123', '09120000006'],
+        ])
+        self.assertEqual((result.created, result.rejected), (1, 1))
+        self.assertEqual([row[3] for row in errors], ['0056789012'])
+
+    def test_code_saved_during_the_import_is_reported_as_duplicate(self):
+        atomic = transaction.atomic
+        raced = []
+
+        def racing_atomic(*args, **kwargs):
+            # An operator registers the first customer between the check and the insert
+            if not raced:
+                raced.append(True)
+                Customer.objects.create(first_name='سارا', last_name='کریمی', national_code='0056789012',
+                                        phone_number='09120000005')
+            return atomic(*args, **kwargs)
+
+        with mock.patch('cashback_app.importer.transaction.atomic', racing_atomic):
+            result, errors = self.run_import([
+                ['سارا', 'کریمی', '0056789012', '09120000005'],
+                ['نادر', 'صادقی', '0067890123', '09120000006'],
+            ])
+
+        self.assertEqual((result.created, result.rejected), (1, 1))
+        self.assertEqual([row[3] for row in errors], ['0056789012'])
+        self.assertEqual(self.counted_customers(), 1)
@@ -0,0 +1,37 @@
+import threading
+from unittest import mock
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from cashback_app import live
+
+
+def broker_events(last_event_id, branch_id):
+    yield b': connected\n\n'
+    yield b': heartbeat\n\n'
+
+
+class StreamLimitTests(SimpleTestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.object(live, 'stream_slots', threading.BoundedSemaphore(1)),
+            # Stands in for the broker, which polls the database
+            mock.patch.object(live, '_stream', broker_events),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_stream_over_the_limit_is_asked_to_retry_later(self):
+        first = live.stream()
+        self.assertEqual(next(first), b': connected\n\n')
+        busy = list(live.stream())
+        self.assertEqual(busy, [f'retry: {settings.LIVE_BUSY_RETRY_MS}\n\n'.encode('utf-8')])
+
+    def test_slot_is_freed_when_a_stream_ends(self):
+        first = live.stream()
+        next(first)
+        # The client went away; the server closes the response's iterator
+        first.close()
+        self.assertEqual(next(live.stream()), b': connected\n\n')
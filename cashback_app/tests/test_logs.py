@@ -0,0 +1,38 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from cashback_app.models import ActivityLog, Branch, UserProfile
+from cashback_app.tests import TEST_CACHES
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ActivityLogPageTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.branch = Branch.objects.create(name='مرکزی', code='central')
+        self.other = Branch.objects.create(name='شعبه دو', code='second')
+
+    def login(self, user_type, branch=None):
+        user = User.objects.create_user(f'{user_type}-{branch and branch.code}', password='pw')
+        UserProfile.objects.update_or_create(user=user, defaults={'user_type': user_type, 'branch': branch})
+        self.client.force_login(user)
+        return user
+
+    def test_admin_sees_the_branch_logs(self):
+        admin = self.login('admin', self.branch)
+        ActivityLog.objects.create(user=admin, activity_type='customer_create', description='ثبت در مرکزی')
+        operator = User.objects.create_user('operator', password='pw')
+        UserProfile.objects.update_or_create(user=operator, defaults={'branch': self.other})
+        ActivityLog.objects.create(user=operator, activity_type='customer_create', description='ثبت در شعبه دو')
+
+        response = self.client.get(reverse('activity_logs'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'ثبت در مرکزی')
+        self.assertNotContains(response, 'ثبت در شعبه دو')
+
+    def test_operator_is_sent_to_login(self):
+        self.login('operator', self.branch)
+        response = self.client.get(reverse('activity_logs'))
+        self.assertEqual(response.status_code, 302)
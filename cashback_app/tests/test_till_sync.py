@@ -0,0 +1,84 @@
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from cashback_app.models import CashbackLot, Customer, Purchase
+from cashback_app.tests import TEST_CACHES
+from cashback_app.till_sync import apply_batch
+
+
+def millis(moment):
+    return int(moment.timestamp() * 1000)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TillSyncTests(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('operator', password='pw')
+        self.customer = Customer.objects.create(
+            first_name='علی', last_name='رضایی', national_code='0012345678', phone_number='09120000001',
+            created_by=self.user,
+        )
+        self.alias = self.customer._state.db
+
+    def item(self, client_id, amount=200000, **extra):
+        return {'client_id': client_id, 'customer': self.customer.pk, 'amount': amount,
+                'queued_at': millis(timezone.now()), **extra}
+
+    def balance(self):
+        return Customer.objects.using(self.alias).get(pk=self.customer.pk).wallet_balance
+
+    def purchases(self):
+        return Purchase.objects.using(self.alias).filter(customer_id=self.customer.pk)
+
+    def test_batch_sent_again_is_recorded_once(self):
+        batch = [self.item('till-1-0001'), self.item('till-1-0002', amount=100000)]
+        first = apply_batch(self.user, batch)
+        self.assertEqual([result['status'] for result in first], ['created', 'created'])
+        again = apply_batch(self.user, batch)
+        self.assertEqual([result['status'] for result in again], ['duplicate', 'duplicate'])
+        self.assertEqual([result['purchase_id'] for result in again], [result['purchase_id'] for result in first])
+        self.assertEqual(self.purchases().count(), 2)
+        self.assertEqual(self.balance(), Decimal(15000))
+
+    def test_item_repeated_within_a_batch_is_recorded_once(self):
+        results = apply_batch(self.user, [self.item('till-1-0001'), self.item('till-1-0001')])
+        self.assertEqual([result['status'] for result in results], ['created', 'duplicate'])
+        self.assertEqual(results[0]['purchase_id'], results[1]['purchase_id'])
+        self.assertEqual(self.balance(), Decimal(10000))
+
+    def test_sale_time_becomes_the_purchase_time(self):
+        sold_at = (timezone.now() - timedelta(days=2)).replace(microsecond=0)
+        apply_batch(self.user, [self.item('till-1-0001', queued_at=millis(sold_at))])
+        purchase = self.purchases().get()
+        self.assertEqual(purchase.created_at, sold_at)
+        lot = CashbackLot.objects.using(self.alias).get(purchase_id=purchase.pk)
+        self.assertEqual(lot.created_at, sold_at)
+        self.assertEqual(lot.expires_at, CashbackLot.expiry_for(sold_at))
+
+    @override_settings(PURCHASE_SYNC_MAX_AGE_DAYS=7)
+    def test_sale_time_in_the_future_or_too_old_is_invalid(self):
+        now = timezone.now()
+        results = apply_batch(self.user, [
+            self.item('till-1-0001', queued_at=millis(now + timedelta(hours=1))),
+            self.item('till-1-0002', queued_at=millis(now - timedelta(days=8))),
+            self.item('till-1-0003', queued_at='yesterday'),
+            # A till clock a little ahead of the server's
+            self.item('till-1-0004', queued_at=millis(now + timedelta(seconds=30))),
+        ])
+        self.assertEqual([result['status'] for result in results], ['invalid', 'invalid', 'invalid', 'created'])
+        self.assertLessEqual(self.purchases().get().created_at, timezone.now())
+
+    def test_sync_view_answers_each_purchase(self):
+        self.client.force_login(self.user)
+        body = json.dumps({'purchases': [self.item('till-1-0001'), {'client_id': 'x'}]})
+        response = self.client.post(reverse('purchase_sync'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.json()['results']], ['created', 'invalid'])
@@ -0,0 +1,108 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from cashback_app.models import ActivityLog, Customer, Purchase, WalletDebit
+from cashback_app.tests import TEST_CACHES
+from cashback_app.versioning import get_version
+
+
+@override_settings(CACHES=TEST_CACHES)
+class WalletTestCase(TestCase):
+    databases = '__all__'
+
+    def setUp(self):
+        self.user = User.objects.create_user('operator', password='pw')
+        self.client.force_login(self.user)
+        self.customer = Customer.objects.create(
+            first_name='مریم', last_name='احمدی', national_code='0023456789', phone_number='09120000002',
+            created_by=self.user,
+        )
+        self.alias = self.customer._state.db
+
+    def balance(self):
+        return Customer.objects.using(self.alias).get(pk=self.customer.pk).wallet_balance
+
+    def set_balance(self, amount):
+        Customer.objects.using(self.alias).filter(pk=self.customer.pk).update(wallet_balance=amount)
+        self.customer.wallet_balance = amount
+
+
+class WalletReductionTests(WalletTestCase):
+    def reduce(self, amount, customer=None):
+        # ``customer`` stands in for the copy the view read before another till changed the wallet
+        with mock.patch('cashback_app.views.get_customer_or_404', return_value=customer or self.customer):
+            return self.client.post(reverse('wallet_reduction', kwargs={'pk': self.customer.pk}),
+                                    {'amount': amount, 'reason': 'خرید حضوری'})
+
+    def test_reduction_records_debit_and_log(self):
+        self.set_balance(Decimal(10000))
+        response = self.reduce(4000)
+        self.assertRedirects(response, reverse('customer_detail', kwargs={'pk': self.customer.pk}),
+                             fetch_redirect_response=False)
+        self.assertEqual(self.balance(), Decimal(6000))
+        debit = WalletDebit.objects.using(self.alias).get(customer_id=self.customer.pk)
+        self.assertEqual(debit.amount, Decimal(4000))
+        self.assertTrue(ActivityLog.objects.filter(pk=debit.activity_log_id, activity_type='wallet_reduction').exists())
+
+    def test_concurrent_change_is_not_overwritten(self):
+        stale = Customer.objects.using(self.alias).get(pk=self.customer.pk)
+        stale.wallet_balance = Decimal(10000)
+        self.set_balance(Decimal(3000))
+        self.reduce(2000, customer=stale)
+        self.assertEqual(self.balance(), Decimal(1000))
+
+    def test_reduction_above_current_balance_is_refused(self):
+        stale = Customer.objects.using(self.alias).get(pk=self.customer.pk)
+        stale.wallet_balance = Decimal(10000)
+        self.set_balance(Decimal(3000))
+        response = self.reduce(8000, customer=stale)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['form'].errors['amount'])
+        self.assertEqual(self.balance(), Decimal(3000))
+        self.assertFalse(WalletDebit.objects.using(self.alias).exists())
+        self.assertFalse(ActivityLog.objects.filter(activity_type='wallet_reduction').exists())
+
+    def test_failed_debit_leaves_no_activity_log(self):
+        self.set_balance(Decimal(10000))
+        with mock.patch('cashback_app.views.Notification.wallet_debit', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError), self.assertLogs('django.request', 'ERROR'):
+                self.reduce(4000)
+        self.assertEqual(self.balance(), Decimal(10000))
+        self.assertFalse(ActivityLog.objects.filter(activity_type='wallet_reduction').exists())
+
+
+class PurchaseCreditTests(WalletTestCase):
+    def test_new_purchase_credits_its_cashback(self):
+        self.set_balance(Decimal(1000))
+        purchase = Purchase.objects.create(customer=self.customer, amount=Decimal(200000), created_by=self.user)
+        self.assertEqual(purchase.cashback_amount, Decimal(10000))
+        self.assertEqual(self.balance(), Decimal(11000))
+        # The notification quotes the balance after the credit
+        self.assertEqual(self.customer.wallet_balance, Decimal(11000))
+
+    def test_concurrent_change_is_not_overwritten(self):
+        stale = Customer.objects.using(self.alias).get(pk=self.customer.pk)
+        # Another till debits the wallet after this one read the customer
+        self.set_balance(Decimal(5000))
+        Purchase.objects.create(customer=stale, amount=Decimal(200000), created_by=self.user)
+        self.assertEqual(self.balance(), Decimal(15000))
+
+    def test_editing_a_purchase_does_not_credit_again(self):
+        purchase = Purchase.objects.create(customer=self.customer, amount=Decimal(200000), created_by=self.user)
+        purchase.amount = Decimal(250000)
+        purchase.save()
+        self.assertEqual(self.balance(), Decimal(10000))
+
+    def test_versions_move_once_the_purchase_commits(self):
+        before = get_version(f'customer:{self.customer.pk}')
+        with self.captureOnCommitCallbacks(using=self.alias) as callbacks:
+            Purchase.objects.create(customer=self.customer, amount=Decimal(200000), created_by=self.user)
+            # A page rendered before the commit must not cache the old rows under a new stamp
+            self.assertEqual(get_version(f'customer:{self.customer.pk}'), before)
+        for callback in callbacks:
+            callback()
+        self.assertNotEqual(get_version(f'customer:{self.customer.pk}'), before)
@@ -0,0 +1,162 @@
+"""
+Batched sync of purchases that tills queued while offline.
+
+The purchase form queues each sale in the browser's IndexedDB (see
+static/js/till_queue.js) under a random client id, and the till's service
+worker posts the queue to ``purchase_sync`` in batches whenever the link is
+up. ``apply_batch`` validates every item like the purchase form does and
+records the valid ones in one transaction per database, all opened before
+the first purchase and committed one after another once the batch is done.
+A database error while recording rolls every shard back and the till sends
+the batch again. There is no two-phase commit, though: if committing one
+shard fails after another already committed, the committed purchases stay,
+and the till's next attempt gets them back as 'duplicate'.
+
+Each item also carries ``queued_at``, when the till queued the sale, in
+milliseconds since the epoch. It becomes the purchase's ``created_at``, so
+daily reports and the expiry of its cashback count from the sale, not from
+the sync. A time more than CLOCK_SKEW ahead of the server's clock or older
+than PURCHASE_SYNC_MAX_AGE_DAYS makes the item invalid; a till clock that is
+slightly ahead is taken as now.
+
+Sending a batch again is safe. Purchases remember their client id under a
+unique index, so an item that was already recorded (the response got lost,
+or two tabs synced at once) is answered with the existing purchase instead
+of being recorded twice.
+"""
+import re
+from contextlib import ExitStack
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .forms import PurchaseForm
+from .models import ActivityLog, Customer, Purchase
+from .sharding import shard_for_pk
+
+CLIENT_ID_RE = re.compile(r'[A-Za-z0-9-]{8,64}')
+# How far a till's clock may run ahead of the server's
+CLOCK_SKEW = timedelta(minutes=5)
+
+
+def _result(client_id, status, purchase=None, errors=None):
+    result = {'client_id': client_id, 'status': status}
+    if purchase is not None:
+        result.update({
+            'purchase_id': purchase.pk,
+            'customer': purchase.customer_id,
+            'cashback_amount': int(purchase.cashback_amount),
+        })
+    if errors:
+        result['errors'] = errors
+    return result
+
+
+def _sale_time(queued_at, now):
+    """The sale time of a ``queued_at`` timestamp, or None if it is not acceptable."""
+    if queued_at is None:
+        # Queued by a till that did not send the time yet
+        return now
+    if isinstance(queued_at, bool) or not isinstance(queued_at, (int, float)):
+        return None
+    try:
+        sold_at = datetime.fromtimestamp(queued_at / 1000, tz=dt_timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        return None
+    if sold_at > now + CLOCK_SKEW or sold_at < now - timedelta(days=settings.PURCHASE_SYNC_MAX_AGE_DAYS):
+        return None
+    return min(sold_at, now)
+
+
+def _validate(item, now):
+    """(client id, unsaved purchase or None, errors) for one queued item."""
+    if not isinstance(item, dict):
+        return '', None, ['قالب خرید نامعتبر است']
+    client_id = str(item.get('client_id') or '')
+    if not CLIENT_ID_RE.fullmatch(client_id):
+        return client_id, None, ['شناسه صندوق نامعتبر است']
+    sold_at = _sale_time(item.get('queued_at'), now)
+    if sold_at is None:
+        return client_id, None, ['زمان ثبت خرید در صندوق نامعتبر یا بیش از حد قدیمی است']
+    form = PurchaseForm({'customer': item.get('customer'), 'amount': item.get('amount')})
+    if not form.is_valid():
+        return client_id, None, [error for errors in form.errors.values() for error in errors]
+    if form.cleaned_data['amount'] <= 0:
+        return client_id, None, ['مبلغ خرید باید بیشتر از صفر باشد']
+    purchase = form.save(commit=False)
+    purchase.created_at = sold_at
+    return client_id, purchase, []
+
+
+def apply_batch(user, items, ip_address=None):
+    """
+    Record the valid purchases of ``items`` ([{'client_id', 'customer',
+    'amount', 'queued_at'}]) as ``user``. Returns one result per item, in order, with
+    status 'created', 'duplicate' (recorded by an earlier sync) or
+    'invalid' (with the form's errors; the till should not send it again).
+    """
+    results = [None] * len(items)
+    by_alias = {}
+    seen = {}
+    now = timezone.now()
+    for index, item in enumerate(items):
+        client_id, purchase, errors = _validate(item, now)
+        if purchase is None:
+            results[index] = _result(client_id, 'invalid', errors=errors)
+        elif client_id in seen:
+            # Sent twice in one batch; answered with the first one's purchase below
+            seen[client_id].append(index)
+        else:
+            seen[client_id] = [index]
+            by_alias.setdefault(shard_for_pk(purchase.customer_id), []).append((client_id, purchase))
+
+    recorded = {}
+    with ExitStack() as stack:
+        stack.enter_context(transaction.atomic())
+        for alias in by_alias:
+            stack.enter_context(transaction.atomic(using=alias))
+        for alias, batch in by_alias.items():
+            recorded.update(_apply_shard(user, alias, batch, ip_address))
+
+    for client_id, indexes in seen.items():
+        status, purchase = recorded[client_id]
+        results[indexes[0]] = _result(client_id, status, purchase)
+        for index in indexes[1:]:
+            results[index] = _result(client_id, 'duplicate', purchase)
+    return results
+
+
+def _apply_shard(user, alias, batch, ip_address):
+    """Record one shard's share of a batch; returns {client_id: (status, purchase)}."""
+    existing = Purchase.objects.using(alias).filter(client_id__in=[client_id for client_id, _ in batch])
+    recorded = {purchase.client_id: ('duplicate', purchase) for purchase in existing}
+    # One fresh copy per customer, locked where the database can, so every
+    # sale of the batch adds to the balance the previous one left
+    customers = Customer.objects.using(alias).select_for_update().in_bulk(
+        {purchase.customer_id for _, purchase in batch}
+    )
+    for client_id, purchase in batch:
+        if client_id in recorded:
+            continue
+        purchase.customer = customers[purchase.customer_id]
+        purchase.client_id = client_id
+        purchase.created_by = user
+        try:
+            with transaction.atomic(using=alias):
+                purchase.save()
+        except IntegrityError:
+            # Recorded by a sync that committed after our lookup
+            recorded[client_id] = ('duplicate', Purchase.objects.using(alias).get(client_id=client_id))
+            purchase.customer.refresh_from_db(fields=['wallet_balance'])
+            continue
+        ActivityLog.objects.create(
+            user=user,
+            activity_type='purchase_create',
+            description=f"خرید جدید از صف آفلاین صندوق ثبت شد برای مشتری: {purchase.customer.first_name} "
+                        f"{purchase.customer.last_name} به مبلغ {int(purchase.amount):,} ریال",
+            ip_address=ip_address,
+        )
+        recorded[client_id] = ('created', purchase)
+    return recorded
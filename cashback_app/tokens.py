@@ -0,0 +1,128 @@
+"""
+Customer lookup by scanned loyalty card or QR token.
+
+Tokens live in the unique-indexed ``CustomerToken`` table on 'default'. Each
+process keeps a small LRU of recently scanned token -> customer id mappings,
+so repeat scans go straight to a primary-key lookup on the customer's shard.
+Each entry remembers the ``customer_tokens`` version stamp it was cached
+under; deactivating or deleting any token bumps the stamp (see signals.py),
+so a revoked card stops working in every process on its next scan. Entries
+also expire after TOKEN_CACHE_TTL seconds.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+from .models import DIGIT_TRANSLATION, Customer, CustomerToken
+from .sharding import customers_by_national_code, shard_for_pk
+from .versioning import get_version
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with a per-entry time to live."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_cache = LRUCache(settings.TOKEN_CACHE_SIZE, settings.TOKEN_CACHE_TTL)
+
+
+def normalize_token(raw):
+    """Scanners may send Persian digits or surrounding whitespace."""
+    return str(raw or '').strip().translate(DIGIT_TRANSLATION)
+
+
+def _customer_for_id(customer_id):
+    alias = shard_for_pk(customer_id)
+    if alias is None:
+        return None
+    return Customer.objects.using(alias).filter(pk=customer_id).first()
+
+
+def resolve_token(raw):
+    """
+    Customer for a scanned token, or None. A 10-digit national code is also
+    accepted so customers without a card can be served at the same till.
+    """
+    token = normalize_token(raw)
+    if not token:
+        return None
+
+    version = get_version('customer_tokens')
+    cached = _cache.get(token)
+    if cached is not None:
+        customer_id, cached_version = cached
+        # An entry cached before any token was revoked is looked up again
+        customer = _customer_for_id(customer_id) if cached_version == version else None
+        if customer is not None:
+            return customer
+        # Revoked, or the customer was moved or merged since this entry was cached
+        _cache.pop(token)
+
+    customer_id = (CustomerToken.objects.filter(token=token, is_active=True)
+                   .values_list('customer_id', flat=True).first())
+    if customer_id is not None:
+        customer = _customer_for_id(customer_id)
+    else:
+        national_code = Customer.normalize_national_code(token)
+        if national_code != token or not Customer.is_valid_national_code(national_code):
+            return None
+        customer = customers_by_national_code(national_code).first()
+    if customer is not None:
+        _cache.set(token, (customer.pk, version))
+    return customer
+
+
+def issue_token(customer, kind='card'):
+    """Create a new active token for a customer."""
+    while True:
+        if kind == 'card':
+            # 16 digits, so it fits a standard card and is typeable on a keypad
+            token = str(secrets.randbelow(9 * 10 ** 15) + 10 ** 15)
+        else:
+            token = f'CB-{secrets.token_urlsafe(12)}'
+        try:
+            with transaction.atomic():
+                return CustomerToken.objects.create(token=token, kind=kind, customer_id=customer.pk)
+        except IntegrityError:
+            continue
+
+
+def forget_token(token):
+    """Drop a token from this process's cache (after deactivating it)."""
+    _cache.pop(token)
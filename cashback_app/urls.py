@@ -13,6 +13,7 @@ urlpatterns = [
     
     # Dashboard
     path('', views.dashboard, name='dashboard'),
+    path('dashboard/stream/', views.dashboard_stream, name='dashboard_stream'),
     
     # Customer Management
     path('customers/', views.customer_list, name='customer_list'),
@@ -22,15 +23,26 @@ urlpatterns = [
     path('customers/<int:pk>/wallet-reduction/', views.wallet_reduction, name='wallet_reduction'),
     path('customers/search/', views.customer_search, name='customer_search'),
     path('customers/export/', views.customer_export_csv, name='customer_export_csv'),
+    path('customers/<int:pk>/tokens/', views.customer_issue_token, name='customer_issue_token'),
+    path('customers/<int:pk>/tokens/<int:token_id>/revoke/', views.customer_revoke_token, name='customer_revoke_token'),
     
     # Purchase Management
     path('purchases/create/', views.purchase_create, name='purchase_create'),
     path('purchases/create/<int:customer_id>/', views.purchase_create, name='purchase_create_for_customer'),
+    path('purchases/sync/', views.purchase_sync, name='purchase_sync'),
+    path('checkout/', views.checkout, name='checkout'),
+    path('sw.js', views.service_worker, name='service_worker'),
     
     # Admin URLs
     path('admin/operators/', views.operator_list, name='operator_list'),
     path('admin/operators/create/', views.operator_create, name='operator_create'),
-    path('admin/logs/', views.activity_logs, name='activity_logs'),
+    path('logs/', views.activity_logs, name='activity_logs'),
     path('report/', views.reports, name='reports'),
     path('report/export/', views.report_export_csv, name='report_export_csv'),
+    path('report/refresh/', views.report_refresh, name='report_refresh'),
+
+    # Background Jobs
+    path('jobs/<int:pk>/', views.job_detail, name='job_detail'),
+    path('jobs/<int:pk>/status/', views.job_status, name='job_status'),
+    path('jobs/<int:pk>/download/', views.job_download, name='job_download'),
 ]
\ No newline at end of file
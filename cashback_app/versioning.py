@@ -0,0 +1,51 @@
+"""
+Version stamps that cache keys embed, so a change invalidates by moving a stamp.
+
+A lost stamp is re-seeded from the clock, which invalidates everything keyed
+on it. That is cheap for a customer's stamp, and there is one per customer,
+so those share the 'default' cache and its culling. The few global stamps
+('stats', 'segments', 'customer_tokens', 'purchase_store:<alias>') guard
+expensive rebuilds such as the analytics store, so they live in the
+'versions' cache, which never culls them.
+"""
+import time
+
+from django.core.cache import caches
+from django.db import transaction
+
+
+def _key(scope):
+    return f'version:{scope}'
+
+
+def _cache(scope):
+    return caches['default' if scope.startswith('customer:') else 'versions']
+
+
+def get_version(scope):
+    """Return the current version stamp for a scope such as 'stats' or 'customer:42'."""
+    key = _key(scope)
+    cache = _cache(scope)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a cleared cache never hands out an old stamp
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(scope):
+    """Invalidate everything keyed on a scope by moving its stamp forward."""
+    key = _key(scope)
+    cache = _cache(scope)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, None)
+        return version
+
+
+def bump_version_on_commit(scope, using='default'):
+    """Bump a scope once the current transaction on ``using`` commits, or now outside of one."""
+    transaction.on_commit(lambda: bump_version(scope), using=using)
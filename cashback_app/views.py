@@ -1,13 +1,31 @@
+import json
+
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
-from django.db.models import Q, Sum
+from django.db.models import F, Q, Sum
 from django.contrib.auth.models import User
-from .models import Customer, Purchase, ActivityLog, UserProfile
-from .forms import CustomerForm, PurchaseForm, WalletReductionForm
-from django.http import HttpResponse
+from django.db import IntegrityError, OperationalError, transaction
+from .models import ChangeEvent, Customer, CustomerSegment, Purchase, ActivityLog, UserProfile, Job, CashbackLot, CustomerToken, Notification, PurchaseSummary, SegmentationRun, branch_id_of
+from .forms import CheckoutForm, CustomerForm, PurchaseForm, WalletReductionForm
+from .archive import lifetime_totals
+from .branches import branch_totals, scoped
+from .jobs import enqueue, result_path
+from . import live
+from .snapshots import build_snapshot, for_branch, load_latest
+from .tokens import forget_token, issue_token, resolve_token
+from .till_sync import apply_batch
+from .sharding import customers_by_national_code, get_customer_or_404, move_customer, scatter, shard_for_national_code, shard_for_pk
+from .conditional import conditional_page, page_etag
+from .versioning import bump_version, get_version
+from django.http import FileResponse, Http404, JsonResponse, StreamingHttpResponse
 from django.core.exceptions import ValidationError
-import csv
+from django.core.paginator import Paginator
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject, cached_property
+from django.views.decorators.http import require_POST
 from .auth import OperatorCreationForm
 
 def normalize_phone(phone):
@@ -26,70 +44,128 @@ def is_admin(user):
     except:
         return False
 
+class DashboardStats:
+    """
+    Totals computed on first access, so a cached stats fragment skips the
+    queries. A branch's totals are read from its counters (see branches.py).
+    """
+
+    def __init__(self, branch_id=None):
+        self.branch_id = branch_id
+
+    @cached_property
+    def branch_totals(self):
+        return branch_totals(self.branch_id)
+
+    @cached_property
+    def total_customers(self):
+        if self.branch_id is not None:
+            return self.branch_totals['customers']
+        return sum(scatter(lambda alias: Customer.objects.using(alias).count()))
+
+    @cached_property
+    def total_purchases(self):
+        if self.branch_id is not None:
+            return self.branch_totals['purchases']
+        return sum(scatter(lambda alias: (
+            Purchase.objects.using(alias).count() +
+            (PurchaseSummary.objects.using(alias).aggregate(Sum('purchase_count'))['purchase_count__sum'] or 0)
+        )))
+
+    @cached_property
+    def total_cashback(self):
+        if self.branch_id is not None:
+            return self.branch_totals['cashback']
+        return sum(scatter(lambda alias: (
+            (Purchase.objects.using(alias).aggregate(Sum('cashback_amount'))['cashback_amount__sum'] or 0) +
+            (PurchaseSummary.objects.using(alias).aggregate(Sum('total_cashback'))['total_cashback__sum'] or 0)
+        )))
+
+def _dashboard_etag(request):
+    branch_id = branch_id_of(request.user)
+    latest_activity = scoped(ActivityLog.objects, branch_id).order_by('-pk').values_list('pk', flat=True).first()
+    return page_etag(request, 'dashboard', branch_id, get_version('stats'), latest_activity)
+
 @login_required
+@conditional_page(_dashboard_etag)
 def dashboard(request):
     """Dashboard view for both operators and admins"""
-    # Get statistics
-    total_customers = Customer.objects.count()
-    total_purchases = Purchase.objects.count()
-    total_cashback = Purchase.objects.aggregate(Sum('cashback_amount'))['cashback_amount__sum'] or 0
-    
+    branch_id = branch_id_of(request.user)
     # Get recent activities
-    recent_activities = ActivityLog.objects.all()[:10]
+    recent_activities = scoped(ActivityLog.objects, branch_id).select_related('user')[:10]
     
     context = {
-        'total_customers': total_customers,
-        'total_purchases': total_purchases,
-        'total_cashback': total_cashback,
+        'stats': DashboardStats(branch_id),
         'recent_activities': recent_activities,
     }
-    
-    # Log activity
-    ActivityLog.objects.create(
-        user=request.user,
-        activity_type='user_login',
-        description=f"کاربر {request.user.username} وارد داشبورد شد",
-        ip_address=request.META.get('REMOTE_ADDR')
-    )
-    
+
     return render(request, 'dashboard.html', context)
 
+@login_required
+def dashboard_stream(request):
+    """Server-Sent Events with live dashboard totals and new activities (see live.py)"""
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    response = StreamingHttpResponse(live.stream(last_event_id, branch_id_of(request.user)),
+                                     content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Proxies such as nginx would otherwise hold events back in their buffers
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 # Customer Management Views
+def _customer_list_etag(request):
+    return page_etag(request, 'customers', branch_id_of(request.user), get_version('stats'), get_version('segments'),
+                     request.GET.urlencode())
+
+def _segment_filter(request):
+    """The RFM segment chosen in the query string, or '' for all customers"""
+    segment = request.GET.get('segment', '')
+    return segment if segment in dict(CustomerSegment.SEGMENTS) else ''
+
 @login_required
+@conditional_page(_customer_list_etag)
 def customer_list(request):
     """List all customers"""
     # Support sorting by wallet balance
     sort = request.GET.get('sort')
     direction = request.GET.get('dir', 'desc')
 
-    customers_qs = Customer.objects.all()
+    # Users live on 'default', so they are prefetched rather than joined
+    customers_qs = scoped(Customer.objects, branch_id_of(request.user)).prefetch_related('created_by')
+    segment = _segment_filter(request)
+    if segment:
+        # Served by the segment index, see segments.py
+        customers_qs = customers_qs.filter(segment__segment=segment)
 
     if sort == 'wallet':
         order_field = 'wallet_balance' if direction == 'asc' else '-wallet_balance'
         customers_qs = customers_qs.order_by(order_field)
 
+    customers = [customer for shard in scatter(lambda alias: list(customers_qs.using(alias))) for customer in shard]
+    if sort == 'wallet':
+        customers.sort(key=lambda customer: customer.wallet_balance, reverse=direction != 'asc')
+
     context = {
-        'customers': customers_qs,
+        'customers': customers,
         'current_sort': sort or '',
         'current_dir': direction,
+        'segments': CustomerSegment.SEGMENTS,
+        'current_segment': segment,
+        'segmentation_run': SegmentationRun.objects.filter(finished_at__isnull=False).first(),
     }
     return render(request, 'customers/list.html', context)
 
 @login_required
 def customer_export_csv(request):
-    """Export customers to CSV"""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="customers.csv"'
-
-    writer = csv.writer(response)
-    writer.writerow(['ID', 'First Name', 'Last Name', 'National Code', 'Phone', 'Created At'])
-
-    customers = Customer.objects.all().values_list('id', 'first_name', 'last_name', 'national_code', 'phone_number', 'created_at')
-
-    for customer in customers:
-        writer.writerow(customer)
-
-    return response
+    """Queue a CSV export of all customers (of the user's branch, of one segment)"""
+    job = enqueue('customer_export', payload={
+        'branch_id': branch_id_of(request.user),
+        'segment': _segment_filter(request),
+    }, user=request.user)
+    return redirect('job_detail', pk=job.pk)
 
 @login_required
 def customer_create(request):
@@ -126,12 +202,15 @@ def customer_create(request):
 @login_required
 def customer_edit(request, pk):
     """Edit an existing customer"""
-    customer = get_object_or_404(Customer, pk=pk)
+    customer = get_customer_or_404(pk)
     
     if request.method == 'POST':
         form = CustomerForm(request.POST, instance=customer)
         if form.is_valid():
-            customer = form.save()
+            customer = form.save(commit=False)
+            # A new national code may belong on another shard
+            customer = move_customer(customer, shard_for_national_code(customer.national_code))
+            customer.save()
             
             # Log activity
             ActivityLog.log_activity(
@@ -149,43 +228,83 @@ def customer_edit(request, pk):
     
     return render(request, 'customers/form.html', {'form': form, 'title': 'ویرایش اطلاعات مشتری'})
 
+def _customer_detail_etag(request, pk):
+    alias = shard_for_pk(pk)
+    updated_at = alias and Customer.objects.using(alias).filter(pk=pk).values_list('updated_at', flat=True).first()
+    if not updated_at:
+        return None
+    # The date is included because upcoming expiries drop off as days pass
+    return page_etag(request, 'customer', pk, updated_at.timestamp(), get_version(f'customer:{pk}'),
+                     timezone.localdate())
+
 @login_required
+@conditional_page(_customer_detail_etag)
 def customer_detail(request, pk):
     """View customer details and purchase history"""
-    customer = get_object_or_404(Customer, pk=pk)
-    purchases = customer.purchases.all()
+    customer = get_customer_or_404(pk)
+    purchases = customer.purchases.prefetch_related('created_by')
+    # Served by the (customer, expires_at) index
+    upcoming_expiries = customer.cashback_lots.filter(
+        expires_at__gt=timezone.now(), remaining__gt=0
+    ).order_by('expires_at')[:5]
     
     return render(request, 'customers/detail.html', {
         'customer': customer,
-        'purchases': purchases
+        'purchases': purchases,
+        'archived_months': customer.purchase_summaries.all(),
+        # Only computed when the cached purchases fragment is rebuilt
+        'lifetime': SimpleLazyObject(lambda: lifetime_totals(customer)),
+        'upcoming_expiries': upcoming_expiries,
+        'tokens': CustomerToken.objects.filter(customer_id=customer.pk, is_active=True),
     })
 
 @login_required
 def wallet_reduction(request, pk):
     """Reduce customer wallet balance"""
-    customer = get_object_or_404(Customer, pk=pk)
+    customer = get_customer_or_404(pk)
     
     if request.method == 'POST':
         form = WalletReductionForm(request.POST, customer=customer)
         if form.is_valid():
             amount = form.cleaned_data['amount']
             reason = form.cleaned_data['reason']
+            alias = customer._state.db
             
-            # Reduce wallet balance
-            customer.wallet_balance -= amount
-            customer.save()
-            
-            # Log activity
-            ActivityLog.log_activity(
-                user=request.user,
-                activity_type='wallet_reduction',
-                description=f"کسر از کیف پول: {amount:,} ریال از کیف پول {customer.first_name} {customer.last_name} کسر شد. دلیل: {reason}",
-                customer=customer,
-                ip_address=request.META.get('REMOTE_ADDR')
-            )
+            # Reduce wallet balance and keep a structured record for auditing;
+            # the activity log commits or rolls back with the debit it describes
+            with transaction.atomic(using=alias), transaction.atomic(using='default'):
+                # The balance is checked again by the UPDATE itself, under the
+                # row's write lock: purchases, expiry sweeps and other tills may
+                # have changed it since the form saw it
+                reduced = Customer.objects.using(alias).filter(pk=customer.pk, wallet_balance__gte=amount).update(
+                    wallet_balance=F('wallet_balance') - amount, updated_at=timezone.now()
+                )
+                customer.refresh_from_db()
+                if reduced:
+                    ChangeEvent.record_rows(Customer, alias, [customer.pk])
+                    log = ActivityLog.log_activity(
+                        user=request.user,
+                        activity_type='wallet_reduction',
+                        description=f"کسر از کیف پول: {amount:,} ریال از کیف پول {customer.first_name} {customer.last_name} کسر شد. دلیل: {reason}",
+                        customer=customer,
+                        ip_address=request.META.get('REMOTE_ADDR')
+                    )
+                    CashbackLot.consume(customer, amount)
+                    debit = customer.debits.create(
+                        amount=amount,
+                        reason=reason,
+                        activity_log_id=log.pk,
+                        created_by=request.user,
+                    )
+                    Notification.wallet_debit(debit)
+                    # The UPDATE sends no signals
+                    transaction.on_commit(lambda: bump_version('stats'), using=alias)
+                    transaction.on_commit(lambda: bump_version(f'customer:{pk}'), using=alias)
             
-            messages.success(request, f"مبلغ {amount:,} ریال از کیف پول مشتری کسر شد")
-            return redirect('customer_detail', pk=customer.pk)
+            if reduced:
+                messages.success(request, f"مبلغ {amount:,} ریال از کیف پول مشتری کسر شد")
+                return redirect('customer_detail', pk=customer.pk)
+            form.add_error('amount', f'مبلغ کسر نمی‌تواند بیشتر از موجودی کیف پول ({customer.wallet_balance:,} ریال) باشد.')
     else:
         form = WalletReductionForm(customer=customer)
     
@@ -206,12 +325,11 @@ def customer_search(request):
     if national_code:
         # Normalize Persian/Arabic digits and strip non-digit characters
         national_code_normalized = Customer.normalize_national_code(national_code)
-        try:
-            customer = Customer.objects.get(national_code=national_code_normalized)
+        customer = customers_by_national_code(national_code_normalized).first()
+        if customer is not None:
             return redirect('customer_detail', pk=customer.pk)
-        except Customer.DoesNotExist:
-            messages.error(request, "مشتری با این کد ملی یافت نشد")
-            customers = Customer.objects.none()
+        messages.error(request, "مشتری با این کد ملی یافت نشد")
+        customers = []
     else:
         queries = Q()
         if name:
@@ -223,19 +341,40 @@ def customer_search(request):
             queries |= Q(phone_number__icontains=phone_normalized)
         
         if queries:
-            customers = Customer.objects.filter(queries)
+            # Only the exact national code lookup above reaches other branches' customers
+            customers_qs = scoped(Customer.objects, branch_id_of(request.user)).filter(queries)
+            customers = [
+                customer
+                for shard in scatter(lambda alias: list(customers_qs.using(alias)))
+                for customer in shard
+            ]
         else:
-            customers = Customer.objects.none()
+            customers = []
     
     return render(request, 'customers/search.html', {'customers': customers})
 
 # Purchase Management Views
+def _record_purchase(request, purchase):
+    """Save a new purchase by the current operator, log it and report the cashback"""
+    purchase.created_by = request.user
+    purchase.save()
+
+    # Log activity
+    ActivityLog.objects.create(
+        user=request.user,
+        activity_type='purchase_create',
+        description=f"خرید جدید ثبت شد برای مشتری: {purchase.customer.first_name} {purchase.customer.last_name} به مبلغ {int(purchase.amount):,} ریال",
+        ip_address=request.META.get('REMOTE_ADDR')
+    )
+
+    messages.success(request, f"خرید با موفقیت ثبت شد. مبلغ {int(purchase.cashback_amount):,} ریال به کیف پول مشتری اضافه شد")
+
 @login_required
 def purchase_create(request, customer_id=None):
     """Create a new purchase for a customer"""
     customer = None
     if customer_id:
-        customer = get_object_or_404(Customer, pk=customer_id)
+        customer = get_customer_or_404(customer_id)
     
     if request.method == 'POST':
         data = request.POST.copy()
@@ -246,18 +385,7 @@ def purchase_create(request, customer_id=None):
             purchase = form.save(commit=False)
             if customer:
                 purchase.customer = customer
-            purchase.created_by = request.user
-            purchase.save()
-            
-            # Log activity
-            ActivityLog.objects.create(
-                user=request.user,
-                activity_type='purchase_create',
-                description=f"خرید جدید ثبت شد برای مشتری: {purchase.customer.first_name} {purchase.customer.last_name} به مبلغ {int(purchase.amount):,} ریال",
-                ip_address=request.META.get('REMOTE_ADDR')
-            )
-            
-            messages.success(request, f"خرید با موفقیت ثبت شد. مبلغ {int(purchase.cashback_amount):,} ریال به کیف پول مشتری اضافه شد")
+            _record_purchase(request, purchase)
             return redirect('customer_detail', pk=purchase.customer.pk)
         # If invalid, the form with errors will be rendered below
     else:
@@ -272,6 +400,98 @@ def purchase_create(request, customer_id=None):
         'title': 'ثبت خرید جدید'
     })
 
+@login_required
+def checkout(request):
+    """Scan a card, QR code or national code and charge the purchase on one page"""
+    token = request.POST.get('token') or request.GET.get('token', '')
+    customer = resolve_token(token) if token else None
+    if token and customer is None:
+        messages.error(request, "کارت یا کد ملی اسکن شده معتبر نیست")
+
+    form = CheckoutForm(request.POST or None)
+    if request.method == 'POST' and customer is not None and form.is_valid():
+        client_id = form.cleaned_data['client_id']
+        # A form submitted again carries the same client id, which is unique
+        recorded = Purchase.objects.using(customer._state.db).filter(client_id=client_id).exists()
+        if not recorded:
+            try:
+                _record_purchase(request, Purchase(customer=customer, amount=form.cleaned_data['amount'],
+                                                   client_id=client_id))
+            except IntegrityError:
+                # The other submission was saved first
+                recorded = True
+        if recorded:
+            messages.info(request, "این خرید قبلاً ثبت شده است")
+        # Ready for the next customer; reloading the receipt does not post the sale again
+        return redirect(f"{reverse('checkout')}?last={customer.pk}")
+
+    # The receipt line shows the new balance of the customer just served
+    last = request.GET.get('last', '')
+    alias = shard_for_pk(last) if last.isdigit() else None
+    last_customer = Customer.objects.using(alias).filter(pk=last).first() if alias else None
+    return render(request, 'purchases/checkout.html', {
+        'form': form,
+        'customer': customer,
+        'token': token,
+        'last_customer': last_customer,
+    })
+
+@login_required
+@require_POST
+def purchase_sync(request):
+    """Record a batch of purchases a till queued offline; returns a result per purchase (see till_sync.py)"""
+    try:
+        items = json.loads(request.body)['purchases']
+    except (ValueError, KeyError, TypeError):
+        items = None
+    if not isinstance(items, list) or len(items) > settings.PURCHASE_SYNC_MAX_BATCH:
+        return JsonResponse({'error': 'دسته خریدها نامعتبر است'}, status=400)
+    try:
+        results = apply_batch(request.user, items, request.META.get('REMOTE_ADDR'))
+    except OperationalError:
+        # Nothing was recorded; the till keeps the batch and sends it again
+        return JsonResponse({'error': 'پایگاه داده مشغول است، دوباره تلاش کنید'}, status=503)
+    return JsonResponse({'results': results})
+
+def service_worker(request):
+    """The tills' service worker, served from the root so it can control every page"""
+    response = render(request, 'purchases/service_worker.js', {'batch_size': settings.PURCHASE_SYNC_MAX_BATCH},
+                      content_type='application/javascript')
+    # Browsers must see a new version as soon as it is deployed
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+@login_required
+@require_POST
+def customer_issue_token(request, pk):
+    """Issue a new loyalty card number or QR payload for a customer"""
+    customer = get_customer_or_404(pk)
+    kind = request.POST.get('kind', 'card')
+    if kind not in dict(CustomerToken.KINDS):
+        raise Http404
+    token = issue_token(customer, kind)
+    ActivityLog.log_activity(
+        user=request.user,
+        activity_type='customer_edit',
+        description=f"صدور {token.get_kind_display()} برای مشتری {customer.first_name} {customer.last_name}",
+        customer=customer,
+        ip_address=request.META.get('REMOTE_ADDR')
+    )
+    messages.success(request, f"{token.get_kind_display()} جدید صادر شد: {token.token}")
+    return redirect('customer_detail', pk=customer.pk)
+
+@login_required
+@require_POST
+def customer_revoke_token(request, pk, token_id):
+    """Deactivate a lost card"""
+    customer = get_customer_or_404(pk)
+    token = get_object_or_404(CustomerToken, pk=token_id, customer_id=customer.pk)
+    token.is_active = False
+    token.save(update_fields=['is_active'])
+    forget_token(token.token)
+    messages.success(request, f"{token.get_kind_display()} {token.token} غیرفعال شد")
+    return redirect('customer_detail', pk=customer.pk)
+
 # Admin Views
 @login_required
 @user_passes_test(is_admin)
@@ -308,68 +528,90 @@ def operator_create(request):
 @user_passes_test(is_admin)
 def activity_logs(request):
     """View all activity logs (admin only)"""
-    logs = ActivityLog.objects.all()
-    return render(request, 'admin/activity_logs.html', {'logs': logs})
+    logs = scoped(ActivityLog.objects, branch_id_of(request.user)).select_related('user')
+    page = Paginator(logs, 50).get_page(request.GET.get('page'))
+    return render(request, 'admin/activity_logs.html', {'logs': page, 'page': page})
+
+def _latest_report_snapshot(branch_id=None):
+    snapshot = load_latest()
+    if snapshot is None or for_branch(snapshot, branch_id) is None:
+        # Only the very first request ever (or for a new branch) builds a snapshot inline
+        build_snapshot()
+        snapshot = load_latest()
+    return for_branch(snapshot, branch_id)
+
+def _reports_etag(request):
+    snapshot = load_latest()
+    if snapshot is None:
+        return None
+    branch_id = branch_id_of(request.user)
+    return page_etag(request, 'reports', branch_id, snapshot['version'], is_admin(request.user))
 
 @login_required
+@conditional_page(_reports_etag)
 def reports(request):
-    """View system reports (for operators and admins)"""
-    # Get statistics
-    total_customers = Customer.objects.count()
-    total_purchases = Purchase.objects.count()
-    total_cashback = Purchase.objects.aggregate(Sum('cashback_amount'))['cashback_amount__sum'] or 0
-    
-    # Calculate average cashback
-    average_cashback = total_cashback / total_purchases if total_purchases > 0 else 0
-    
-    # Get top customers by purchase amount
-    top_customers = Customer.objects.annotate(
-        total_purchase=Sum('purchases__amount')
-    ).order_by('-total_purchase')[:10]
-    
-    context = {
-        'total_customers': total_customers,
-        'total_purchases': total_purchases,
-        'total_cashback': total_cashback,
-        'average_cashback': average_cashback,
-        'top_customers': top_customers,
-    }
-    
-    return render(request, 'admin/reports.html', context)
+    """View system reports (of the user's branch) from the latest precomputed snapshot"""
+    snapshot = _latest_report_snapshot(branch_id_of(request.user))
+    return render(request, 'admin/reports.html', {
+        'total_customers': snapshot['total_customers'],
+        'total_purchases': snapshot['total_purchases'],
+        'total_cashback': snapshot['total_cashback'],
+        'average_cashback': snapshot['average_cashback'],
+        'top_customers': snapshot['top_customers'],
+        'daily_totals': snapshot.get('daily_totals', []),
+        'purchase_amount_percentiles': snapshot.get('purchase_amount_percentiles', {}),
+        'customer_spend_percentiles': snapshot.get('customer_spend_percentiles', {}),
+        'as_of': snapshot['as_of'],
+        'is_admin': is_admin(request.user),
+    })
 
 @login_required
 def report_export_csv(request):
-    """Export reports data to CSV"""
-    # Get statistics
-    total_customers = Customer.objects.count()
-    total_purchases = Purchase.objects.count()
-    total_cashback = Purchase.objects.aggregate(Sum('cashback_amount'))['cashback_amount__sum'] or 0
-    average_cashback = total_cashback / total_purchases if total_purchases > 0 else 0
-    
-    # Get top customers by purchase amount
-    top_customers = Customer.objects.annotate(
-        total_purchase=Sum('purchases__amount')
-    ).order_by('-total_purchase')[:10]
-    
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="reports.csv"'
+    """Download the reports CSV from the latest snapshot"""
+    snapshot = _latest_report_snapshot(branch_id_of(request.user))
+    return FileResponse(open(snapshot['csv_path'], 'rb'), as_attachment=True,
+                        filename='reports.csv', content_type='text/csv')
 
-    writer = csv.writer(response)
-    
-    # Write statistics
-    writer.writerow(['گزارشات کلی'])
-    writer.writerow(['تعداد کل مشتریان', total_customers])
-    writer.writerow(['تعداد کل خریدها', total_purchases])
-    writer.writerow(['مجموع کشبک', total_cashback])
-    writer.writerow(['میانگین کشبک', f'{average_cashback:.2f}'])
-    writer.writerow([])  # Empty row
-    
-    # Write top customers
-    writer.writerow(['10 مشتری برتر بر اساس مبلغ خرید'])
-    writer.writerow(['نام مشتری', 'مبلغ کل خرید'])
-    for customer in top_customers:
-        name = f"{customer.first_name} {customer.last_name}"
-        total = customer.total_purchase or 0
-        writer.writerow([name, total])
+@login_required
+@user_passes_test(is_admin)
+@require_POST
+def report_refresh(request):
+    """Queue a rebuild of the reports snapshot (admin only)"""
+    enqueue('report_snapshot', user=request.user)
+    messages.success(request, "بروزرسانی گزارش‌ها در صف قرار گرفت و تا چند لحظه دیگر انجام می‌شود")
+    return redirect('reports')
 
-    return response
+# Background Job Views
+def _get_job_for_user(request, pk):
+    job = get_object_or_404(Job, pk=pk)
+    if job.created_by_id != request.user.pk and not is_admin(request.user):
+        raise Http404
+    return job
+
+@login_required
+def job_detail(request, pk):
+    """Show the progress of a background job"""
+    job = _get_job_for_user(request, pk)
+    return render(request, 'jobs/detail.html', {'job': job})
+
+@login_required
+def job_status(request, pk):
+    """Job progress as JSON, polled by the job detail page"""
+    job = _get_job_for_user(request, pk)
+    return JsonResponse({
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress': job.progress,
+        'message': job.progress_message,
+        'finished': job.is_finished,
+        'has_result': bool(job.result_file) and job.status == 'succeeded',
+    })
+
+@login_required
+def job_download(request, pk):
+    """Download the result file of a finished job"""
+    job = _get_job_for_user(request, pk)
+    path = result_path(job)
+    if job.status != 'succeeded' or path is None or not path.exists():
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=job.result_file)
@@ -8,7 +8,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-cashback-project-secret-key-123456789'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = os.environ.get('DJANGO_DEBUG', '1') == '1'
 
 ALLOWED_HOSTS = ['87.107.165.171', 'localhost', '127.0.0.1']
 
@@ -27,10 +27,16 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    # Compresses HTML, CSV and JSON; ETags set below it are made weak
+    'cashback_app.middleware.GZipMiddleware',
+    # Answers 304 for any page whose ETag/Last-Modified matches the request
+    'django.middleware.http.ConditionalGetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'cashback_app.middleware.LastSeenMiddleware',
+    'cashback_app.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -41,7 +47,6 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -49,6 +54,14 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # Compile each template once per process; runserver's autoreloader
+            # resets this cache whenever a template file changes.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
@@ -63,6 +76,145 @@ DATABASES = {
     }
 }
 
+# Runtime data (caches, generated files) lives outside the source tree
+VAR_DIR = Path(os.environ.get('CASHBACK_VAR_DIR', BASE_DIR / 'var'))
+
+# Caches
+# The file-based default is shared by every worker process on the host, which
+# keeps version stamps consistent; point it at Redis/Memcached in larger setups.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', str(VAR_DIR / 'cache' / 'default')),
+        'TIMEOUT': 3600,
+    },
+    # Used by the {% cache %} tag. Keys embed version stamps, so entries never
+    # go stale; they are simply replaced when the underlying rows change.
+    'template_fragments': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('DJANGO_FRAGMENT_CACHE_LOCATION', str(VAR_DIR / 'cache' / 'fragments')),
+        'TIMEOUT': 3600,
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+    # The global version stamps (see cashback_app/versioning.py). Only a
+    # handful of keys, but losing one forces a full rebuild of what it guards,
+    # e.g. the analytics store, so the limit is far above what culling needs.
+    'versions': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('DJANGO_VERSION_CACHE_LOCATION', str(VAR_DIR / 'cache' / 'versions')),
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 1_000_000},
+    },
+}
+
+# Sessions are read from the cache and only fall back to the database on a miss
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+
+# Minimum seconds between last-seen writes for one login session
+LAST_SEEN_INTERVAL = int(os.environ.get('LAST_SEEN_INTERVAL', '300'))
+
+# On-demand request profiles (see cashback_app/profiling.py); rules are
+# re-read every PROFILING_RULES_TTL seconds and only the newest
+# PROFILE_RING_SIZE profiles are kept
+PROFILING_RULES_TTL = 10
+PROFILE_DIR = VAR_DIR / 'profiles'
+PROFILE_RING_SIZE = 200
+PROFILE_SAMPLE_INTERVAL = 0.005
+
+# History of `manage.py benchmark_startup` runs, to track startup over time
+BENCHMARK_DIR = VAR_DIR / 'benchmarks'
+
+# Live dashboard over Server-Sent Events (see cashback_app/live.py). One
+# poller per process feeds every open dashboard; each stream holds a worker
+# thread while open, so at most LIVE_MAX_STREAMS run per process and the
+# server needs more threads than that (GUNICORN_THREADS in gunicorn.conf.py).
+LIVE_POLL_INTERVAL = 2
+LIVE_HEARTBEAT = 15
+# Events buffered per stream before a stalled client is told to reload
+LIVE_CLIENT_QUEUE = 100
+# Streams end after this long and the browser reconnects, freeing the thread
+LIVE_STREAM_MAX_SECONDS = 600
+LIVE_RETRY_MS = 3000
+LIVE_MAX_STREAMS = int(os.environ.get('LIVE_MAX_STREAMS', '4'))
+# Reconnect delay for a client turned away because every stream slot is taken
+LIVE_BUSY_RETRY_MS = 30000
+
+# Customer SMS notifications (see cashback_app/notifications.py and
+# `manage.py send_notifications`). Without a gateway URL messages are only logged.
+if os.environ.get('NOTIFICATION_URL'):
+    NOTIFICATION_PROVIDER = {
+        'BACKEND': 'cashback_app.notifications.HttpProvider',
+        'URL': os.environ['NOTIFICATION_URL'],
+        'API_KEY': os.environ.get('NOTIFICATION_API_KEY', ''),
+        'BATCH_SIZE': 50,
+        # Messages per second the gateway accepts (0 = unlimited)
+        'RATE_LIMIT': int(os.environ.get('NOTIFICATION_RATE_LIMIT', '0')),
+    }
+else:
+    NOTIFICATION_PROVIDER = {'BACKEND': 'cashback_app.notifications.ConsoleProvider'}
+NOTIFICATION_MAX_ATTEMPTS = 5
+NOTIFICATION_KEEP_DAYS = 30
+
+# Change feed for accounting and BI (see cashback_app/changefeed.py and
+# `manage.py relay_changes`). Each consumer has its own sink and offsets.
+if os.environ.get('CHANGE_FEED_URL'):
+    _change_feed_sink = {
+        'BACKEND': 'cashback_app.changefeed.HttpSink',
+        'URL': os.environ['CHANGE_FEED_URL'],
+        'API_KEY': os.environ.get('CHANGE_FEED_API_KEY', ''),
+    }
+else:
+    _change_feed_sink = {'BACKEND': 'cashback_app.changefeed.FileSink', 'DIRECTORY': VAR_DIR / 'change_feed'}
+CHANGE_FEED_CONSUMERS = {'accounting': _change_feed_sink}
+# Events younger than this wait for the next relay pass, so transactions
+# still committing are not skipped
+CHANGE_FEED_SETTLE_SECONDS = 2
+# Events every consumer received are deleted after this many days
+CHANGE_FEED_KEEP_DAYS = 7
+
+# Per-process LRU of scanned card/QR tokens (see cashback_app/tokens.py)
+TOKEN_CACHE_SIZE = 10000
+TOKEN_CACHE_TTL = 300
+
+# Background jobs (see cashback_app/jobs.py and `manage.py run_jobs`)
+JOB_RESULTS_DIR = VAR_DIR / 'jobs'
+
+# Customer files uploaded in the admin, kept until their import job finishes
+IMPORT_UPLOAD_DIR = VAR_DIR / 'imports'
+
+# Precomputed report snapshots (see `manage.py build_report_snapshot`)
+REPORT_SNAPSHOT_DIR = VAR_DIR / 'reports'
+REPORT_SNAPSHOT_KEEP = 10
+
+# Columnar copy of purchases for analytics (see cashback_app/columnar.py)
+PURCHASE_STORE_DIR = VAR_DIR / 'purchase_store'
+
+# Purchases a till may send in one sync of its offline queue (see
+# cashback_app/till_sync.py)
+PURCHASE_SYNC_MAX_BATCH = 100
+# Queued purchases older than this are refused instead of backdated
+PURCHASE_SYNC_MAX_AGE_DAYS = int(os.environ.get('PURCHASE_SYNC_MAX_AGE_DAYS', '7'))
+
+# Cashback credited by a purchase expires after this many days (0 = never)
+CASHBACK_EXPIRY_DAYS = int(os.environ.get('CASHBACK_EXPIRY_DAYS', '365'))
+
+# Purchases older than this many days are moved to the archive table by
+# `manage.py archive_purchases` (see cashback_app/archive.py)
+PURCHASE_ARCHIVE_DAYS = int(os.environ.get('PURCHASE_ARCHIVE_DAYS', '365'))
+
+# Customer sharding (see cashback_app/sharding.py). Customers and their
+# purchases are spread over CASHBACK_SHARDS databases by national code; the
+# extra shards are local SQLite files. Run `migrate --database <alias>` for each.
+CASHBACK_SHARDS = int(os.environ.get('CASHBACK_SHARDS', '1'))
+SHARD_DATABASES = ['default'] + [f'shard_{index}' for index in range(1, CASHBACK_SHARDS)]
+for _alias in SHARD_DATABASES[1:]:
+    DATABASES[_alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / f'db_{_alias}.sqlite3',
+    }
+DATABASE_ROUTERS = ['cashback_app.sharding.ShardRouter']
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -2,4 +2,10 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cashback_project.settings')
-application = get_wsgi_application()
\ No newline at end of file
+application = get_wsgi_application()
+
+# Under gunicorn's preload_app this runs once in the master, before the
+# workers are forked (see gunicorn.conf.py and cashback_app/startup.py)
+if os.environ.get('CASHBACK_WARMUP', '1') == '1':
+    from cashback_app.startup import warmup
+    warmup()
@@ -0,0 +1,24 @@
+# gunicorn settings: gunicorn -c gunicorn.conf.py cashback_project.wsgi
+# Check startup time and per-worker memory with `manage.py benchmark_startup`.
+import multiprocessing
+import os
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Threads also carry the live dashboard streams (see cashback_app/live.py).
+# Each open dashboard holds one thread for up to LIVE_STREAM_MAX_SECONDS, and
+# at most LIVE_MAX_STREAMS (default 4) per worker are accepted, so keep
+# threads above that: dashboards served at once = workers * LIVE_MAX_STREAMS.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+
+# Import and warm up the application once in the master; workers are forked
+# from it and share its memory copy-on-write instead of each loading Django
+preload_app = True
+
+# Recycle workers now and then so memory they dirtied goes back to the shared copy
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '5000'))
+max_requests_jitter = max_requests // 10
+
+timeout = 30
+graceful_timeout = 30
@@ -0,0 +1,76 @@
+// Live dashboard: totals and recent activities pushed over Server-Sent Events
+// by /dashboard/stream/ (see cashback_app/live.py)
+
+document.addEventListener('DOMContentLoaded', function() {
+  const list = document.getElementById('live-activities');
+  if (!list || typeof EventSource === 'undefined') {
+    return;
+  }
+  const limit = parseInt(list.dataset.limit, 10) || 10;
+  // The browser reconnects by itself and sends the last activity id it saw
+  const source = new EventSource(list.dataset.streamUrl);
+
+  source.addEventListener('stats', function(event) {
+    const data = JSON.parse(event.data);
+    Object.keys(data.values).forEach(function(name) {
+      const element = document.querySelector('[data-live-stat="' + name + '"]');
+      if (!element) {
+        return;
+      }
+      const value = data.values[name];
+      element.textContent = element.dataset.liveFormat === 'price' ? value.toLocaleString('en-US') : value;
+      if (data.deltas[name]) {
+        highlight(element.closest('.card'));
+      }
+    });
+  });
+
+  source.addEventListener('activity', function(event) {
+    const activity = JSON.parse(event.data);
+    const empty = list.querySelector('[data-live-empty]');
+    if (empty) {
+      empty.remove();
+    }
+    list.insertBefore(activityItem(activity), list.firstChild);
+    while (list.children.length > limit) {
+      list.removeChild(list.lastChild);
+    }
+  });
+
+  // Too many missed events to replay; start over from the server's page
+  source.addEventListener('reset', function() {
+    source.close();
+    window.location.reload();
+  });
+});
+
+function activityItem(activity) {
+  const item = document.createElement('li');
+  item.className = 'list-group-item';
+  const row = document.createElement('div');
+  row.className = 'd-flex justify-content-between';
+  const description = document.createElement('span');
+  description.textContent = activity.description;
+  const time = document.createElement('small');
+  time.className = 'text-muted';
+  time.textContent = activity.created_at;
+  row.appendChild(description);
+  row.appendChild(time);
+  const user = document.createElement('small');
+  user.className = 'text-muted';
+  user.textContent = activity.user;
+  item.appendChild(row);
+  item.appendChild(user);
+  highlight(item);
+  return item;
+}
+
+function highlight(element) {
+  if (!element) {
+    return;
+  }
+  element.classList.add('live-updated');
+  setTimeout(function() {
+    element.classList.remove('live-updated');
+  }, 1500);
+}
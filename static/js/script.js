@@ -5,6 +5,7 @@ document.addEventListener('DOMContentLoaded', function() {
   
   // Initialize any interactive elements
   initializeComponents();
+  initializeTillQueue();
 });
 
 function initializeComponents() {
@@ -17,4 +18,138 @@ function initializeComponents() {
       return new bootstrap.Tooltip(tooltipTriggerEl);
     });
   }
-}
\ No newline at end of file
+}
+
+// Offline purchase queue: the service worker (/sw.js) keeps the purchase form
+// usable without a connection and sends queued purchases (till_queue.js) in
+// batches once the link is back
+
+function tillQueueAvailable() {
+  return 'serviceWorker' in navigator && window.isSecureContext;
+}
+
+function initializeTillQueue() {
+  const workerUrl = document.body.dataset.serviceWorker;
+  if (!workerUrl || !tillQueueAvailable()) {
+    return;
+  }
+  navigator.serviceWorker.register(workerUrl).then(requestTillSync).catch(function(error) {
+    console.warn('Service worker registration failed', error);
+  });
+  window.addEventListener('online', requestTillSync);
+  initializePurchaseQueue();
+}
+
+function requestTillSync() {
+  navigator.serviceWorker.ready.then(function(registration) {
+    const token = document.querySelector('[name=csrfmiddlewaretoken]');
+    if (registration.active) {
+      registration.active.postMessage({type: 'till-queue-sync', csrfToken: token ? token.value : ''});
+    }
+    // Lets the browser retry by itself, even after the tab is closed
+    if (registration.sync) {
+      registration.sync.register('purchase-sync').catch(function() {});
+    }
+  });
+}
+
+function initializePurchaseQueue() {
+  const form = document.querySelector('form[data-till-queue]');
+  const panel = document.getElementById('till-queue');
+  if (!form || !panel || typeof TillQueue === 'undefined' || !TillQueue.supported) {
+    return;
+  }
+  panel.hidden = false;
+
+  form.addEventListener('submit', function(event) {
+    event.preventDefault();
+    const select = form.querySelector('[name=customer]');
+    const amountInput = form.querySelector('[name=amount]');
+    const option = select ? select.selectedOptions[0] : null;
+    TillQueue.add({
+      customer: parseInt(form.dataset.customerId || select.value, 10),
+      customer_name: form.dataset.customerName || (option ? option.text : ''),
+      amount: parseInt(amountInput.value, 10)
+    }).then(function() {
+      amountInput.value = '';
+      amountInput.dispatchEvent(new Event('input'));
+      amountInput.focus();
+      renderTillQueue(panel);
+      requestTillSync();
+    }).catch(function() {
+      // No IndexedDB (e.g. a private window): post the form as before
+      form.submit();
+    });
+  });
+
+  navigator.serviceWorker.addEventListener('message', function(event) {
+    if (event.data && event.data.type === 'till-queue-synced') {
+      renderTillQueue(panel, false);
+    } else if (event.data && event.data.type === 'till-queue-offline') {
+      renderTillQueue(panel, true);
+    }
+  });
+  renderTillQueue(panel, !navigator.onLine);
+}
+
+const TILL_QUEUE_STATUS = {
+  pending: ['در انتظار ارسال', 'bg-warning text-dark'],
+  synced: ['ثبت شد', 'bg-success'],
+  failed: ['رد شد', 'bg-danger']
+};
+
+function renderTillQueue(panel, offline) {
+  TillQueue.all().then(function(items) {
+    const waiting = items.filter(function(item) { return item.status === 'pending'; }).length;
+    const status = panel.querySelector('[data-till-queue-status]');
+    if (waiting) {
+      status.textContent = waiting + ' خرید در انتظار ارسال' + (offline ? ' (اتصال برقرار نیست)' : '');
+    } else {
+      status.textContent = 'همه خریدها ارسال شده‌اند';
+    }
+
+    const body = panel.querySelector('[data-till-queue-items]');
+    body.replaceChildren();
+    items.forEach(function(item) {
+      const row = document.createElement('tr');
+      [item.customer_name, item.amount.toLocaleString('en-US') + ' ریال'].forEach(function(text) {
+        const cell = document.createElement('td');
+        cell.textContent = text;
+        row.appendChild(cell);
+      });
+
+      const state = document.createElement('td');
+      const badge = document.createElement('span');
+      badge.className = 'badge ' + TILL_QUEUE_STATUS[item.status][1];
+      badge.textContent = TILL_QUEUE_STATUS[item.status][0];
+      state.appendChild(badge);
+      let note = '';
+      if (item.status === 'synced') {
+        note = 'کش‌بک ' + item.cashback_amount.toLocaleString('en-US') + ' ریال';
+      } else if (item.status === 'failed') {
+        note = (item.errors || []).join('، ');
+      }
+      if (note) {
+        const small = document.createElement('small');
+        small.className = 'text-muted ms-2';
+        small.textContent = note;
+        state.appendChild(small);
+      }
+      row.appendChild(state);
+
+      const actions = document.createElement('td');
+      if (item.status === 'failed') {
+        const button = document.createElement('button');
+        button.type = 'button';
+        button.className = 'btn btn-outline-danger btn-sm';
+        button.textContent = 'حذف';
+        button.addEventListener('click', function() {
+          TillQueue.remove(item.client_id).then(function() { renderTillQueue(panel, offline); });
+        });
+        actions.appendChild(button);
+      }
+      row.appendChild(actions);
+      body.appendChild(row);
+    });
+  });
+}
@@ -0,0 +1,172 @@
+// Offline purchase queue of a till, kept in IndexedDB so sales survive a
+// dropped link or a closed tab. Loaded by pages (script.js) and by the
+// service worker (/sw.js), which both send the queue to the server in batches
+// (see cashback_app/till_sync.py). Every purchase carries a random client id,
+// so sending a batch twice never records a sale twice, and the time it was
+// queued, which the server records as the time of the sale.
+
+(function(global) {
+  const DB_NAME = 'cashback-till';
+  const STORE = 'purchases';
+  const META = 'meta';
+  // Recorded purchases kept to show the operator what was sent
+  const KEEP_SYNCED = 20;
+
+  let opening = null;
+
+  function open() {
+    if (!opening) {
+      opening = new Promise(function(resolve, reject) {
+        const request = indexedDB.open(DB_NAME, 1);
+        request.onupgradeneeded = function() {
+          const store = request.result.createObjectStore(STORE, {keyPath: 'client_id'});
+          store.createIndex('status', 'status');
+          request.result.createObjectStore(META);
+        };
+        request.onsuccess = function() { resolve(request.result); };
+        request.onerror = function() { opening = null; reject(request.error); };
+      });
+    }
+    return opening;
+  }
+
+  // Run fn(store) in one transaction; resolves with what fn's request returned
+  function withStore(name, mode, fn) {
+    return open().then(function(db) {
+      return new Promise(function(resolve, reject) {
+        const tx = db.transaction(name, mode);
+        const request = fn(tx.objectStore(name));
+        tx.oncomplete = function() { resolve(request ? request.result : undefined); };
+        tx.onerror = function() { reject(tx.error); };
+        tx.onabort = function() { reject(tx.error); };
+      });
+    });
+  }
+
+  function newClientId() {
+    if (global.crypto && global.crypto.randomUUID) {
+      return global.crypto.randomUUID();
+    }
+    const bytes = global.crypto.getRandomValues(new Uint8Array(16));
+    return Array.from(bytes, function(b) { return b.toString(16).padStart(2, '0'); }).join('');
+  }
+
+  function add(purchase) {
+    const item = Object.assign({client_id: newClientId(), status: 'pending', queued_at: Date.now()}, purchase);
+    return withStore(STORE, 'readwrite', function(store) { return store.add(item); }).then(function() {
+      return item;
+    });
+  }
+
+  function all() {
+    return withStore(STORE, 'readonly', function(store) { return store.getAll(); }).then(function(items) {
+      return items.sort(function(a, b) { return b.queued_at - a.queued_at; });
+    });
+  }
+
+  function pending(limit) {
+    return withStore(STORE, 'readonly', function(store) {
+      return store.index('status').getAll('pending', limit);
+    }).then(function(items) {
+      return items.sort(function(a, b) { return a.queued_at - b.queued_at; });
+    });
+  }
+
+  function remove(clientId) {
+    return withStore(STORE, 'readwrite', function(store) { return store.delete(clientId); });
+  }
+
+  function getMeta(key) {
+    return withStore(META, 'readonly', function(store) { return store.get(key); });
+  }
+
+  function setMeta(key, value) {
+    return withStore(META, 'readwrite', function(store) { return store.put(value, key); });
+  }
+
+  // Store the server's answers and drop the oldest recorded purchases
+  function applyResults(results) {
+    return open().then(function(db) {
+      return new Promise(function(resolve, reject) {
+        const tx = db.transaction(STORE, 'readwrite');
+        const store = tx.objectStore(STORE);
+        results.forEach(function(result) {
+          const get = store.get(result.client_id);
+          get.onsuccess = function() {
+            const item = get.result;
+            if (!item) {
+              return;
+            }
+            if (result.status === 'invalid') {
+              item.status = 'failed';
+              item.errors = result.errors || [];
+            } else {
+              item.status = 'synced';
+              item.synced_at = Date.now();
+              item.cashback_amount = result.cashback_amount;
+            }
+            store.put(item);
+          };
+        });
+        const synced = store.index('status').getAll('synced');
+        synced.onsuccess = function() {
+          synced.result
+            .sort(function(a, b) { return b.synced_at - a.synced_at; })
+            .slice(KEEP_SYNCED)
+            .forEach(function(item) { store.delete(item.client_id); });
+        };
+        tx.oncomplete = function() { resolve(); };
+        tx.onerror = function() { reject(tx.error); };
+      });
+    });
+  }
+
+  let syncing = null;
+
+  // Send pending purchases in batches until none are left. Rejects when the
+  // server can't be reached or refuses the batch; the queue is kept as it is.
+  function sync(url, batchSize) {
+    if (syncing) {
+      return syncing;
+    }
+    let sent = 0;
+    function next() {
+      return Promise.all([pending(batchSize), getMeta('csrf_token')]).then(function(values) {
+        const batch = values[0];
+        if (!batch.length) {
+          return sent;
+        }
+        return fetch(url, {
+          method: 'POST',
+          credentials: 'same-origin',
+          redirect: 'manual',
+          headers: {'Content-Type': 'application/json', 'X-CSRFToken': values[1] || ''},
+          body: JSON.stringify({purchases: batch.map(function(item) {
+            return {client_id: item.client_id, customer: item.customer, amount: item.amount,
+                    queued_at: item.queued_at};
+          })})
+        }).then(function(response) {
+          // A redirect means the session ended; the operator has to log in again
+          if (!response.ok) {
+            throw new Error('sync failed: ' + (response.status || response.type));
+          }
+          return response.json();
+        }).then(function(data) {
+          sent += batch.length;
+          return applyResults(data.results).then(next);
+        });
+      });
+    }
+    syncing = next().finally(function() { syncing = null; });
+    return syncing;
+  }
+
+  global.TillQueue = {
+    add: add,
+    all: all,
+    remove: remove,
+    setMeta: setMeta,
+    sync: sync,
+    supported: typeof indexedDB !== 'undefined'
+  };
+})(self);
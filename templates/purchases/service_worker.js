@@ -0,0 +1,102 @@
+// Service worker of the tills, served by the service_worker view from /sw.js.
+// Keeps the purchase form and its assets available while the branch link is
+// down, and sends the offline purchase queue (till_queue.js) to the server
+// when the link is back: on Background Sync where the browser has it, and
+// whenever a page asks.
+
+importScripts('/static/js/till_queue.js');
+
+const CACHE = 'cashback-till-v2';
+const SYNC_URL = '{% url "purchase_sync" %}';
+const SYNC_TAG = 'purchase-sync';
+const BATCH_SIZE = {{ batch_size }};
+const FORM_URL = '{% url "purchase_create" %}';
+const ASSETS = [
+  FORM_URL,
+  '/static/css/style.css',
+  '/static/js/script.js',
+  '/static/js/till_queue.js',
+  '/static/js/wordifyfa.js',
+  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.rtl.min.css',
+  'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js'
+];
+
+self.addEventListener('install', function(event) {
+  event.waitUntil(caches.open(CACHE).then(function(cache) {
+    // One asset that can't be fetched must not keep the worker from installing
+    return Promise.all(ASSETS.map(function(url) {
+      return cache.add(url).catch(function() {});
+    }));
+  }).then(function() {
+    return self.skipWaiting();
+  }));
+});
+
+self.addEventListener('activate', function(event) {
+  event.waitUntil(caches.keys().then(function(names) {
+    return Promise.all(names.filter(function(name) { return name !== CACHE; }).map(function(name) {
+      return caches.delete(name);
+    }));
+  }).then(function() {
+    return self.clients.claim();
+  }));
+});
+
+function isCached(url) {
+  return url.pathname.startsWith(FORM_URL) || url.pathname.startsWith('/static/') || ASSETS.includes(url.href);
+}
+
+// Network first, so pages and assets are never older than they need to be;
+// the cached copy only answers when the network doesn't
+self.addEventListener('fetch', function(event) {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (request.method !== 'GET' || !isCached(url)) {
+    return;
+  }
+  event.respondWith(fetch(request).then(function(response) {
+    if (response.ok && !response.redirected) {
+      const copy = response.clone();
+      caches.open(CACHE).then(function(cache) { cache.put(request, copy); });
+    }
+    return response;
+  }).catch(function() {
+    return caches.match(request).then(function(cached) {
+      if (cached || request.mode !== 'navigate') {
+        return cached || Response.error();
+      }
+      // A customer's form that was never opened online falls back to the general one
+      return caches.match(FORM_URL).then(function(form) { return form || Response.error(); });
+    });
+  }));
+});
+
+function notifyPages(message) {
+  return self.clients.matchAll({type: 'window'}).then(function(pages) {
+    pages.forEach(function(page) { page.postMessage(message); });
+  });
+}
+
+function flush() {
+  return TillQueue.sync(SYNC_URL, BATCH_SIZE).then(function(sent) {
+    return notifyPages({type: 'till-queue-synced', sent: sent});
+  }, function(error) {
+    return notifyPages({type: 'till-queue-offline'}).then(function() { throw error; });
+  });
+}
+
+// Background Sync retries a rejected flush by itself, with backoff
+self.addEventListener('sync', function(event) {
+  if (event.tag === SYNC_TAG) {
+    event.waitUntil(flush());
+  }
+});
+
+self.addEventListener('message', function(event) {
+  if (!event.data || event.data.type !== 'till-queue-sync') {
+    return;
+  }
+  // Pages hand over their CSRF token; the worker can't read it by itself
+  const token = event.data.csrfToken ? TillQueue.setMeta('csrf_token', event.data.csrfToken) : Promise.resolve();
+  event.waitUntil(token.then(flush).catch(function() {}));
+});